@@ -0,0 +1,801 @@
+"""
+回测引擎：实现Template用到的engine接口，按1分钟k线逐根回放策略，撮合限价单和停止单。
+A股规则：只做多，卖出不超过可卖持仓(T+1时当天买入的不能卖)，成交量按手数取整。
+参数优化：run_optimization在进程池里对参数组合做回测，结果存到本地，重复运行时跳过。
+"""
+import hashlib
+import json
+import os
+import random
+import shutil
+import sqlite3
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import closing
+from datetime import date, datetime
+from itertools import product
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Type, Union
+
+import numpy as np
+import pandas as pd
+
+from trade.constant import (
+    Direction,
+    Offset,
+    Status,
+    OrderType,
+    EngineType,
+    StopOrderStatus,
+    STOPORDER_PREFIX,
+    EVENT_BACKTEST_LOG,
+    EVENT_BACKTEST_FINISHED,
+    EVENT_BACKTEST_OPTIMIZATION_FINISHED,
+)
+from trade.object import BarData, OrderData, TradeData, StopOrder
+from trade.template import Template
+from trade.utility import parse_vt_symbol, get_folder_path, BarStore
+
+
+class DailyResult:
+    """一个交易日的持仓、成交和盈亏"""
+
+    def __init__(self, date: date, close_price: float):
+        self.date = date
+        self.close_price = close_price
+        self.pre_close = 0.0
+
+        self.trades: List[TradeData] = []
+        self.trade_count = 0
+
+        self.start_pos = 0.0
+        self.end_pos = 0.0
+
+        self.turnover = 0.0
+        self.commission = 0.0
+        self.slippage = 0.0
+
+        self.trading_pnl = 0.0
+        self.holding_pnl = 0.0
+        self.total_pnl = 0.0
+        self.net_pnl = 0.0
+
+    def add_trade(self, trade: TradeData) -> None:
+        self.trades.append(trade)
+
+    def calculate_pnl(self, pre_close: float, start_pos: float, size: float, rate: float, slippage: float) -> None:
+        # 第一天没有昨收，用当天收盘价，持仓盈亏为0
+        self.pre_close = pre_close or self.close_price
+        self.start_pos = start_pos
+        self.end_pos = start_pos
+        self.holding_pnl = self.start_pos * (self.close_price - self.pre_close) * size
+
+        self.trade_count = len(self.trades)
+        for trade in self.trades:
+            if trade.direction == Direction.LONG:
+                pos_change = trade.volume
+            else:
+                pos_change = -trade.volume
+            self.end_pos += pos_change
+            turnover = trade.volume * size * trade.price
+            self.trading_pnl += pos_change * (self.close_price - trade.price) * size
+            self.slippage += trade.volume * size * slippage
+            self.turnover += turnover
+            self.commission += turnover * rate
+
+        self.total_pnl = self.trading_pnl + self.holding_pnl
+        self.net_pnl = self.total_pnl - self.commission - self.slippage
+
+
+class BacktestingEngine:
+    """
+    For:
+    1. replaying 1-minute BarData into one strategy, the strategy's engine is this object
+    2. matching limit orders and stop orders against the next bar, like vnpy's CTA backtester
+    3. daily pnl, drawdown, and per buy/sell point type (B1/B2/B3/S1/S2/S3) statistics
+
+    Notice:
+    1. long only: a sell is cut to the sellable position not already pending, and dropped when nothing is left
+    2. with t_plus_one, volume bought on a day can only be sold from the next day
+    3. the run loop only touches order dicts when there are active orders, most bars cost one strategy.on_bar
+    """
+
+    engine_type = EngineType.BACKTEST
+
+    def __init__(self, event_engine=None):
+        self.event_engine = event_engine
+
+        self.vt_symbol = ''
+        self.symbol = ''
+        self.exchange = None
+        self.rate = 0.0003
+        self.slippage = 0.0
+        self.size = 1
+        self.pricetick = 0.01
+        self.lot = 100
+        self.capital = 1000000
+        self.t_plus_one = True
+        self.warmup_days = 0
+
+        self.strategy: Optional[Template] = None
+        self.bar: Optional[BarData] = None
+        self.datetime: Optional[datetime] = None
+        self.history_data: List[BarData] = []
+
+        self.stop_order_count = 0
+        self.stop_orders: Dict[str, StopOrder] = {}
+        self.active_stop_orders: Dict[str, StopOrder] = {}
+
+        self.limit_order_count = 0
+        self.limit_orders: Dict[str, OrderData] = {}
+        self.active_limit_orders: Dict[str, OrderData] = {}
+
+        self.trade_count = 0
+        self.trades: Dict[str, TradeData] = {}
+
+        # 委托对应的买卖点类型
+        self.order_signal: Dict[str, str] = {}
+        self.trade_signal: Dict[str, str] = {}
+
+        self.pos = 0
+        self.today_bought = 0
+        self.daily_result: Optional[DailyResult] = None
+        self.daily_results: Dict[date, DailyResult] = {}
+        self.daily_df: Optional[pd.DataFrame] = None
+        self.logs: List[str] = []
+
+    def clear_data(self) -> None:
+        """清除上一次回测的状态，保留参数"""
+        self.strategy = None
+        self.bar = None
+        self.datetime = None
+        self.stop_order_count = 0
+        self.stop_orders.clear()
+        self.active_stop_orders.clear()
+        self.limit_order_count = 0
+        self.limit_orders.clear()
+        self.active_limit_orders.clear()
+        self.trade_count = 0
+        self.trades.clear()
+        self.order_signal.clear()
+        self.trade_signal.clear()
+        self.pos = 0
+        self.today_bought = 0
+        self.daily_result = None
+        self.daily_results.clear()
+        self.daily_df = None
+        self.logs.clear()
+
+    def set_parameters(self, vt_symbol: str, rate: float = 0.0003, slippage: float = 0.0, size: float = 1,
+                       pricetick: float = 0.01, lot: int = 100, capital: float = 1000000, t_plus_one: bool = True,
+                       warmup_days: int = 0) -> None:
+        self.vt_symbol = vt_symbol
+        # 缠图和扫描用不带交易所的代码，同parse_vt_symbol：6开头为上交所，其余为深交所
+        self.symbol, self.exchange = parse_vt_symbol(vt_symbol)
+        self.rate = rate
+        self.slippage = slippage
+        self.size = size
+        self.pricetick = pricetick
+        self.lot = lot
+        self.capital = capital
+        self.t_plus_one = t_plus_one
+        self.warmup_days = warmup_days
+
+    def add_strategy(self, strategy_class: Type[Template], setting: dict, strategy_name: str = 'backtest') -> None:
+        self.strategy = strategy_class(self, strategy_name, self.vt_symbol, setting)
+        # 缠论策略只在jb级别下单，jb不是任何级别时整个回测不会有成交
+        chan_freq_map = getattr(self.strategy, 'chan_freq_map', None)
+        jb = getattr(self.strategy, 'jb', None)
+        if chan_freq_map is not None and jb not in chan_freq_map:
+            raise ValueError('操作级别jb=%r不在%s中，回测不会下单' % (jb, list(chan_freq_map)))
+
+    def set_data(self, bars: Iterable[BarData]) -> None:
+        """回测用的1分钟k线，按时间排序"""
+        self.history_data = list(bars)
+
+    def run_backtesting(self) -> None:
+        strategy = self.strategy
+        on_bar = strategy.on_bar
+        strategy.on_start()
+
+        # 预热：只计算不交易
+        warmup_dates = set()
+        trading = False
+        for bar in self.history_data:
+            if not trading:
+                warmup_dates.add(bar.datetime.date())
+                if len(warmup_dates) > self.warmup_days:
+                    trading = True
+                    strategy.trading = True
+                    self.write_log('开始回测：%s' % bar.datetime)
+            self.new_bar(bar, on_bar)
+
+        strategy.trading = False
+        strategy.on_stop()
+        self.write_log('回测结束')
+        self.put_event(EVENT_BACKTEST_FINISHED, None)
+
+    def new_bar(self, bar: BarData, on_bar: Callable = None) -> None:
+        daily_result = self.daily_result
+        if daily_result is None or bar.datetime.date() != daily_result.date:
+            # 新的交易日
+            self.today_bought = 0
+            daily_result = self.daily_result = DailyResult(bar.datetime.date(), bar.close_price)
+            self.daily_results[daily_result.date] = daily_result
+        self.bar = bar
+        self.datetime = bar.datetime
+
+        if self.active_limit_orders:
+            self.cross_limit_order()
+        if self.active_stop_orders:
+            self.cross_stop_order()
+        (on_bar or self.strategy.on_bar)(bar)
+
+        daily_result.close_price = bar.close_price
+
+    def get_sellable(self) -> float:
+        if self.t_plus_one:
+            return self.pos - self.today_bought
+        return self.pos
+
+    def get_pending_sell(self) -> float:
+        volume = 0
+        for order in self.active_limit_orders.values():
+            if order.direction == Direction.SHORT:
+                volume += order.volume
+        for stop_order in self.active_stop_orders.values():
+            if stop_order.direction == Direction.SHORT:
+                volume += stop_order.volume
+        return volume
+
+    def cross_limit_order(self) -> None:
+        """上一根k线提交的限价单在这根k线撮合，成交价取委托价和开盘价中对自己有利的"""
+        bar = self.bar
+        long_cross_price = bar.low_price
+        short_cross_price = bar.high_price
+        long_best_price = bar.open_price
+        short_best_price = bar.open_price
+
+        for order in list(self.active_limit_orders.values()):
+            if order.status == Status.SUBMITTING:
+                order.status = Status.NOTTRADED
+                self.strategy.on_order(order)
+
+            if order.direction == Direction.LONG:
+                if order.price < long_cross_price or long_cross_price <= 0:
+                    continue
+                price = min(order.price, long_best_price)
+                volume = order.volume
+            else:
+                if order.price > short_cross_price or short_cross_price <= 0:
+                    continue
+                price = max(order.price, short_best_price)
+                volume = min(order.volume, self.get_sellable())
+                if volume <= 0:
+                    # 持仓已经没有了
+                    order.status = Status.REJECTED
+                    self.active_limit_orders.pop(order.vt_orderid)
+                    self.strategy.on_order(order)
+                    continue
+
+            order.traded = volume
+            order.status = Status.ALLTRADED
+            self.active_limit_orders.pop(order.vt_orderid)
+            self.strategy.on_order(order)
+            self.on_fill(order, price, volume)
+
+    def cross_stop_order(self) -> None:
+        """停止单：最高价(最低价)触及停止价时以停止价和开盘价中较差的成交"""
+        bar = self.bar
+        for stop_order in list(self.active_stop_orders.values()):
+            if stop_order.direction == Direction.LONG:
+                if bar.high_price < stop_order.price:
+                    continue
+                price = max(stop_order.price, bar.open_price)
+                volume = stop_order.volume
+            else:
+                if bar.low_price > stop_order.price:
+                    continue
+                price = min(stop_order.price, bar.open_price)
+                volume = min(stop_order.volume, self.get_sellable())
+                if volume <= 0:
+                    stop_order.status = StopOrderStatus.CANCELLED
+                    self.active_stop_orders.pop(stop_order.stop_orderid)
+                    self.strategy.on_stop_order(stop_order)
+                    continue
+
+            self.limit_order_count += 1
+            order = OrderData(
+                symbol=self.symbol,
+                exchange=self.exchange,
+                orderid=str(self.limit_order_count),
+                type=OrderType.STOP,
+                direction=stop_order.direction,
+                offset=stop_order.offset,
+                price=stop_order.price,
+                volume=volume,
+                traded=volume,
+                status=Status.ALLTRADED,
+                datetime=self.datetime
+            )
+            self.limit_orders[order.vt_orderid] = order
+            signal = self.order_signal.get(stop_order.stop_orderid)
+            if signal:
+                self.order_signal[order.vt_orderid] = signal
+
+            stop_order.vt_orderids.append(order.vt_orderid)
+            stop_order.status = StopOrderStatus.TRIGGERED
+            self.active_stop_orders.pop(stop_order.stop_orderid)
+            self.strategy.on_stop_order(stop_order)
+            self.strategy.on_order(order)
+            self.on_fill(order, price, volume)
+
+    def on_fill(self, order: OrderData, price: float, volume: float) -> None:
+        self.trade_count += 1
+        trade = TradeData(
+            symbol=order.symbol,
+            exchange=order.exchange,
+            orderid=order.orderid,
+            tradeid=str(self.trade_count),
+            direction=order.direction,
+            offset=order.offset,
+            price=price,
+            volume=volume,
+            datetime=self.datetime
+        )
+        if trade.direction == Direction.LONG:
+            self.pos += volume
+            self.today_bought += volume
+        else:
+            self.pos -= volume
+        self.strategy.pos = self.pos
+        signal = self.order_signal.get(order.vt_orderid)
+        if signal:
+            self.trade_signal[trade.vt_tradeid] = signal
+        self.trades[trade.vt_tradeid] = trade
+        self.daily_result.add_trade(trade)
+        self.strategy.on_trade(trade)
+
+    def send_order(self, strategy: Template, direction: Direction, offset: Offset, price: float, volume: float,
+                   stop: bool = False, lock: bool = False) -> List[str]:
+        price = round(round(price / self.pricetick) * self.pricetick, 8)
+        if self.lot > 1:
+            volume = int(volume // self.lot) * self.lot
+        if direction == Direction.SHORT:
+            # 只能卖出可卖持仓里还没有挂单的部分
+            volume = min(volume, self.get_sellable() - self.get_pending_sell())
+        if volume <= 0:
+            return []
+        signal = self.get_signal_type(strategy, direction)
+        if stop:
+            vt_orderid = self.send_stop_order(direction, offset, price, volume)
+        else:
+            vt_orderid = self.send_limit_order(direction, offset, price, volume)
+        if signal:
+            self.order_signal[vt_orderid] = signal
+        return [vt_orderid]
+
+    def send_stop_order(self, direction: Direction, offset: Offset, price: float, volume: float) -> str:
+        self.stop_order_count += 1
+        stop_order = StopOrder(
+            vt_symbol=self.vt_symbol,
+            direction=direction,
+            offset=offset,
+            price=price,
+            volume=volume,
+            stop_orderid='%s.%d' % (STOPORDER_PREFIX, self.stop_order_count),
+            strategy_name=self.strategy.strategy_name
+        )
+        self.active_stop_orders[stop_order.stop_orderid] = stop_order
+        self.stop_orders[stop_order.stop_orderid] = stop_order
+        return stop_order.stop_orderid
+
+    def send_limit_order(self, direction: Direction, offset: Offset, price: float, volume: float) -> str:
+        self.limit_order_count += 1
+        order = OrderData(
+            symbol=self.symbol,
+            exchange=self.exchange,
+            orderid=str(self.limit_order_count),
+            direction=direction,
+            offset=offset,
+            price=price,
+            volume=volume,
+            status=Status.SUBMITTING,
+            datetime=self.datetime
+        )
+        self.active_limit_orders[order.vt_orderid] = order
+        self.limit_orders[order.vt_orderid] = order
+        return order.vt_orderid
+
+    @staticmethod
+    def get_signal_type(strategy: Template, direction: Direction) -> str:
+        """
+        下单时刚产生的买卖点类型：Chan_Class.on_buy_sell先加入buy_list/sell_list再调用buy/sell。
+        不是缠论策略时返回空字符串。
+        """
+        chan_freq_map = getattr(strategy, 'chan_freq_map', None)
+        jb = getattr(strategy, 'jb', None)
+        if not chan_freq_map or jb not in chan_freq_map:
+            return ''
+        chan = chan_freq_map[jb]
+        bs_list = chan.buy_list if direction == Direction.LONG else chan.sell_list
+        return bs_list[-1].type if bs_list else ''
+
+    def cancel_order(self, strategy: Template, vt_orderid: str) -> None:
+        if vt_orderid.startswith(STOPORDER_PREFIX):
+            stop_order = self.active_stop_orders.pop(vt_orderid, None)
+            if stop_order:
+                stop_order.status = StopOrderStatus.CANCELLED
+                strategy.on_stop_order(stop_order)
+        else:
+            order = self.active_limit_orders.pop(vt_orderid, None)
+            if order:
+                order.status = Status.CANCELLED
+                strategy.on_order(order)
+
+    def cancel_all(self, strategy: Template) -> None:
+        for vt_orderid in list(self.active_limit_orders.keys()):
+            self.cancel_order(strategy, vt_orderid)
+        for vt_orderid in list(self.active_stop_orders.keys()):
+            self.cancel_order(strategy, vt_orderid)
+
+    def write_log(self, msg: str, strategy: Template = None) -> None:
+        msg = '%s\t%s' % (self.datetime, msg)
+        self.logs.append(msg)
+        self.put_event(EVENT_BACKTEST_LOG, msg)
+
+    def put_event(self, type: str, data) -> None:
+        if self.event_engine:
+            from trade.engine import Event
+            self.event_engine.put(Event(type, data))
+
+    def get_engine_type(self) -> EngineType:
+        return self.engine_type
+
+    def put_strategy_event(self, strategy: Template) -> None:
+        pass
+
+    def put_render_event(self, strategy: Template) -> None:
+        pass
+
+    def send_msg(self, msg: str, strategy: Template = None) -> None:
+        pass
+
+    def sync_strategy_data(self, strategy: Template) -> None:
+        pass
+
+    def calculate_result(self) -> pd.DataFrame:
+        """逐日盈亏"""
+        pre_close = 0
+        start_pos = 0
+        rows = defaultdict(list)
+        for d in sorted(self.daily_results):
+            daily_result = self.daily_results[d]
+            daily_result.calculate_pnl(pre_close, start_pos, self.size, self.rate, self.slippage)
+            pre_close = daily_result.close_price
+            start_pos = daily_result.end_pos
+            for key in ('date', 'close_price', 'pre_close', 'trade_count', 'start_pos', 'end_pos', 'turnover',
+                        'commission', 'slippage', 'trading_pnl', 'holding_pnl', 'total_pnl', 'net_pnl'):
+                rows[key].append(getattr(daily_result, key))
+        self.daily_df = pd.DataFrame(rows)
+        if len(self.daily_df):
+            self.daily_df.set_index('date', inplace=True)
+        return self.daily_df
+
+    def calculate_statistics(self, df: pd.DataFrame = None) -> dict:
+        """收益、回撤统计，以及按买卖点类型的统计"""
+        if df is None:
+            df = self.daily_df if self.daily_df is not None else self.calculate_result()
+        statistics = {'total_days': 0, 'capital': self.capital}
+        if df is None or not len(df):
+            statistics.update(self.calculate_signal_statistics())
+            return statistics
+
+        balance = df['net_pnl'].cumsum() + self.capital
+        highlevel = balance.cummax()
+        drawdown = balance - highlevel
+        ddpercent = drawdown / highlevel * 100
+        pre_balance = balance.shift(1)
+        pre_balance.iloc[0] = self.capital
+        daily_return = (balance / pre_balance - 1).fillna(0)
+
+        total_days = len(df)
+        end_balance = float(balance.iloc[-1])
+        max_drawdown = float(drawdown.min())
+        max_ddpercent = float(ddpercent.min())
+        max_drawdown_end = drawdown.idxmin()
+        max_drawdown_start = balance[:max_drawdown_end].idxmax()
+        return_std = float(daily_return.std()) if total_days > 1 else 0.0
+        daily_mean = float(daily_return.mean())
+        statistics.update({
+            'start_date': df.index[0],
+            'end_date': df.index[-1],
+            'total_days': total_days,
+            'profit_days': int((df['net_pnl'] > 0).sum()),
+            'loss_days': int((df['net_pnl'] < 0).sum()),
+            'end_balance': end_balance,
+            'max_drawdown': max_drawdown,
+            'max_ddpercent': max_ddpercent,
+            'max_drawdown_start': max_drawdown_start,
+            'max_drawdown_end': max_drawdown_end,
+            'total_net_pnl': float(df['net_pnl'].sum()),
+            'total_commission': float(df['commission'].sum()),
+            'total_slippage': float(df['slippage'].sum()),
+            'total_turnover': float(df['turnover'].sum()),
+            'total_trade_count': int(df['trade_count'].sum()),
+            'total_return': (end_balance / self.capital - 1) * 100,
+            'daily_return': daily_mean * 100,
+            'return_std': return_std * 100,
+            # A股一年约240个交易日
+            'sharpe_ratio': daily_mean / return_std * np.sqrt(240) if return_std else 0.0,
+        })
+        statistics.update(self.calculate_signal_statistics())
+        return statistics
+
+    def calculate_signal_statistics(self) -> dict:
+        """
+        按买卖点类型统计：买入按先进先出和之后的卖出配对，盈亏(扣手续费和滑点)记到买点类型上，
+        卖点类型只统计次数；没有卖出的持仓按最后收盘价计算浮动盈亏。
+        """
+        signal_stats = defaultdict(lambda: {'trade_count': 0, 'volume': 0, 'closed': 0, 'win': 0, 'pnl': 0.0})
+        lots = []
+        cost = self.rate
+        for trade in sorted(self.trades.values(), key=lambda x: int(x.tradeid)):
+            signal = self.trade_signal.get(trade.vt_tradeid, '')
+            stats = signal_stats[signal]
+            stats['trade_count'] += 1
+            stats['volume'] += trade.volume
+            if trade.direction == Direction.LONG:
+                lots.append([trade.volume, trade.price, signal])
+                continue
+            volume = trade.volume
+            while volume > 0 and lots:
+                lot = lots[0]
+                matched = min(volume, lot[0])
+                pnl = matched * self.size * (trade.price - lot[1] - (trade.price + lot[1]) * cost - 2 * self.slippage)
+                buy_stats = signal_stats[lot[2]]
+                buy_stats['closed'] += 1
+                buy_stats['win'] += pnl > 0
+                buy_stats['pnl'] += pnl
+                lot[0] -= matched
+                volume -= matched
+                if lot[0] <= 0:
+                    lots.pop(0)
+
+        last_price = self.bar.close_price if self.bar else 0
+        open_pnl = defaultdict(float)
+        for volume, price, signal in lots:
+            open_pnl[signal] += volume * self.size * (last_price - price)
+        ans = {}
+        for signal, stats in signal_stats.items():
+            stats['win_rate'] = stats['win'] / stats['closed'] * 100 if stats['closed'] else 0.0
+            stats['open_pnl'] = open_pnl.get(signal, 0.0)
+            ans[signal or '其他'] = stats
+        return {'signal_statistics': ans}
+
+
+class OptimizationSetting:
+    """
+    参数优化的取值范围：add_parameter(name, start, end, step)或者add_parameter(name, values=[...])。
+    target_name为排序用的统计指标，见BacktestingEngine.calculate_statistics。
+    """
+
+    def __init__(self):
+        self.params: Dict[str, list] = {}
+        self.target_name = 'total_net_pnl'
+
+    def add_parameter(self, name: str, start=None, end=None, step=None, values: list = None) -> None:
+        if values is not None:
+            self.params[name] = list(values)
+        elif end is None or step is None:
+            self.params[name] = [start]
+        else:
+            value = start
+            values = []
+            while value <= end:
+                values.append(value)
+                value += step
+            self.params[name] = values
+
+    def set_target(self, target_name: str) -> None:
+        self.target_name = target_name
+
+    def generate_settings(self) -> List[dict]:
+        names = list(self.params.keys())
+        return [dict(zip(names, values)) for values in product(*[self.params[name] for name in names])]
+
+
+class OptimizationStore:
+    """
+    参数优化结果的本地存储(sqlite)，键为k线数据、股票、策略类、version、回测参数和策略参数的hash，重复运行时跳过已经算过的组合。
+    策略代码改了之后换一个version，之前的结果就不会再被使用
+    """
+
+    def __init__(self, path: Union[str, Path] = None):
+        if path is None:
+            path = get_folder_path('backtest').joinpath('optimization.db')
+        self.path = str(path)
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS result (key TEXT PRIMARY KEY, setting TEXT, statistics TEXT)')
+
+    @staticmethod
+    def make_key(data_key: str, engine_setting: dict, setting: dict, strategy_class: Type[Template] = None,
+                 vt_symbol: str = '', version: str = '') -> str:
+        strategy_name = strategy_class.__module__ + '.' + strategy_class.__qualname__ if strategy_class else ''
+        text = json.dumps([data_key, engine_setting, setting, strategy_name, vt_symbol, version], sort_keys=True,
+                          default=str)
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    def get(self, keys: List[str]) -> Dict[str, dict]:
+        ans = {}
+        with closing(sqlite3.connect(self.path)) as conn:
+            for key in keys:
+                row = conn.execute('SELECT statistics FROM result WHERE key = ?', (key,)).fetchone()
+                if row:
+                    ans[key] = json.loads(row[0])
+        return ans
+
+    def put(self, key: str, setting: dict, statistics: dict) -> None:
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            conn.execute('INSERT OR REPLACE INTO result VALUES (?, ?, ?)',
+                         (key, json.dumps(setting, sort_keys=True, default=str),
+                          json.dumps(statistics, ensure_ascii=False, default=str)))
+
+
+# 参数优化子进程里的k线和回测参数，由_init_optimization设置
+_optimization = {}
+
+BAR_COLUMNS = ['datetime', 'open', 'high', 'low', 'close', 'volume', 'open_interest']
+
+# 参数优化的k线文件超过这么多秒没有使用就删除
+BAR_COLUMNS_EXPIRE = 7 * 24 * 3600
+
+
+def save_bar_columns(bars: List[BarData], folder: Path) -> Tuple[str, dict]:
+    """
+    k线按列保存成.npy文件，子进程用内存映射只读打开，不用每个任务传一遍k线。
+    返回(数据的hash, 股票信息)，同样的数据只写一次。
+    """
+    store = BarStore(max(len(bars), 1))
+    store.extend(bars)
+    n = len(store)
+    arrays = [getattr(store, name + '_array')[:n] for name in BAR_COLUMNS]
+    arrays[0] = arrays[0].view('int64')
+    meta = {'symbol': store.symbol, 'exchange': store.exchange, 'interval': store.interval, 'tzinfo': store.tzinfo}
+    sha = hashlib.sha1(repr(sorted((k, str(v)) for k, v in meta.items())).encode())
+    for array in arrays:
+        sha.update(np.ascontiguousarray(array).tobytes())
+    data_key = sha.hexdigest()
+    path = folder.joinpath(data_key)
+    if not path.exists():
+        tmp_path = folder.joinpath(data_key + '.tmp')
+        tmp_path.mkdir(exist_ok=True)
+        for name, array in zip(BAR_COLUMNS, arrays):
+            np.save(str(tmp_path.joinpath(name + '.npy')), array)
+        tmp_path.rename(path)
+    else:
+        # 记录最近一次使用的时间，clean_bar_columns按它过期
+        os.utime(str(path))
+    return data_key, meta
+
+
+def clean_bar_columns(folder: Path, keep: str = '', expire: float = BAR_COLUMNS_EXPIRE) -> None:
+    """删除folder下超过expire秒没有使用的k线文件夹；其他进程还在映射时删除失败，下次再删"""
+    now = time.time()
+    for path in folder.iterdir():
+        if not path.is_dir() or path.name == keep:
+            continue
+        try:
+            if now - path.stat().st_mtime > expire:
+                shutil.rmtree(str(path))
+        except OSError:
+            pass
+
+
+def load_bar_columns(path: Union[str, Path], meta: dict) -> BarStore:
+    """
+    直接用内存映射的数组作为BarStore的列，多个进程共用同一份只读数据，BarData在遍历时才生成。
+    返回的BarStore是只读的。
+    """
+    path = Path(path)
+    arrays = [np.load(str(path.joinpath(name + '.npy')), mmap_mode='r') for name in BAR_COLUMNS]
+    store = BarStore()
+    store.symbol = meta['symbol']
+    store.exchange = meta['exchange']
+    store.interval = meta['interval']
+    store.tzinfo = meta['tzinfo']
+    n = len(arrays[0])
+    if n:
+        arrays[0] = arrays[0].view('datetime64[us]')
+        for name, array in zip(BAR_COLUMNS, arrays):
+            setattr(store, name + '_array', array)
+        store.count = store.size = n
+    return store
+
+
+def _init_optimization(path: str, meta: dict, vt_symbol: str, engine_setting: dict, strategy_class) -> None:
+    """每个子进程执行一次：读取k线，之后所有任务共用"""
+    from trade.chanlog import ChanLog
+    ChanLog.disable()
+    _optimization['bars'] = load_bar_columns(path, meta)
+    _optimization['vt_symbol'] = vt_symbol
+    _optimization['engine_setting'] = engine_setting
+    _optimization['strategy_class'] = strategy_class
+
+
+def run_optimization_task(setting: dict) -> Tuple[dict, dict]:
+    """在子进程里回测一组参数"""
+    engine = BacktestingEngine()
+    engine.set_parameters(_optimization['vt_symbol'], **_optimization['engine_setting'])
+    engine.add_strategy(_optimization['strategy_class'], dict(setting))
+    engine.history_data = _optimization['bars']
+    engine.run_backtesting()
+    engine.calculate_result()
+    statistics = engine.calculate_statistics()
+    # 存储和跨进程传递用json能表示的值
+    return setting, json.loads(json.dumps(statistics, ensure_ascii=False, default=str))
+
+
+def run_optimization(bars: List[BarData], vt_symbol: str, optimization_setting: OptimizationSetting,
+                     strategy_class: Type[Template] = None, engine_setting: dict = None, base_setting: dict = None,
+                     workers: int = None, random_count: int = 0, seed: int = 0, store: OptimizationStore = None,
+                     event_engine=None, version: str = '') -> List[Tuple[dict, float, dict]]:
+    """
+    网格(random_count=0)或随机搜索，返回按target从大到小排序的[(参数, target, 统计)]。
+    workers默认cpu个数，0表示在当前进程里逐个回测。
+    已经在store里的组合不再回测，策略代码修改后传入新的version重新计算；结束时发送EVENT_BACKTEST_OPTIMIZATION_FINISHED事件。
+    """
+    if strategy_class is None:
+        from trade.strategies.chan_strategy import Chan_Strategy
+        strategy_class = Chan_Strategy
+    engine_setting = dict(engine_setting or {})
+    store = store or OptimizationStore()
+    settings = optimization_setting.generate_settings()
+    if random_count and random_count < len(settings):
+        settings = random.Random(seed).sample(settings, random_count)
+    settings = [dict(base_setting or {}, **setting) for setting in settings]
+
+    folder = get_folder_path('backtest').joinpath('bars')
+    folder.mkdir(exist_ok=True)
+    data_key, meta = save_bar_columns(bars, folder)
+    clean_bar_columns(folder, data_key)
+    keys = [OptimizationStore.make_key(data_key, engine_setting, setting, strategy_class, vt_symbol, version)
+            for setting in settings]
+    cached = store.get(keys)
+    todo = [(key, setting) for key, setting in zip(keys, settings) if key not in cached]
+    results = [(setting, cached[key]) for key, setting in zip(keys, settings) if key in cached]
+
+    if todo:
+        initargs = (str(folder.joinpath(data_key)), meta, vt_symbol, engine_setting, strategy_class)
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers <= 0:
+            # 当前进程里运行：结束后恢复日志级别，释放k线
+            from trade.chanlog import ChanLog
+            level = ChanLog.level
+            try:
+                _init_optimization(*initargs)
+                for key, setting in todo:
+                    setting, statistics = run_optimization_task(setting)
+                    store.put(key, setting, statistics)
+                    results.append((setting, statistics))
+            finally:
+                ChanLog.set_level(level)
+                _optimization.clear()
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_optimization,
+                                     initargs=initargs) as executor:
+                futures = {executor.submit(run_optimization_task, setting): key for key, setting in todo}
+                for future in as_completed(futures):
+                    setting, statistics = future.result()
+                    store.put(futures[future], setting, statistics)
+                    results.append((setting, statistics))
+
+    target_name = optimization_setting.target_name
+    ans = [(setting, statistics.get(target_name) or 0, statistics) for setting, statistics in results]
+    ans.sort(key=lambda x: x[1], reverse=True)
+    if event_engine:
+        from trade.engine import Event
+        event_engine.put(Event(EVENT_BACKTEST_OPTIMIZATION_FINISHED, ans))
+    return ans
@@ -0,0 +1,288 @@
+"""
+k线本地缓存：每个股票每个周期一个目录，每列一个二进制文件，读取时内存映射。
+记录已经查询过的日期，再次查询时只向数据源请求缺少的日期段。
+"""
+import json
+import os
+from datetime import date, datetime, time, timedelta
+from pathlib import Path
+from typing import Callable, List, Tuple, Union
+
+import numpy as np
+import pandas
+
+from trade.constant import Exchange, Interval
+from trade.utility import BarStore, get_folder_path
+
+# 列名和类型，datetime为墙上时间距1970-01-01的微秒数
+COLUMNS = [
+    ('datetime', 'int64'),
+    ('open', 'float64'),
+    ('high', 'float64'),
+    ('low', 'float64'),
+    ('close', 'float64'),
+    ('volume', 'float64'),
+    ('open_interest', 'float64'),
+]
+
+US_PER_DAY = 86400 * 1000000
+
+
+def to_date(value: Union[date, datetime, str]) -> date:
+    if isinstance(value, str):
+        value = datetime.strptime(value[:10], '%Y-%m-%d')
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+def date_to_us(d: date) -> int:
+    return (d - date(1970, 1, 1)).days * US_PER_DAY
+
+
+def merge_ranges(ranges: List[Tuple[date, date]]) -> List[Tuple[date, date]]:
+    """合并重叠或相邻的日期段，闭区间"""
+    ans = []
+    for start, end in sorted(ranges):
+        if ans and start <= ans[-1][1] + timedelta(days=1):
+            if end > ans[-1][1]:
+                ans[-1] = (ans[-1][0], end)
+        else:
+            ans.append((start, end))
+    return ans
+
+
+def subtract_ranges(start: date, end: date, ranges: List[Tuple[date, date]]) -> List[Tuple[date, date]]:
+    """[start, end]中不在ranges里的日期段"""
+    ans = []
+    cur = start
+    for range_start, range_end in ranges:
+        if range_end < cur:
+            continue
+        if range_start > end:
+            break
+        if range_start > cur:
+            ans.append((cur, range_start - timedelta(days=1)))
+        cur = max(cur, range_end + timedelta(days=1))
+        if cur > end:
+            break
+    if cur <= end:
+        ans.append((cur, end))
+    return ans
+
+
+class BarCache:
+    """
+    For:
+    1. on-disk cache of bar data per symbol and interval, one raw binary file per column, memory-mapped on load
+    2. remembering which days were already fetched, so a query only fetches the missing day ranges
+
+    Notice:
+    1. fetched days are kept as calendar day ranges, weekends and holidays inside a fetched range are not fetched again
+    2. today is marked as fetched only after close_time; before that today's bars are fetched on every query and
+       returned without being written to the column files
+    3. bars after the last cached bar are appended to the column files; otherwise the columns are merged and written
+       as a new generation, and meta.json is replaced last, so an interrupted write leaves the old data readable
+    4. column files of other generations (left when windows could not delete them) are removed on the next query
+    5. fetch(symbol, exchange, interval, start, end) returns a DataFrame indexed by bar datetime with columns
+       open/high/low/close/volume (open_interest optional) for the days [start, end], or None
+    """
+
+    def __init__(self, fetch: Callable, path: Union[str, Path] = None, close_time: time = time(15, 30)):
+        self.fetch = fetch
+        self.path = Path(path) if path else get_folder_path('bar_cache')
+        self.close_time = close_time
+
+    def get_path(self, symbol: str, exchange: Exchange, interval: Interval) -> Path:
+        return self.path.joinpath('%s.%s' % (symbol, exchange.value), interval.value)
+
+    def load_meta(self, folder: Path) -> dict:
+        file = folder.joinpath('meta.json')
+        if not file.exists():
+            return {'generation': 0, 'count': 0, 'days': []}
+        with open(str(file), encoding='utf-8') as f:
+            meta = json.load(f)
+        meta['days'] = [(to_date(start), to_date(end)) for start, end in meta['days']]
+        return meta
+
+    def save_meta(self, folder: Path, meta: dict) -> None:
+        data = dict(meta)
+        data['days'] = [(start.isoformat(), end.isoformat()) for start, end in meta['days']]
+        tmp_file = folder.joinpath('meta.json.tmp')
+        with open(str(tmp_file), 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(str(tmp_file), str(folder.joinpath('meta.json')))
+
+    @staticmethod
+    def get_column_file(folder: Path, name: str, generation: int) -> Path:
+        return folder.joinpath('%s.%d.bin' % (name, generation))
+
+    def load_columns(self, folder: Path, meta: dict) -> dict:
+        """按列内存映射，只读"""
+        count = meta['count']
+        columns = {}
+        for name, dtype in COLUMNS:
+            if count:
+                columns[name] = np.memmap(str(self.get_column_file(folder, name, meta['generation'])), dtype=dtype,
+                                          mode='r', shape=(count,))
+            else:
+                columns[name] = np.zeros(0, dtype=dtype)
+        return columns
+
+    def get_missing(self, symbol: str, exchange: Exchange, interval: Interval, start, end) -> List[Tuple[date, date]]:
+        """[start, end]中还没有缓存的日期段"""
+        meta = self.load_meta(self.get_path(symbol, exchange, interval))
+        return subtract_ranges(to_date(start), to_date(end), meta['days'])
+
+    def query(self, symbol: str, exchange: Exchange, interval: Interval, start, end, tzinfo=None) -> BarStore:
+        """[start, end]的k线，缺少的日期先从数据源补齐"""
+        start = to_date(start)
+        end = to_date(end)
+        folder = self.get_path(symbol, exchange, interval)
+        meta = self.load_meta(folder)
+        self.clean_generations(folder, meta)
+        missing = subtract_ranges(start, end, meta['days'])
+        partial = None
+        if missing:
+            meta, partial = self.update(folder, meta, symbol, exchange, interval, missing)
+
+        columns = self.load_columns(folder, meta)
+        dt_array = columns['datetime']
+        left = int(np.searchsorted(dt_array, date_to_us(start), 'left'))
+        right = int(np.searchsorted(dt_array, date_to_us(end + timedelta(days=1)), 'left'))
+        store = BarStore(max(right - left, 1))
+        store.symbol = symbol
+        store.exchange = exchange
+        store.interval = interval
+        store.tzinfo = tzinfo
+        store.extend_arrays(*[columns[name][left:right] for name, dtype in COLUMNS])
+        del columns, dt_array
+        # 收盘前今天的k线只在内存里，都在已缓存的日期之后
+        if partial is not None:
+            store.extend_arrays(*[partial[name] for name, dtype in COLUMNS])
+        return store
+
+    def clean_generations(self, folder: Path, meta: dict) -> None:
+        """删除不是当前一代的列文件"""
+        if not folder.exists():
+            return
+        current = '.%d.bin' % meta['generation']
+        for file in folder.glob('*.bin'):
+            if not file.name.endswith(current) or not meta['count']:
+                try:
+                    file.unlink()
+                except OSError:
+                    pass
+
+    def update(self, folder: Path, meta: dict, symbol: str, exchange: Exchange, interval: Interval,
+               missing: List[Tuple[date, date]]) -> Tuple[dict, dict]:
+        """从数据源取缺少的日期段，完整的日期写入缓存，返回(新的meta, 收盘前今天的各列)"""
+        now = datetime.now()
+        # 收盘前今天的数据不完整，不记为已缓存
+        last_day = now.date() if now.time() >= self.close_time else now.date() - timedelta(days=1)
+        frames = []
+        fetched = []
+        for range_start, range_end in missing:
+            df = self.fetch(symbol, exchange, interval, range_start, range_end)
+            if df is not None and len(df):
+                # 只保留请求的日期段内的k线，和已缓存的日期段不重叠
+                dt_array = np.asarray(pandas.DatetimeIndex(df.index).values, dtype='datetime64[us]').view('int64')
+                mask = (dt_array >= date_to_us(range_start)) & (dt_array < date_to_us(range_end + timedelta(days=1)))
+                frames.append((dt_array[mask], df[mask]))
+            if range_start <= last_day:
+                fetched.append((range_start, min(range_end, last_day)))
+
+        new_columns = {name: [] for name, dtype in COLUMNS}
+        for dt_array, df in frames:
+            new_columns['datetime'].append(dt_array)
+            for name, dtype in COLUMNS[1:]:
+                if name in df.columns:
+                    # pandas 0.24没有to_numpy的na_value参数
+                    new_columns[name].append(df[name].fillna(0).to_numpy(dtype=dtype))
+                else:
+                    new_columns[name].append(np.zeros(len(df), dtype=dtype))
+        new_columns = {name: np.concatenate(arrays) if arrays else np.zeros(0, dtype=dtype)
+                       for (name, dtype), arrays in zip(COLUMNS, new_columns.values())}
+        order = np.argsort(new_columns['datetime'], kind='stable')
+        new_columns = {name: array[order] for name, array in new_columns.items()}
+        # last_day之后(收盘前的今天)的k线不写入列文件，否则每次查询都会和重新取的今天重叠，整段重写
+        split = int(np.searchsorted(new_columns['datetime'], date_to_us(last_day + timedelta(days=1)), 'left'))
+        partial = {name: array[split:] for name, array in new_columns.items()}
+        new_columns = {name: array[:split] for name, array in new_columns.items()}
+
+        folder.mkdir(parents=True, exist_ok=True)
+        meta = dict(meta)
+        meta['days'] = merge_ranges(meta['days'] + fetched)
+        if split:
+            if not meta['count'] or new_columns['datetime'][0] > self.get_last_datetime(folder, meta):
+                self.append_columns(folder, meta, new_columns)
+            else:
+                self.write_columns(folder, meta, new_columns)
+        self.save_meta(folder, meta)
+        return meta, partial
+
+    def get_last_datetime(self, folder: Path, meta: dict) -> int:
+        """已缓存的最后一根k线的时间，直接读文件，不做内存映射"""
+        itemsize = np.dtype('int64').itemsize
+        with open(str(self.get_column_file(folder, 'datetime', meta['generation'])), 'rb') as f:
+            f.seek((meta['count'] - 1) * itemsize)
+            return int(np.frombuffer(f.read(itemsize), dtype='int64')[0])
+
+    def append_columns(self, folder: Path, meta: dict, columns: dict) -> None:
+        """新k线都在已缓存的之后，直接追加到当前的列文件"""
+        count = meta['count']
+        for name, dtype in COLUMNS:
+            file = self.get_column_file(folder, name, meta['generation'])
+            with open(str(file), 'ab' if file.exists() else 'wb') as f:
+                # 去掉上次中断写入的部分
+                f.truncate(count * np.dtype(dtype).itemsize)
+                f.seek(0, os.SEEK_END)
+                f.write(np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+        meta['count'] = count + len(columns['datetime'])
+
+    def write_columns(self, folder: Path, meta: dict, columns: dict) -> None:
+        """新旧k线合并去重后写成新一代的列文件，同一时间以新取的为准"""
+        old = self.load_columns(folder, meta)
+        merged = {name: np.concatenate([old[name], columns[name]]) for name, dtype in COLUMNS}
+        # 合并结果是新数组，释放旧文件的映射，之后才能删除(windows)
+        del old
+        order = np.argsort(merged['datetime'], kind='stable')
+        merged = {name: array[order] for name, array in merged.items()}
+        dt_array = merged['datetime']
+        keep = np.ones(len(dt_array), dtype=bool)
+        keep[:-1] = dt_array[1:] != dt_array[:-1]
+        generation = meta['generation'] + 1
+        for name, dtype in COLUMNS:
+            with open(str(self.get_column_file(folder, name, generation)), 'wb') as f:
+                f.write(np.ascontiguousarray(merged[name][keep], dtype=dtype).tobytes())
+        old_generation = meta['generation']
+        meta['generation'] = generation
+        meta['count'] = int(keep.sum())
+        # 先切换meta再删除旧文件
+        self.save_meta(folder, meta)
+        for name, dtype in COLUMNS:
+            file = self.get_column_file(folder, name, old_generation)
+            if file.exists():
+                try:
+                    file.unlink()
+                except OSError:
+                    # 其他地方还在映射时删除失败，下次查询时clean_generations再删
+                    pass
+
+    def clear(self, symbol: str, exchange: Exchange, interval: Interval) -> None:
+        folder = self.get_path(symbol, exchange, interval)
+        if folder.exists():
+            for file in folder.iterdir():
+                file.unlink()
+            folder.rmdir()
+
+
+def store_to_frame(store: BarStore) -> pandas.DataFrame:
+    """和聚宽get_price相同格式的DataFrame：按时间索引，列为open/high/low/close/volume"""
+    return pandas.DataFrame({
+        'open': store.open,
+        'high': store.high,
+        'low': store.low,
+        'close': store.close,
+        'volume': store.volume,
+    }, index=pandas.DatetimeIndex(store.datetime), columns=['open', 'high', 'low', 'close', 'volume'])
@@ -1,16 +1,166 @@
+import atexit
+import sys
+from logging import INFO, CRITICAL
+from queue import Empty, Full, Queue
+from threading import Thread, Lock
+
 from trade.utility import TEMP_DIR
 
 
 class ChanLog:
+    """
+    缠论计算日志，按symbol-freq写入config/chan_log目录。
+    先判断日志级别再格式化，消息由后台线程批量写入，每个文件只打开一次。
+    data可以是字符串、对象、可调用对象(延迟生成)，或者配合args使用%格式化。
+    """
+    # 低于level的日志直接丢弃，不做任何格式化
+    level: int = INFO
+    # 缓冲队列长度，满了之后log直接丢弃这条日志，不等待
+    buffer_size: int = 10000
+    # close等待后台线程写完的最长时间
+    close_timeout: float = 10.0
+    # 后台线程每批最多写入的条数
+    batch_size: int = 1000
+    # 丢弃的日志条数和写入失败的批数
+    dropped: int = 0
+    errors: int = 0
 
-    @staticmethod
-    def log(freq, symbol, data) -> None:
+    _queue: Queue = None
+    _thread: Thread = None
+    _lock: Lock = Lock()
+    _atexit: bool = False
+
+    @classmethod
+    def set_level(cls, level: int) -> None:
+        cls.level = level
+
+    @classmethod
+    def disable(cls) -> None:
+        cls.level = CRITICAL + 1
+
+    @classmethod
+    def is_enabled(cls, level: int = INFO) -> bool:
+        return level >= cls.level
+
+    @classmethod
+    def log(cls, freq, symbol, data, *args, level: int = INFO) -> None:
+        if level < cls.level:
+            return
+        if callable(data):
+            data = data()
+        if args:
+            data = data % args
         data = str(data)
         if len(data) <= 0:
             return
-        chan_path = TEMP_DIR.joinpath('chan_log')
-        if not chan_path.exists():
-            chan_path.mkdir(parents=True)
-        chan_file = chan_path.joinpath(symbol + '-' + freq + '.txt')
-        with open(chan_file, 'a') as f:
-            f.write(data + '\n')
+        # close会把_queue置为None，在锁内取出队列；正在close时放进去的日志会丢掉，但不会阻塞
+        with cls._lock:
+            if cls._thread is None or not cls._thread.is_alive():
+                cls._start()
+            queue = cls._queue
+        try:
+            queue.put_nowait((symbol + '-' + freq, data))
+        except Full:
+            cls.dropped += 1
+
+    @classmethod
+    def _start(cls) -> None:
+        # 调用时已经持有_lock
+        cls._queue = Queue(maxsize=cls.buffer_size)
+        cls._thread = Thread(target=cls._run, args=(cls._queue,), daemon=True)
+        cls._thread.start()
+        if not cls._atexit:
+            cls._atexit = True
+            atexit.register(cls.close)
+
+    @classmethod
+    def _run(cls, queue: Queue) -> None:
+        # 文件句柄属于这个线程，close超时后重新启动的线程不会和它共用
+        files = {}
+        while True:
+            item = queue.get()
+            if item is None:
+                queue.task_done()
+                break
+            batch = [item]
+            stop = False
+            try:
+                while len(batch) < cls.batch_size:
+                    item = queue.get_nowait()
+                    if item is None:
+                        stop = True
+                        break
+                    batch.append(item)
+            except Empty:
+                pass
+            try:
+                cls._write(batch, files)
+            except Exception as ex:
+                # 写盘失败(磁盘满、没有权限等)时丢掉这一批，线程继续运行，否则log和close会一直等待
+                cls.errors += 1
+                print('ChanLog写入失败，丢弃%d条日志：%r' % (len(batch), ex), file=sys.stderr)
+            finally:
+                for _ in range(len(batch) + stop):
+                    queue.task_done()
+            if stop:
+                break
+        try:
+            cls._close_files(files)
+        except Exception as ex:
+            print('ChanLog关闭文件失败：%r' % ex, file=sys.stderr)
+
+    @classmethod
+    def _write(cls, batch, files: dict) -> None:
+        lines = {}
+        for key, data in batch:
+            lines.setdefault(key, []).append(data + '\n')
+        for key, items in lines.items():
+            f = cls._get_file(key, files)
+            f.write(''.join(items))
+            f.flush()
+
+    @classmethod
+    def _get_file(cls, key: str, files: dict):
+        f = files.get(key)
+        if f is None:
+            chan_path = TEMP_DIR.joinpath('chan_log')
+            if not chan_path.exists():
+                chan_path.mkdir(parents=True)
+            f = open(chan_path.joinpath(key + '.txt'), 'a')
+            files[key] = f
+        return f
+
+    @staticmethod
+    def _close_files(files: dict) -> None:
+        for f in files.values():
+            f.close()
+        files.clear()
+
+    @classmethod
+    def flush(cls) -> None:
+        # 等待缓冲区中的日志全部写入文件
+        with cls._lock:
+            queue = cls._queue
+        if queue is not None:
+            queue.join()
+
+    @classmethod
+    def close(cls) -> None:
+        # 写完剩余日志，关闭文件句柄，之后再log会重新启动后台线程
+        # 在锁外等待，不影响其他线程log；线程确实退出后才清空状态
+        with cls._lock:
+            thread = cls._thread
+            queue = cls._queue
+        if thread is None:
+            return
+        try:
+            queue.put(None, timeout=cls.close_timeout)
+        except Full:
+            return
+        thread.join(timeout=cls.close_timeout)
+        if thread.is_alive():
+            return
+        with cls._lock:
+            if cls._thread is thread:
+                cls._thread = None
+                cls._queue = None
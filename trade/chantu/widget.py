@@ -2,7 +2,6 @@ from datetime import datetime, timedelta
 
 from PyQt5.QtWidgets import QMessageBox
 
-import pandas as pd
 from functools import partial
 from typing import List
 from trade.engine import MainEngine, Event
@@ -11,11 +10,11 @@ from PyQt5.QtWebEngineWidgets import QWebEngineView
 from pathlib import Path
 from trade.constant import FREQS, EVENT_CHANTU, EVENT_RENDER
 from trade.strategies.chan_strategy import Chan_Strategy
+from trade.strategies.chan_render import build_render_payload
 from trade.object import HistoryRequest, Interval, Exchange
 from trade.jqdata import jqdata_client
-import talib as tl
+from trade.utility import get_folder_path
 from threading import Thread
-import json
 import time
 
 ENGINE = 'CHANTU'
@@ -90,6 +89,13 @@ class ChanTuManager(QtWidgets.QWidget):
         if vt_symbol[0] == '6':
             exchange = Exchange.SSE
         now_time = datetime.now()
+        # 有快照就只下载、回放快照之后的k线
+        checkpoint_path = get_folder_path('chan_checkpoint').joinpath(
+            '%s-%s-%s.ckpt' % (vt_symbol, start_time, '-'.join(str(v) for v in
+                                                           chan_strategy.get_checkpoint_setting().values())))
+        if chan_strategy.load_checkpoint(checkpoint_path):
+            print('恢复快照：' + str(chan_strategy.last_datetime))
+            start_time = chan_strategy.last_datetime.date()
         req = HistoryRequest(
             symbol=vt_symbol,
             exchange=exchange,
@@ -110,6 +116,9 @@ class ChanTuManager(QtWidgets.QWidget):
             self.main_engine.put(event=Event(EVENT_RENDER, '获取K线错误，请检查开始日期'))
             print('获取K线错误，请检查开始日期')
             return
+        if chan_strategy.last_datetime:
+            # 按时间二分查找快照之后的k线，BarData在回放时才逐根生成
+            BarDataList.drop_front(BarDataList.bisect_right(chan_strategy.last_datetime))
         print('获取k线花费时间：', time_end - time_start)
         print('总的1分钟k线数据大小：' + str(len(BarDataList)))
         time_start = time_end
@@ -122,6 +131,8 @@ class ChanTuManager(QtWidgets.QWidget):
                 self.render_html(chan_strategy, setting['include'])
             i += 1
         self.render_html(chan_strategy, setting['include'])
+        if not self.state:
+            chan_strategy.save_checkpoint(checkpoint_path)
         chan_map = chan_strategy.chan_freq_map
         for freq in chan_map:
             chan = chan_map[freq]
@@ -135,39 +146,20 @@ class ChanTuManager(QtWidgets.QWidget):
     def render_html(self, chan_strategy, include=True):
         chan_map = chan_strategy.chan_freq_map
         for freq in chan_map:
-            klist = pd.DataFrame(columns=["date", "open", "close", "low", "high", "volume"], dtype=object)
-            chan = chan_map[freq]
-            format_str = '%Y-%m-%d %H:%M'
-            if freq == FREQS[0]:
-                format_str = '%Y-%m-%d'
-            for k in chan.chan_k_list:
-                klist = klist.append({
-                    "date": k.datetime.strftime(format_str), "open": k.open_price, "close": k.close_price,
-                    "low": k.low_price,
-                    "high": k.high_price, "volume": k.volume
-                }, ignore_index=True)
-            bl = self.reFormatBS(chan.buy_list, format_str)
-            sl = self.reFormatBS(chan.sell_list, format_str)
-            if len(klist) <= 0:
+            payload = build_render_payload(chan_map[freq], freq)
+            if payload is None:
                 continue
-            dif, dea, macd = tl.MACD(klist['close'].values, fastperiod=12, slowperiod=26, signalperiod=9)
-            Macd = {}
-            macd *= 2
-            Macd['dif'] = dif.tolist()
-            Macd['dea'] = dea.tolist()
-            Macd['macd'] = macd.tolist()
-            Macd = json.dumps(Macd)
             self.ans = self.plot(
-                klist.to_json(orient='split'),
-                self.reFormatLine(chan.stroke_list, format_str),
-                self.reFormatLine(chan.line_list, format_str),
-                self.reFormatPivot(chan.pivot_list, format_str),
+                payload['kline'],
+                payload['bi'],
+                payload['xd'],
+                payload['zs'],
                 [],
                 [],
                 [],
-                Macd,
-                bl,
-                sl,
+                payload['macd'],
+                payload['bl'],
+                payload['sl'],
                 [],
                 []
             )
@@ -435,34 +427,6 @@ class ChanTuManager(QtWidgets.QWidget):
         rePivotList += "]"
         return rePivotList
 
-    def reFormatPivot(self, pivot, format_str):
-        reformatpivot = []
-        for Item in pivot:
-            reformatpivot.append(
-                [Item[0].strftime(format_str), Item[1].strftime(format_str), Item[2], Item[3]])
-        return reformatpivot
-
-    def reFormatLine(self, line, format_str):
-        reformatline = []
-        for Item in line:
-            if Item[3] == 'up':
-                reformatline.append([Item[2].strftime(format_str), Item[0]])
-            else:
-                reformatline.append([Item[2].strftime(format_str), Item[1]])
-        return reformatline
-
-    def reFormatBS(self, BS, format_str):
-        rebs = []
-        for bs in BS:
-            valid = '有效'
-            if bs[5] == 0:
-                valid = '无效'
-                rebs.append([bs[0].strftime(format_str), bs[1], bs[2], bs[3].strftime(format_str),
-                             valid + ':' + bs[6].strftime(format_str), bs[7], bs[8]])
-            else:
-                rebs.append([bs[0].strftime(format_str), bs[1], bs[2], bs[3].strftime(format_str), '', bs[7], bs[8]])
-        return rebs
-
     def reFormatBuyAndSell(self, buy, sell):
         """将买卖点列表更改为js指定格式字符串。"""
         reBuyList_1 = "["
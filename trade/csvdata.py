@@ -0,0 +1,148 @@
+"""
+离线k线：读取trade/data/股票代码/下的月度csv(文件名为当月第一天，如2020-01-01.csv，列为date, open, high, low, close,
+volume)。多个月份并行读取，最后合并一次；每个csv第一次读取后保存为二进制缓存，之后不再解析csv。
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+import pandas
+
+from trade.constant import Exchange, Interval
+from trade.utility import BarStore, get_folder_path
+
+# 缓存的列，date为墙上时间距1970-01-01的微秒数
+CSV_COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+
+
+def get_month_files(folder: Path, start: date = None, end: date = None) -> List[Path]:
+    """folder下和[start, end]有重叠的月度csv，按月份排序"""
+    files = []
+    for file in folder.glob('*.csv'):
+        try:
+            month = datetime.strptime(file.stem, '%Y-%m-%d').date()
+        except ValueError:
+            continue
+        next_month = (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+        if start and next_month <= start:
+            continue
+        if end and month > end:
+            continue
+        files.append((month, file))
+    return [file for month, file in sorted(files)]
+
+
+def get_source_key(file: Path) -> Tuple[int, int]:
+    stat = file.stat()
+    return stat.st_mtime_ns, stat.st_size
+
+
+def read_month(file: Path, cache_file: Path) -> Dict[str, np.ndarray]:
+    """解析一个月度csv，写入缓存，返回各列"""
+    df = pandas.read_csv(str(file))
+    columns = {'date': pandas.to_datetime(df['date'], format='%Y-%m-%d %H:%M:%S').values.astype('datetime64[us]')
+               .view('int64')}
+    for name in CSV_COLUMNS:
+        columns[name] = df[name].to_numpy(dtype='float64')
+    mtime, size = get_source_key(file)
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = cache_file.with_name(cache_file.stem + '.tmp.npz')
+    np.savez(str(tmp_file), source=np.array([mtime, size], dtype='int64'), **columns)
+    os.replace(str(tmp_file), str(cache_file))
+    return columns
+
+
+def load_month_cache(file: Path, cache_file: Path):
+    """缓存存在且csv没有修改时返回各列，否则返回None"""
+    if not cache_file.exists():
+        return None
+    with np.load(str(cache_file)) as data:
+        if tuple(data['source'].tolist()) != get_source_key(file):
+            return None
+        return {name: data[name] for name in ['date'] + CSV_COLUMNS}
+
+
+class CsvLoader:
+    """
+    For:
+    1. loading monthly 1-minute csv files of any symbol and date range under data_dir
+    2. keeping a binary copy of every parsed csv, so later loads skip csv parsing
+
+    Notice:
+    1. the cache of a month is rebuilt when its csv changes (mtime or size)
+    2. months without a valid cache are parsed in a process pool (workers=0 parses in the calling process)
+    3. the months are concatenated once at the end
+    """
+
+    def __init__(self, data_dir: Union[str, Path] = 'trade/data', cache_dir: Union[str, Path] = None,
+                 workers: int = None):
+        self.data_dir = Path(data_dir)
+        self.cache_dir = Path(cache_dir) if cache_dir else get_folder_path('csv_cache')
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+
+    def get_cache_file(self, symbol: str, file: Path) -> Path:
+        return self.cache_dir.joinpath(symbol, file.stem + '.npz')
+
+    def load_columns(self, symbol: str, start: date = None, end: date = None) -> Dict[str, np.ndarray]:
+        """[start, end]内的各列，date为微秒数，按时间排序"""
+        start = start.date() if isinstance(start, datetime) else start
+        end = end.date() if isinstance(end, datetime) else end
+        files = get_month_files(self.data_dir.joinpath(symbol), start, end)
+        months: List[Dict[str, np.ndarray]] = [None] * len(files)
+        todo = []
+        for i, file in enumerate(files):
+            cache_file = self.get_cache_file(symbol, file)
+            months[i] = load_month_cache(file, cache_file)
+            if months[i] is None:
+                todo.append((i, file, cache_file))
+
+        if len(todo) > 1 and self.workers > 0:
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(todo))) as executor:
+                futures = [(i, executor.submit(read_month, file, cache_file)) for i, file, cache_file in todo]
+                for i, future in futures:
+                    months[i] = future.result()
+        else:
+            for i, file, cache_file in todo:
+                months[i] = read_month(file, cache_file)
+
+        names = ['date'] + CSV_COLUMNS
+        if not months:
+            return {name: np.zeros(0, dtype='int64' if name == 'date' else 'float64') for name in names}
+        columns = {name: np.concatenate([month[name] for month in months]) for name in names}
+        order = np.argsort(columns['date'], kind='stable')
+        dt_array = columns['date'][order]
+        left = 0
+        right = len(dt_array)
+        if start:
+            left = int(np.searchsorted(dt_array, np.datetime64(start, 'us').astype('int64'), 'left'))
+        if end:
+            right = int(np.searchsorted(dt_array, np.datetime64(end + timedelta(days=1), 'us').astype('int64'),
+                                        'left'))
+        index = order[left:right]
+        return {name: columns[name][index] for name in names}
+
+    def load_frame(self, symbol: str, start: date = None, end: date = None) -> pandas.DataFrame:
+        """和csv相同列的DataFrame，date为datetime64"""
+        columns = self.load_columns(symbol, start, end)
+        return pandas.DataFrame({
+            'date': columns['date'].astype('datetime64[us]'),
+            'open': columns['open'],
+            'close': columns['close'],
+            'low': columns['low'],
+            'high': columns['high'],
+            'volume': columns['volume'],
+        }, columns=['date', 'open', 'close', 'low', 'high', 'volume'])
+
+    def load_store(self, symbol: str, exchange: Exchange, start: date = None, end: date = None) -> BarStore:
+        """1分钟k线的BarStore，整列写入，不生成BarData"""
+        columns = self.load_columns(symbol, start, end)
+        store = BarStore(max(len(columns['date']), 1))
+        store.symbol = symbol
+        store.exchange = exchange
+        store.interval = Interval.MINUTE
+        store.extend_arrays(columns['date'], columns['open'], columns['high'], columns['low'], columns['close'],
+                            columns['volume'])
+        return store
@@ -9,6 +9,7 @@ from trade.constant import (
 from trade.utility import load_json, save_json, extract_vt_symbol, round_to, check_run_time, trans_setting
 import os
 from trade.jqdata import jqdata_client
+from trade.object import BarData
 
 STOP_STATUS_MAP = {
     Status.SUBMITTING: StopOrderStatus.WAITING,
@@ -22,7 +23,8 @@ from .utility import get_folder_path, TRADER_DIR
 from collections import defaultdict
 from queue import Empty, Queue
 from threading import Thread
-from time import sleep
+from time import sleep, perf_counter
+from datetime import datetime
 from typing import Any, Callable, List
 
 EVENT_TIMER = "eTimer"
@@ -46,7 +48,14 @@ class MainEngine:
         self._thread: Thread = Thread(target=self._run)
         self._timer: Thread = Thread(target=self._run_timer)
         self._bar: Thread = Thread(target=self._run_bar)
-        self._bar_map: defaultdict = defaultdict(str)
+        # 每个股票最后推送的1分钟k线时间，只推送更新的k线
+        self._bar_map: Dict[str, datetime] = {}
+        # 行情轮询间隔和每次请求的股票数
+        self.bar_poll_interval: int = 5
+        self.bar_chunk_size: int = 200
+        # 轮询统计：次数、推送的k线数、最近和最大的请求耗时
+        self.bar_stats: Dict[str, float] = {'polls': 0, 'bars': 0, 'errors': 0, 'last_latency': 0.0,
+                                            'max_latency': 0.0, 'total_latency': 0.0}
         self._handlers: defaultdict = defaultdict(list)
         self._symbol_set: Set[str] = set()
         self._general_handlers: List = []
@@ -70,14 +79,47 @@ class MainEngine:
 
     def _run_bar(self) -> None:
         while self._active:
-            if check_run_time():
-                for vt_symbol in self._symbol_set:
-                    data = jqdata_client.query_bar_xq(vt_symbol)
-                    if data and (not self._bar_map[vt_symbol] or self._bar_map[vt_symbol] != str(data.datetime)):
-                        event = Event(EVENT_BAR, data)
-                        self.put(event)
-                        self._bar_map[vt_symbol] = str(data.datetime)
-            sleep(5)
+            if check_run_time() and self._symbol_set:
+                self.poll_bars()
+            sleep(self.bar_poll_interval)
+
+    def poll_bars(self) -> List[BarData]:
+        """所有订阅股票一起查询最新k线，只推送比上次新的，同一分钟的k线一起推送"""
+        symbols = list(self._symbol_set)
+        start = perf_counter()
+        try:
+            bars = jqdata_client.query_bars(symbols, self.bar_chunk_size)
+        except Exception as ex:
+            self.bar_stats['errors'] += 1
+            self.write_log("行情查询失败：" + repr(ex))
+            return []
+        latency = perf_counter() - start
+        stats = self.bar_stats
+        stats['polls'] += 1
+        stats['last_latency'] = latency
+        stats['max_latency'] = max(stats['max_latency'], latency)
+        stats['total_latency'] += latency
+
+        new_bars = []
+        for vt_symbol in symbols:
+            bar = bars.get(vt_symbol)
+            if not bar:
+                continue
+            last_datetime = self._bar_map.get(vt_symbol)
+            if last_datetime is None or bar.datetime > last_datetime:
+                self._bar_map[vt_symbol] = bar.datetime
+                new_bars.append(bar)
+        for bar in new_bars:
+            self.put(Event(EVENT_BAR, bar))
+        stats['bars'] += len(new_bars)
+        return new_bars
+
+    def get_bar_stats(self) -> dict:
+        """行情轮询的统计，avg_latency为平均请求耗时(秒)"""
+        stats = dict(self.bar_stats)
+        stats['avg_latency'] = stats['total_latency'] / stats['polls'] if stats['polls'] else 0.0
+        stats['symbols'] = len(self._symbol_set)
+        return stats
 
     def _run_timer(self) -> None:
         while self._active:
@@ -90,6 +132,7 @@ class MainEngine:
 
     def unsubscribe(self, vt_sybmol: str) -> None:
         self._symbol_set.remove(vt_sybmol)
+        self._bar_map.pop(vt_sybmol, None)
 
     def start(self) -> None:
         self._active = True
@@ -1,7 +1,8 @@
 import json
 import calendar
 from datetime import timedelta, datetime
-from typing import List, Optional
+from typing import Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
 import time
 import pandas
 from pytz import timezone
@@ -9,6 +10,10 @@ from numpy import ndarray
 import jqdatasdk as jq
 from trade.constant import Exchange, Interval
 from trade.object import BarData, HistoryRequest
+from trade.barcache import BarCache, store_to_frame
+from trade.csvdata import CsvLoader
+from trade.provider import DataProvider
+from trade.utility import BarStore, parse_vt_symbol
 from pathlib import Path
 
 INTERVAL_VT2RQ = {
@@ -33,6 +38,13 @@ class JqdataClient:
 
         self.inited: bool = False
         self.symbols: ndarray = None
+        # 历史k线先查本地缓存，只请求缺少的日期
+        self.use_cache: bool = True
+        self.cache: BarCache = None
+        # 离线的月度csv
+        self.csv_loader: CsvLoader = None
+        # 所有聚宽请求经过这里：限速、并发上限、超时重试、相同请求合并
+        self.provider: DataProvider = DataProvider(jq)
 
     def init(self, username: str = "", password: str = "") -> bool:
         if self.inited:
@@ -46,7 +58,7 @@ class JqdataClient:
             return False
 
         try:
-            jq.auth(self.username, self.password)
+            self.provider.auth(self.username, self.password)
             print("jq auth success.")
             self.inited = True
 
@@ -116,46 +128,25 @@ class JqdataClient:
         # For adjust timestamp from bar close point (JQData) to open point
         adjustment = INTERVAL_ADJUSTMENT_MAP[interval]
 
-        # For querying night trading period data
-        end += timedelta(1)
-
         # Only query open interest for futures contract
         fields = ["open", "high", "low", "close", "volume"]
 
-        data: List[BarData] = []
-        df = self.merge_data()
+        data = BarStore()
+        df = self.merge_data(symbol, start, end)
         if df is not None:
-            for ix, row in df.iterrows():
-                bar = BarData(
-                    symbol=symbol,
-                    exchange=exchange,
-                    interval=interval,
-                    datetime=datetime.strptime(row["date"], '%Y-%m-%d %H:%M:%S'),
-                    open_price=row["open"],
-                    high_price=row["high"],
-                    low_price=row["low"],
-                    close_price=row["close"],
-                    volume=row["volume"],
-                    open_interest=row.get("open_interest", 0),
-                    gateway_name="JQ"
-                )
-
-                data.append(bar)
+            # csv里是不带时区的时间
+            data = frame_to_store(df, symbol, exchange, interval, datetime_column="date")
 
         return df, data
 
     def query_bar(self, vt_symbol: str) -> Optional[BarData]:
         # if self.symbols is None:
         #     return None
-        symbol_list = vt_symbol.split('.')
-        symbol = symbol_list[0]
-        exchange = Exchange.SSE
-        if symbol_list[1] == 'SZSE':
-            exchange = Exchange.SZSE
+        symbol, exchange = parse_vt_symbol(vt_symbol)
 
         jq_symbol = self.to_jq_symbol(symbol, exchange)
 
-        df = jq.get_price(
+        df = self.provider.get_price(
             jq_symbol,
             frequency=INTERVAL_VT2RQ.get(Interval.MINUTE),
             fields=["open", "high", "low", "close", "volume"],
@@ -166,38 +157,103 @@ class JqdataClient:
 
         data: BarData = None
 
-        if df is not None:
-            for ix, row in df.iterrows():
-                dt = row.name.to_pydatetime()
-                dt = CHINA_TZ.localize(dt)
-
-                data = BarData(
-                    symbol=symbol,
-                    exchange=exchange,
-                    interval=Interval.MINUTE,
-                    datetime=dt,
-                    open_price=row["open"],
-                    high_price=row["high"],
-                    low_price=row["low"],
-                    close_price=row["close"],
-                    volume=row["volume"],
-                    open_interest=row.get("open_interest", 0)
-                )
+        if df is not None and len(df):
+            # 只要最后一根
+            data = frame_to_store(df.iloc[-1:], symbol, exchange, Interval.MINUTE, CHINA_TZ)[-1]
 
         return data
         # return self.query_bar_xq(vt_symbol)
 
+    def query_bars(self, vt_symbols: List[str], chunk_size: int = 200, workers: int = 4) -> Dict[str, BarData]:
+        """
+        多个股票最新的1分钟k线，{vt_symbol: BarData}。
+        每chunk_size个股票一次get_price，多个chunk并发请求；600000和600000.SSE这样对应同一个聚宽代码的只请求一次，都有结果。
+        """
+        # 聚宽代码 -> [(vt_symbol, symbol, exchange)]
+        code_map = {}
+        for vt_symbol in vt_symbols:
+            symbol, exchange = parse_vt_symbol(vt_symbol)
+            code_map.setdefault(self.to_jq_symbol(symbol, exchange), []).append((vt_symbol, symbol, exchange))
+        codes = list(code_map.keys())
+        chunks = [codes[i:i + chunk_size] for i in range(0, len(codes), chunk_size)]
+        if len(chunks) > 1 and workers > 1:
+            with ThreadPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+                frames = list(executor.map(self.query_latest_price, chunks))
+        else:
+            frames = [self.query_latest_price(chunk) for chunk in chunks]
+
+        ans = {}
+        tzinfo = get_tzinfo(CHINA_TZ)
+        for df in frames:
+            if df is None or not len(df):
+                continue
+            # 每个股票只要最后一根
+            df = df.sort_values("time", kind="mergesort").drop_duplicates("code", keep="last")
+            times = pandas.DatetimeIndex(df["time"]).to_pydatetime()
+            for dt, code, open_price, high_price, low_price, close_price, volume in zip(
+                    times, df["code"], df["open"], df["high"], df["low"], df["close"], df["volume"]):
+                for vt_symbol, symbol, exchange in code_map.get(code, ()):
+                    ans[vt_symbol] = BarData(
+                        symbol=symbol,
+                        exchange=exchange,
+                        interval=Interval.MINUTE,
+                        datetime=dt.replace(tzinfo=tzinfo),
+                        open_price=float(open_price),
+                        high_price=float(high_price),
+                        low_price=float(low_price),
+                        close_price=float(close_price),
+                        volume=float(volume)
+                    )
+        return ans
+
+    def query_latest_price(self, codes: List[str]) -> Optional[pandas.DataFrame]:
+        """一组聚宽代码最新的1分钟k线，长表格式：time, code, open, high, low, close, volume"""
+        return self.provider.get_price(
+            codes,
+            frequency=INTERVAL_VT2RQ.get(Interval.MINUTE),
+            fields=["open", "high", "low", "close", "volume"],
+            end_date=datetime.now(),
+            count=1,
+            skip_paused=True,
+            panel=False
+        )
+
+    def get_quota(self) -> dict:
+        """聚宽当天的查询额度{'total': 总条数, 'spare': 剩余条数}"""
+        return self.provider.get_query_count()
 
     def is_trade_day(self) -> bool:
         yd = datetime.now() - timedelta(days=1)
-        days = jq.get_trade_days(start_date=yd.date(), end_date=None)
+        days = self.provider.get_trade_days(start_date=yd.date(), end_date=None)
         if days and len(days) > 0:
             return True
         return False
 
+    def get_cache(self) -> BarCache:
+        if self.cache is None:
+            self.cache = BarCache(self.fetch_price)
+        return self.cache
+
+    def fetch_price(self, symbol: str, exchange: Exchange, interval: Interval, start, end) -> pandas.DataFrame:
+        """从聚宽取[start, end]这些天的k线，供缓存补齐缺少的日期"""
+        return self.provider.get_price(
+            self.to_jq_symbol(symbol, exchange),
+            frequency=INTERVAL_VT2RQ.get(interval),
+            fields=["open", "high", "low", "close", "volume"],
+            start_date=start,
+            end_date=end + timedelta(1),
+            skip_paused=True
+        )
+
     def query_history(self, req: HistoryRequest) -> Optional[List[BarData]]:
         # if self.symbols is None:
         #     return None
+        if self.use_cache and req.interval in INTERVAL_VT2RQ:
+            # 缓存里是墙上时间，取出时加上北京时间的时区
+            store = self.get_cache().query(req.symbol, req.exchange, req.interval, req.start, req.end,
+                                           get_tzinfo(CHINA_TZ))
+            return store_to_frame(store), store
+
         symbol = req.symbol
         exchange = req.exchange
         interval = req.interval
@@ -220,7 +276,7 @@ class JqdataClient:
         if not symbol.isdigit():
             fields.append("open_interest")
 
-        df = jq.get_price(
+        df = self.provider.get_price(
             jq_symbol,
             frequency=jq_interval,
             fields=["open", "high", "low", "close", "volume"],
@@ -229,46 +285,19 @@ class JqdataClient:
             skip_paused=True
         )
 
-        data: List[BarData] = []
+        data = BarStore()
 
         if df is not None:
-            for ix, row in df.iterrows():
-                dt = row.name.to_pydatetime()
-                dt = CHINA_TZ.localize(dt)
-
-                bar = BarData(
-                    symbol=symbol,
-                    exchange=exchange,
-                    interval=interval,
-                    datetime=dt,
-                    open_price=row["open"],
-                    high_price=row["high"],
-                    low_price=row["low"],
-                    close_price=row["close"],
-                    volume=row["volume"],
-                    open_interest=row.get("open_interest", 0)
-                )
-
-                data.append(bar)
+            data = frame_to_store(df, symbol, exchange, interval, CHINA_TZ)
 
         return df, data
 
-    def merge_data(self):
+    def merge_data(self, symbol: str = '600809', start=None, end=None) -> pandas.DataFrame:
+        """读取trade/data/symbol/下[start, end]的月度csv，第一次读取后使用二进制缓存"""
         time_start = time.time()
-        symbol = '600809'
-        cwd = Path.cwd()
-        temp_path = cwd.joinpath('trade/data/' + symbol)
-        year_start = 2016
-        year_end = 2022
-        month_start = 1
-        month_end = 13
-        df = pandas.DataFrame(columns=["date", "open", "close", "low", "high", "volume"], dtype=object)
-        for year in range(year_start, year_end):
-            for month in range(month_start, month_end):
-                firstDay, lastDay = getMonthFirstDayAndLastDay(year, month)
-                file = str(temp_path) + '/' + firstDay.strftime("%Y-%m-%d") + '.csv'
-                if Path(file).exists():
-                    df = pandas.concat([df, pandas.read_csv(file)], sort=True)
+        if self.csv_loader is None:
+            self.csv_loader = CsvLoader(Path.cwd().joinpath('trade/data'))
+        df = self.csv_loader.load_frame(symbol, start, end)
         time_end = time.time()
         print('totally cost', time_end - time_start)
         return df
@@ -277,6 +306,48 @@ class JqdataClient:
 jqdata_client = JqdataClient()
 
 
+def get_tzinfo(tz):
+    """pytz的时区要localize之后才是正确的偏移(北京时间+8:00)，k线的时区对整段数据只取一次"""
+    if hasattr(tz, 'localize'):
+        return tz.localize(datetime.now()).tzinfo
+    return tz
+
+
+def frame_to_store(df: pandas.DataFrame, symbol: str, exchange: Exchange, interval: Interval, tz=None,
+                   datetime_column: str = None) -> BarStore:
+    """
+    聚宽get_price的DataFrame(按时间索引)或者csv读出的DataFrame(datetime_column列)整列转换成BarStore。
+    时间列一次转换，BarData在取用时才生成；带时区的时间先转换到tz再取墙上时间。
+    """
+    if datetime_column:
+        dt_index = pandas.DatetimeIndex(pandas.to_datetime(df[datetime_column]))
+    else:
+        dt_index = pandas.DatetimeIndex(df.index)
+    if dt_index.tz is not None:
+        if tz is not None:
+            dt_index = dt_index.tz_convert(tz)
+        dt_index = dt_index.tz_localize(None)
+    store = BarStore(max(len(df), 1))
+    store.symbol = symbol
+    store.exchange = exchange
+    store.interval = interval
+    store.tzinfo = get_tzinfo(tz)
+    if "open_interest" in df.columns:
+        open_interest = df["open_interest"].fillna(0).to_numpy(dtype="float64")
+    else:
+        open_interest = 0
+    store.extend_arrays(
+        dt_index.values.astype("datetime64[us]"),
+        df["open"].to_numpy(dtype="float64"),
+        df["high"].to_numpy(dtype="float64"),
+        df["low"].to_numpy(dtype="float64"),
+        df["close"].to_numpy(dtype="float64"),
+        df["volume"].to_numpy(dtype="float64"),
+        open_interest
+    )
+    return store
+
+
 def getMonthFirstDayAndLastDay(year=None, month=None):
     """
     :param year: 年份，默认是本年，可传int或str类型
@@ -0,0 +1,282 @@
+"""
+聚宽接口的本地替身和压测：FakeJqApi实现JqdataClient用到的jqdatasdk函数，可以模拟延迟、失败、并发上限和每日额度。
+
+    python -m trade.jqfake --threads 16 --requests 400 --latency 0.05 --fail-rate 0.05 --rate 50
+    python -m trade.jqfake --client --symbols 500
+
+第一种直接通过DataProvider压测get_price，第二种用jqdata_client.query_bars轮询多个股票(没有安装jqdatasdk时用替身代替)。
+输出一行json：吞吐、延迟分位数、DataProvider和替身的统计。
+"""
+import argparse
+import importlib.util
+import json
+import random
+import sys
+import threading
+import time
+import types
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import List
+
+import numpy as np
+import pandas
+
+from trade.provider import DataProvider
+
+
+class FakeJqError(Exception):
+    pass
+
+
+def _to_timestamp(value) -> pandas.Timestamp:
+    return pandas.Timestamp(value) if value is not None else pandas.Timestamp(datetime.now())
+
+
+def _trade_days(start: pandas.Timestamp, end: pandas.Timestamp) -> List[pandas.Timestamp]:
+    """[start, end]内的周一到周五"""
+    return [day for day in pandas.date_range(start.normalize(), end.normalize(), freq='D') if day.weekday() < 5]
+
+
+def _minutes(day: pandas.Timestamp) -> pandas.DatetimeIndex:
+    """A股一天240根1分钟k线的时间(k线结束时间)"""
+    morning = pandas.date_range(day + pandas.Timedelta('09:31:00'), periods=120, freq='min')
+    afternoon = pandas.date_range(day + pandas.Timedelta('13:01:00'), periods=120, freq='min')
+    return morning.append(afternoon)
+
+
+class FakeJqApi:
+    """
+    For:
+    1. standing in for jqdatasdk offline: auth, get_price, get_trade_days, get_all_securities, get_query_count
+    2. simulating latency (lognormal around latency), random failures, a concurrency limit and a daily quota
+
+    Notice:
+    1. prices are a deterministic function of the code and the bar time, so repeated queries return the same bars
+    2. days are Monday to Friday, holidays are not modelled
+    3. stats counts calls, failures, rejected calls and the highest concurrency seen
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.5, fail_rate: float = 0.0, max_concurrent: int = 0,
+                 quota: int = 1000000, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.max_concurrent = max_concurrent
+        self.quota = quota
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.concurrent = 0
+        self.stats = {'calls': 0, 'failures': 0, 'rejected': 0, 'max_concurrent': 0}
+
+    def _enter(self) -> None:
+        with self.lock:
+            self.stats['calls'] += 1
+            if self.stats['calls'] > self.quota:
+                self.stats['rejected'] += 1
+                raise FakeJqError('超过每日查询额度')
+            if self.max_concurrent and self.concurrent >= self.max_concurrent:
+                self.stats['rejected'] += 1
+                raise FakeJqError('并发请求过多')
+            self.concurrent += 1
+            self.stats['max_concurrent'] = max(self.stats['max_concurrent'], self.concurrent)
+            delay = self.latency * self.random.lognormvariate(0, self.jitter) if self.latency else 0
+            fail = self.random.random() < self.fail_rate
+        try:
+            if delay:
+                time.sleep(delay)
+            if fail:
+                with self.lock:
+                    self.stats['failures'] += 1
+                raise FakeJqError('模拟的网络错误')
+        finally:
+            with self.lock:
+                self.concurrent -= 1
+
+    def auth(self, username: str, password: str) -> None:
+        self._enter()
+
+    def get_query_count(self) -> dict:
+        with self.lock:
+            return {'total': self.quota, 'spare': max(self.quota - self.stats['calls'], 0)}
+
+    def get_trade_days(self, start_date=None, end_date=None, count=None) -> np.ndarray:
+        self._enter()
+        end = _to_timestamp(end_date)
+        if count:
+            start = end - pandas.Timedelta(days=count * 2 + 7)
+            days = _trade_days(start, end)[-count:]
+        else:
+            days = _trade_days(_to_timestamp(start_date), end)
+        return np.array([day.date() for day in days])
+
+    def get_all_securities(self, types=None, date=None) -> pandas.DataFrame:
+        self._enter()
+        codes = ['%06d.XSHG' % i for i in range(600000, 600100)] + ['%06d.XSHE' % i for i in range(1, 101)]
+        return pandas.DataFrame({'display_name': codes, 'type': 'stock'}, index=codes)
+
+    def get_price(self, security, start_date=None, end_date=None, frequency='daily', fields=None, skip_paused=False,
+                  fq='pre', count=None, panel=True, **kwargs) -> pandas.DataFrame:
+        self._enter()
+        fields = fields or ['open', 'close', 'high', 'low', 'volume', 'money']
+        if isinstance(security, (list, tuple)):
+            frames = []
+            for code in security:
+                df = self._price_frame(code, start_date, end_date, frequency, fields, count)
+                df.insert(0, 'code', code)
+                df.insert(0, 'time', df.index)
+                frames.append(df.reset_index(drop=True))
+            if not frames:
+                return pandas.DataFrame(columns=['time', 'code'] + list(fields))
+            return pandas.concat(frames, ignore_index=True)
+        return self._price_frame(security, start_date, end_date, frequency, fields, count)
+
+    def _price_frame(self, code: str, start_date, end_date, frequency: str, fields: List[str],
+                     count: int) -> pandas.DataFrame:
+        end = _to_timestamp(end_date)
+        if count:
+            start = end - pandas.Timedelta(days=count // 240 * 2 + 7)
+        else:
+            start = _to_timestamp(start_date)
+        days = _trade_days(start, end)
+        if count and frequency not in ('1d', 'daily'):
+            # 只生成最后几天的分钟
+            days = days[-(count // 240 + 2):]
+        if frequency in ('1d', 'daily'):
+            index = pandas.DatetimeIndex(days)
+        else:
+            index = pandas.DatetimeIndex([]) if not days else _minutes(days[0]).append(
+                [_minutes(day) for day in days[1:]])
+        index = index[(index >= start) & (index <= end)]
+        if count:
+            index = index[-count:]
+        # 价格只和代码、时间有关
+        seed = zlib.crc32(code.encode()) % 1000
+        minutes = index.asi8 // 60000000000
+        base = 10 + seed / 100 + np.sin(minutes / 240.0 + seed) * 2 + (minutes % 97) / 1000
+        columns = {
+            'open': np.round(base, 2),
+            'close': np.round(base + 0.01, 2),
+            'high': np.round(base + 0.03, 2),
+            'low': np.round(base - 0.02, 2),
+            'volume': (minutes % 1000 + 100).astype('float64') * 100,
+            'money': np.round(base * 10000, 2),
+        }
+        return pandas.DataFrame({name: columns[name] for name in fields if name in columns}, index=index)
+
+
+def install(api: FakeJqApi = None) -> FakeJqApi:
+    """
+    没有安装jqdatasdk时，用替身注册一个jqdatasdk模块，之后可以正常import trade.jqdata。只用于离线测试和压测。
+    """
+    api = api or FakeJqApi()
+    if 'jqdatasdk' in sys.modules or importlib.util.find_spec('jqdatasdk') is not None:
+        return api
+    module = types.ModuleType('jqdatasdk')
+    for name in ['auth', 'get_price', 'get_trade_days', 'get_all_securities', 'get_query_count']:
+        setattr(module, name, getattr(api, name))
+    sys.modules['jqdatasdk'] = module
+    return api
+
+
+def percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def bench_provider(provider: DataProvider, requests: int, threads: int, symbols: int, dup: float,
+                   seed: int = 0) -> dict:
+    """多线程通过provider请求get_price，dup比例的请求和之前的请求相同，用于观察合并效果"""
+    rnd = random.Random(seed)
+    codes = ['%06d.XSHG' % (600000 + i) for i in range(symbols)]
+    tasks = []
+    for i in range(requests):
+        if tasks and rnd.random() < dup:
+            tasks.append(tasks[rnd.randrange(max(len(tasks) - threads, 0), len(tasks))])
+        else:
+            day = date(2021, 1, 4) + timedelta(days=rnd.randrange(300))
+            tasks.append((rnd.choice(codes), day, day + timedelta(days=rnd.randrange(1, 10))))
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def run(task):
+        code, start, end = task
+        begin = time.perf_counter()
+        try:
+            provider.get_price(code, start_date=start, end_date=end, frequency='1m',
+                               fields=['open', 'high', 'low', 'close', 'volume'], skip_paused=True)
+        except Exception:
+            with lock:
+                errors[0] += 1
+        with lock:
+            latencies.append(time.perf_counter() - begin)
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(run, tasks))
+    elapsed = time.perf_counter() - start_time
+    return {
+        'requests': requests,
+        'errors': errors[0],
+        'seconds': elapsed,
+        'throughput': requests / elapsed if elapsed else 0.0,
+        'p50': percentile(latencies, 50),
+        'p90': percentile(latencies, 90),
+        'p99': percentile(latencies, 99),
+        'max': max(latencies) if latencies else 0.0,
+    }
+
+
+def bench_client(symbols: int, polls: int) -> dict:
+    """用jqdata_client.query_bars轮询symbols个股票polls次"""
+    from trade.jqdata import jqdata_client
+    vt_symbols = ['%06d.SSE' % (600000 + i) for i in range(symbols)]
+    latencies = []
+    for i in range(polls):
+        begin = time.perf_counter()
+        bars = jqdata_client.query_bars(vt_symbols)
+        latencies.append(time.perf_counter() - begin)
+    return {'symbols': symbols, 'polls': polls, 'bars': len(bars), 'p50': percentile(latencies, 50),
+            'max': max(latencies) if latencies else 0.0}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='聚宽替身压测')
+    parser.add_argument('--requests', type=int, default=400, help='请求数')
+    parser.add_argument('--threads', type=int, default=16, help='发起请求的线程数')
+    parser.add_argument('--symbols', type=int, default=50, help='股票数')
+    parser.add_argument('--dup', type=float, default=0.2, help='重复请求的比例')
+    parser.add_argument('--latency', type=float, default=0.05, help='替身的平均延迟(秒)')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='替身的失败比例')
+    parser.add_argument('--max-concurrent', type=int, default=0, help='替身的并发上限，0表示不限')
+    parser.add_argument('--rate', type=float, default=50, help='DataProvider每秒请求数，0表示不限速')
+    parser.add_argument('--burst', type=float, default=None, help='令牌桶容量，默认等于rate')
+    parser.add_argument('--workers', type=int, default=4, help='DataProvider的并发请求数')
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--timeout', type=float, default=10)
+    parser.add_argument('--client', action='store_true', help='通过jqdata_client.query_bars轮询')
+    parser.add_argument('--polls', type=int, default=5, help='--client时的轮询次数')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    api = FakeJqApi(latency=args.latency, fail_rate=args.fail_rate, max_concurrent=args.max_concurrent,
+                    seed=args.seed)
+    provider = DataProvider(api, rate=args.rate, burst=args.burst, max_workers=args.workers,
+                            timeout=args.timeout, retries=args.retries, backoff=0.05)
+    if args.client:
+        install(api)
+        from trade.jqdata import jqdata_client
+        jqdata_client.provider = provider
+        result = bench_client(args.symbols, args.polls)
+    else:
+        result = bench_provider(provider, args.requests, args.threads, args.symbols, args.dup, args.seed)
+    result['provider'] = provider.get_stats()
+    result['api'] = dict(api.stats)
+    provider.close()
+    print(json.dumps(result, ensure_ascii=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,164 @@
+"""
+数据源调用层：限速(令牌桶)、并发上限、超时、带随机抖动的重试，以及相同请求合并。
+JqdataClient通过它调用jqdatasdk，也可以套在jqfake上做离线压测。
+"""
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, Tuple
+
+
+class ProviderError(Exception):
+    """重试之后仍然失败，cause为最后一次的异常"""
+
+    def __init__(self, name: str, attempts: int, cause: BaseException):
+        super().__init__('%s失败%d次：%r' % (name, attempts, cause))
+        self.name = name
+        self.attempts = attempts
+        self.cause = cause
+
+
+class TokenBucket:
+    """
+    For:
+    1. limiting the request rate to rate per second, with bursts up to capacity
+
+    Notice:
+    1. acquire blocks until a token is available, or returns False after timeout
+    2. thread safe
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.last_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_time) * self.rate)
+        self.last_time = now
+
+    def acquire(self, tokens: float = 1, timeout: float = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return True
+                wait = (tokens - self.tokens) / self.rate
+            if deadline is not None:
+                if now + wait > deadline:
+                    return False
+            time.sleep(wait)
+
+
+class DataProvider:
+    """
+    For:
+    1. calling a data api (jqdatasdk or a stand-in) as provider.get_price(...), provider.get_trade_days(...), ...
+    2. rate limit with a token bucket, at most max_workers requests in flight, timeout per request
+    3. retrying failed requests with exponential backoff and full jitter
+    4. coalescing: an identical request that is already in flight is not sent again, callers share its result
+
+    Notice:
+    1. a timed out request cannot be cancelled, its worker stays busy until the api returns, so a hung api
+       lowers the available concurrency instead of exceeding it
+    2. arguments are compared by repr for coalescing, requests with datetime.now() in them are never merged
+    3. stats counts requests, api calls, coalesced requests, retries, timeouts, failures and latency
+    """
+
+    def __init__(self, api: Any = None, rate: float = 10, burst: float = 20, max_workers: int = 4,
+                 timeout: float = 30, retries: int = 3, backoff: float = 0.5, max_backoff: float = 8,
+                 retry_exceptions: Tuple = (Exception,), no_retry: Tuple[str, ...] = ('auth', 'get_query_count')):
+        self.api = api
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='provider')
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_exceptions = retry_exceptions
+        self.no_retry = no_retry
+        self.random = random.Random()
+
+        self.lock = threading.Lock()
+        self.in_flight: Dict[str, Future] = {}
+        self.stats: Dict[str, float] = {'requests': 0, 'calls': 0, 'coalesced': 0, 'retries': 0, 'timeouts': 0,
+                                        'failures': 0, 'total_latency': 0.0, 'max_latency': 0.0}
+
+    def __getattr__(self, name: str) -> Callable:
+        if name.startswith('_') or self.__dict__.get('api') is None:
+            raise AttributeError(name)
+        return lambda *args, **kwargs: self.call(name, *args, **kwargs)
+
+    def call(self, name: str, *args, **kwargs):
+        """调用api.name(*args, **kwargs)，同样的请求正在进行时等待它的结果"""
+        key = repr((name, args, sorted(kwargs.items())))
+        with self.lock:
+            self.stats['requests'] += 1
+            future = self.in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.in_flight[key] = future
+            else:
+                self.stats['coalesced'] += 1
+        if not owner:
+            return future.result()
+
+        start = time.perf_counter()
+        try:
+            result = self._call_with_retry(name, args, kwargs)
+        except BaseException as ex:
+            future.set_exception(ex)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            latency = time.perf_counter() - start
+            with self.lock:
+                del self.in_flight[key]
+                self.stats['total_latency'] += latency
+                self.stats['max_latency'] = max(self.stats['max_latency'], latency)
+
+    def _call_with_retry(self, name: str, args: tuple, kwargs: dict):
+        retries = 0 if name in self.no_retry else self.retries
+        attempt = 0
+        while True:
+            attempt += 1
+            if self.bucket:
+                self.bucket.acquire()
+            with self.lock:
+                self.stats['calls'] += 1
+            worker = self.executor.submit(getattr(self.api, name), *args, **kwargs)
+            try:
+                return worker.result(timeout=self.timeout)
+            except FutureTimeoutError as ex:
+                error = ex
+                with self.lock:
+                    self.stats['timeouts'] += 1
+            except self.retry_exceptions as ex:
+                error = ex
+            if attempt > retries:
+                with self.lock:
+                    self.stats['failures'] += 1
+                raise ProviderError(name, attempt, error) from error
+            with self.lock:
+                self.stats['retries'] += 1
+            # 指数退避，在[0, 上限]之间随机，避免多个线程同时重试
+            time.sleep(self.random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1))))
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.stats)
+        finished = stats['requests'] - stats['coalesced']
+        stats['avg_latency'] = stats['total_latency'] / finished if finished else 0.0
+        return stats
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False)
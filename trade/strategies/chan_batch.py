@@ -0,0 +1,180 @@
+"""
+缠论批量计算，用于历史数据回填。
+结果和Chan_Class逐根k线(on_bar)处理完全一致，算完之后Chan_Class可以继续逐根处理实时k线。
+"""
+import numpy as np
+
+from .chan_object import FxData, UP, DOWN
+
+
+class IncludeResult:
+    """
+    k线包含处理的批量结果
+    open/high/low/close: 合并后的chan k线
+    bar_index: 每根chan k线最后合并进来的原始k线下标，日期、成交量取自这根k线
+    index_map: 原始k线下标 -> chan k线下标
+    cur_high/cur_low: 处理完每根原始k线时，最后一根chan k线的高低点(之后还可能被合并改变)
+    """
+    __slots__ = ('open', 'high', 'low', 'close', 'bar_index', 'index_map', 'cur_high', 'cur_low')
+
+    def __init__(self, open, high, low, close, bar_index, index_map, cur_high, cur_low):
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.bar_index = bar_index
+        self.index_map = index_map
+        self.cur_high = cur_high
+        self.cur_low = cur_low
+
+    def __len__(self):
+        return len(self.bar_index)
+
+
+def batch_include(high, low, open, close, include=True) -> IncludeResult:
+    """
+    对整段历史k线做包含处理，规则同Chan_Class.on_process_k_include：
+    前两根直接加入；之后和最后一根chan k线有包含关系就合并，
+    最后一根比倒数第二根高(向上)取高高，否则取低低。
+    """
+    high = np.asarray(high, dtype=float)
+    low = np.asarray(low, dtype=float)
+    open = np.asarray(open, dtype=float)
+    close = np.asarray(close, dtype=float)
+    n = len(high)
+    if not include:
+        index = np.arange(n)
+        return IncludeResult(open.copy(), high.copy(), low.copy(), close.copy(), index, index.copy(), high.copy(),
+                             low.copy())
+
+    # 包含判断是顺序依赖的，用python list逐个比较比numpy标量运算快得多
+    h_list = high.tolist()
+    l_list = low.tolist()
+    o_list = open.tolist()
+    c_list = close.tolist()
+    k_high = []
+    k_low = []
+    k_open = []
+    k_close = []
+    bar_index = []
+    index_map = [0] * n
+    cur_high = [0.0] * n
+    cur_low = [0.0] * n
+    pre_high = 0.0
+    last_high = last_low = last_open = last_close = 0.0
+    m = 0
+    for i in range(n):
+        bar_high = h_list[i]
+        bar_low = l_list[i]
+        if m >= 2 and ((last_high >= bar_high and last_low <= bar_low) or (
+                last_high <= bar_high and last_low >= bar_low)):
+            if last_high > pre_high:
+                last_high = max(last_high, bar_high)
+                last_low = max(last_low, bar_low)
+                last_open = max(last_open, o_list[i])
+                last_close = max(last_close, c_list[i])
+            else:
+                last_high = min(last_high, bar_high)
+                last_low = min(last_low, bar_low)
+                last_open = min(last_open, o_list[i])
+                last_close = min(last_close, c_list[i])
+            k_high[-1] = last_high
+            k_low[-1] = last_low
+            k_open[-1] = last_open
+            k_close[-1] = last_close
+            bar_index[-1] = i
+        else:
+            pre_high = last_high
+            last_high = bar_high
+            last_low = bar_low
+            last_open = o_list[i]
+            last_close = c_list[i]
+            k_high.append(last_high)
+            k_low.append(last_low)
+            k_open.append(last_open)
+            k_close.append(last_close)
+            bar_index.append(i)
+            m += 1
+        index_map[i] = m - 1
+        cur_high[i] = last_high
+        cur_low[i] = last_low
+
+    return IncludeResult(
+        np.array(k_open, dtype=float),
+        np.array(k_high, dtype=float),
+        np.array(k_low, dtype=float),
+        np.array(k_close, dtype=float),
+        np.array(bar_index, dtype=np.int64),
+        np.array(index_map, dtype=np.int64),
+        np.array(cur_high, dtype=float),
+        np.array(cur_low, dtype=float)
+    )
+
+
+class FxResult:
+    """
+    分型的批量结果，按Chan_Class.fx_list的追加顺序排列
+    bar: 产生分型时的原始k线下标
+    index: 分型所在的chan k线下标
+    direction: UP顶分型，DOWN底分型
+    high/low/datetime: 分型k线的高低点和日期(datetime64 墙上时间)
+    stroke: 是否是当根原始k线送进on_stroke的分型(同一根k线既是顶又是底时只送底分型)
+    """
+    __slots__ = ('bar', 'index', 'direction', 'high', 'low', 'datetime', 'stroke')
+
+    def __init__(self, bar, index, direction, high, low, datetime, stroke):
+        self.bar = bar
+        self.index = index
+        self.direction = direction
+        self.high = high
+        self.low = low
+        self.datetime = datetime
+        self.stroke = stroke
+
+    def __len__(self):
+        return len(self.index)
+
+    def to_fx_list(self, tzinfo=None) -> list:
+        """转换成fx_list里的FxData"""
+        dt_list = self.datetime.astype('datetime64[us]').tolist()
+        if tzinfo is not None:
+            dt_list = [dt.replace(tzinfo=tzinfo) for dt in dt_list]
+        return [FxData(high, low, dt, direction, index) for high, low, dt, direction, index in
+                zip(self.high.tolist(), self.low.tolist(), dt_list, self.direction.tolist(), self.index.tolist())]
+
+
+def batch_fx(include: IncludeResult, datetime) -> FxResult:
+    """
+    批量分型判断，规则同Chan_Class.on_process_fx：
+    每根原始k线处理完后，看倒数第二根chan k线是否高于(低于)前后两根，
+    最后一根chan k线用当时(还没被后面k线合并)的高低点，所以同一个分型可能出现多次。
+    datetime: 原始k线的日期序列
+    """
+    high = include.high
+    low = include.low
+    # 分型中间那根chan k线的下标，至少三根chan k线才判断
+    j = include.index_map - 1
+    valid = j >= 1
+    if valid.any():
+        j = np.where(valid, j, 1)
+        high_j = high[j]
+        low_j = low[j]
+        top = valid & (high_j >= include.cur_high) & (high_j >= high[j - 1])
+        bottom = valid & (low_j <= include.cur_low) & (low_j <= low[j - 1])
+    else:
+        top = bottom = valid
+
+    top_bar = np.nonzero(top)[0]
+    bottom_bar = np.nonzero(bottom)[0]
+    bar = np.concatenate((top_bar, bottom_bar))
+    direction = np.concatenate((np.full(len(top_bar), UP, dtype=np.int8),
+                                np.full(len(bottom_bar), DOWN, dtype=np.int8)))
+    # 同一根k线先追加顶分型再追加底分型
+    order = np.lexsort((-direction, bar))
+    bar = bar[order]
+    direction = direction[order]
+    index = j[bar]
+    stroke = np.ones(len(bar), dtype=bool)
+    stroke[:-1] = bar[1:] != bar[:-1]
+    return FxResult(bar, index, direction, high[index], low[index],
+                    np.asarray(datetime)[include.bar_index[index]], stroke)
@@ -0,0 +1,175 @@
+"""
+Chan_Batch和Chan_Strategy逐根回放的一致性检查。
+
+    python -m trade.strategies.chan_batch_check                  # 随机生成的1分钟k线
+    python -m trade.strategies.chan_batch_check --days 120 --seeds 1 2 3
+    python -m trade.strategies.chan_batch_check --csv trade/data/600809/2020-01-01.csv ...
+    python -m trade.strategies.chan_batch_check --days 400 --retention 3   # 清理旧结构后和完整回放比较
+
+csv格式同trade/data下的月度文件：date, open, high, low, close, volume
+"""
+import argparse
+import csv
+import sys
+import time
+from datetime import datetime
+from typing import List
+
+from trade.object import BarData
+from trade.constant import Exchange, Interval, FREQS
+from trade.chanlog import ChanLog
+from .chan_strategy import Chan_Strategy
+from .chan_batch_engine import Chan_Batch
+from .chan_sample import generate_sessions
+
+SETTINGS = [
+    {'include': True, 'build_pivot': False, 'qjt': True, 'gz': True},
+    {'include': True, 'build_pivot': True, 'qjt': True, 'gz': False},
+    {'include': False, 'build_pivot': False, 'qjt': False, 'gz': False},
+]
+
+STRUCTURES = ['fx_list', 'stroke_list', 'line_list', 'pivot_list', 'trend_list', 'buy_list', 'sell_list']
+
+# 清理后下标会平移，比较时去掉下标字段
+RETENTION_STRUCTURES = [('fx_list', ('index',)), ('stroke_list', ('index',)), ('line_list', ('index',)),
+                        ('pivot_list', ('enter', 'exit', 'buy', 'sell')), ('buy_list', ('index',)),
+                        ('sell_list', ('index',))]
+
+
+def load_csv_bars(files: List[str], symbol: str = '600000', exchange: Exchange = Exchange.SSE) -> List[BarData]:
+    """读取trade/data下格式的1分钟k线csv，按时间排序"""
+    bars = []
+    for file in files:
+        with open(file, newline='') as f:
+            for row in csv.DictReader(f):
+                bars.append(BarData(symbol=symbol, exchange=exchange, interval=Interval.MINUTE,
+                                    datetime=datetime.strptime(row['date'], '%Y-%m-%d %H:%M:%S'),
+                                    open_price=float(row['open']), high_price=float(row['high']),
+                                    low_price=float(row['low']), close_price=float(row['close']),
+                                    volume=float(row['volume'])))
+    bars.sort(key=lambda bar: bar.datetime)
+    return bars
+
+
+def _norm(data):
+    # 记录和list统一成list，浮点数统一精度，便于比较和打印
+    if isinstance(data, (list, tuple)) or hasattr(data, 'to_list'):
+        return [_norm(x) for x in data]
+    if isinstance(data, float):
+        return repr(round(data, 8))
+    return data
+
+
+def snapshot(chan_freq_map: dict) -> dict:
+    """各级别的k线和缠论结构"""
+    ans = {}
+    for freq, chan in chan_freq_map.items():
+        k_list = chan.chan_k_list
+        ans[(freq, 'chan_k_list')] = _norm(list(zip(k_list.datetime.tolist(), k_list.open.tolist(),
+                                                    k_list.high.tolist(), k_list.low.tolist(),
+                                                    k_list.close.tolist())))
+        for name in STRUCTURES:
+            ans[(freq, name)] = _norm(getattr(chan, name))
+        # macd按分型在chan_k_list中的位置保存，输出时转成日期
+        ans[(freq, 'macd')] = _norm(sorted((str(k_list.get_datetime(k)), v) for k, v in chan.macd.items()))
+    return ans
+
+
+def replay(bars: List[BarData], vt_symbol: str, setting: dict) -> dict:
+    """Chan_Strategy逐根on_bar"""
+    strategy = Chan_Strategy(engine=None, strategy_name='check', vt_symbol=vt_symbol, setting=dict(setting))
+    for bar in bars:
+        strategy.on_bar(bar)
+    return strategy.chan_freq_map
+
+
+def compare(bars: List[BarData], vt_symbol: str, setting: dict) -> List[str]:
+    """返回不一致的地方，空列表表示完全一致"""
+    start = time.time()
+    chan_freq_map = replay(bars, vt_symbol, setting)
+    replay_time = time.time() - start
+    expected = snapshot(chan_freq_map)
+    start = time.time()
+    chan_freq_map = Chan_Batch(vt_symbol, setting).run(bars)
+    batch_time = time.time() - start
+    actual = snapshot(chan_freq_map)
+    diffs = []
+    for key, value in expected.items():
+        other = actual.get(key)
+        if other != value:
+            n = next((i for i, (x, y) in enumerate(zip(value, other)) if x != y), min(len(value), len(other)))
+            diffs.append('%s %s: 第%d项不同，逐根%d项，批量%d项' % (key[0], key[1], n, len(value), len(other)))
+    print('%s %s 逐根%.2fs 批量%.2fs %s' % (vt_symbol, setting, replay_time, batch_time, 'OK' if not diffs else 'DIFF'))
+    return diffs
+
+
+def _fields(records, drop) -> list:
+    return [_norm([getattr(r, name) for name in r._fields if name not in drop]) for r in records]
+
+
+def compare_retention(bars: List[BarData], vt_symbol: str, setting: dict, retention: int,
+                      interval: int = 1200) -> List[str]:
+    """
+    retention清理后保留的结构应该等于完整回放的最后一段；开启区间套时低级别的k线和中枢也必须被清理掉一部分。
+    """
+    start = time.time()
+    full = replay(bars, vt_symbol, setting)
+    compact = replay(bars, vt_symbol, dict(setting, retention=retention, retention_interval=interval))
+    diffs = []
+    for freq, chan in full.items():
+        other = compact[freq]
+        for name, drop in RETENTION_STRUCTURES:
+            value = _fields(getattr(chan, name), drop)
+            kept = _fields(getattr(other, name), drop)
+            if value[len(value) - len(kept):] != kept:
+                diffs.append('%s %s: 清理后%d项，不是完整回放%d项的最后一段' % (freq, name, len(kept), len(value)))
+        k_list, kept_k_list = chan.chan_k_list, other.chan_k_list
+        if len(kept_k_list) > len(k_list) or \
+                (k_list.datetime[len(k_list) - len(kept_k_list):] != kept_k_list.datetime).any():
+            diffs.append('%s chan_k_list: 清理后不是完整回放的最后一段' % freq)
+    if setting.get('qjt'):
+        # 最低级别结构最多，区间套的限制不能让它完全不清理
+        freq = FREQS[-1]
+        if len(compact[freq].k_list) >= len(full[freq].k_list):
+            diffs.append('%s k_list: 开启区间套时没有清理，%d根' % (freq, len(compact[freq].k_list)))
+        if len(compact[freq].pivot_list) >= len(full[freq].pivot_list):
+            diffs.append('%s pivot_list: 开启区间套时没有清理，%d个' % (freq, len(compact[freq].pivot_list)))
+    sizes = ' '.join('%s %d/%d' % (freq, len(compact[freq].k_list), len(chan.k_list)) for freq, chan in full.items())
+    print('%s %s retention=%d %.2fs k线%s %s' % (vt_symbol, setting, retention, time.time() - start, sizes,
+                                              'OK' if not diffs else 'DIFF'))
+    return diffs
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Chan_Batch和逐根回放的一致性检查')
+    parser.add_argument('--days', type=int, default=60, help='随机k线的天数')
+    parser.add_argument('--seeds', type=int, nargs='*', default=[1, 2], help='随机种子')
+    parser.add_argument('--csv', nargs='*', default=[], help='真实1分钟k线csv文件')
+    parser.add_argument('--symbol', default='600000')
+    parser.add_argument('--retention', type=int, default=0,
+                        help='大于0时检查按retention清理旧结构的结果，而不是批量计算')
+    args = parser.parse_args(argv)
+
+    # 日志和一致性无关，关掉避免写盘
+    ChanLog.disable()
+    datasets = []
+    if args.csv:
+        datasets.append(load_csv_bars(args.csv, args.symbol))
+    else:
+        for seed in args.seeds:
+            datasets.append(generate_sessions(args.days, seed, args.symbol))
+    failed = False
+    for bars in datasets:
+        for setting in SETTINGS:
+            if args.retention:
+                diffs = compare_retention(bars, args.symbol, setting, args.retention)
+            else:
+                diffs = compare(bars, args.symbol, setting)
+            for diff in diffs:
+                print('    ' + diff)
+            failed = failed or bool(diffs)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,247 @@
+from typing import List
+
+import numpy as np
+
+from trade.object import BarData
+from trade.constant import FREQS, FREQS_WINDOW, Interval
+from trade.chanlog import ChanLog
+from trade.utility import BarStore, MacdManager
+from .chan_class import Chan_Class
+from .chan_batch import batch_include, batch_fx
+
+# 1分钟k线时间戳截到分钟，同BarGenerator的replace(second=0, microsecond=0)
+MINUTE_US = 60 * 1000000
+
+
+class _Level:
+    """批量计算时一个级别的状态"""
+    __slots__ = ('chan', 'order', 'window', 'emit', 'include', 'fx', 'fx_list', 'index_map', 'k_dt', 'chan_dt',
+                 'dt_view', 'count', 'patched', 'pos')
+
+    def __init__(self, chan: Chan_Class, order: int, window: int):
+        self.chan = chan
+        self.order = order
+        self.window = window
+        # 每根本级别k线在第几根1分钟k线时生成
+        self.emit = None
+        self.include = None
+        self.fx = None
+        self.fx_list = None
+        # 视图切换用的python list：原始k线->chan k线下标，原始k线日期，chan_k_list最终的日期
+        self.index_map = None
+        self.k_dt = None
+        self.chan_dt = None
+        self.dt_view = None
+        self.count = -1
+        self.patched = -1
+        # 共振逐根处理时下一根要处理的k线
+        self.pos = 0
+
+    def count_at(self, t: int, order: int) -> int:
+        """在(t, order)这个时刻本级别已经收到的k线数量"""
+        if self.order <= order:
+            return (t + 1) // self.window
+        return t // self.window
+
+    def set_view(self, count: int) -> None:
+        """
+        把k_list和chan_k_list切换到只收到count根k线时的样子。
+        笔以上的结构只读取k_list[-1]和chan_k_list[-1]的日期，chan_k_list[-1]此时还没被后面的k线合并，日期取当时的k线。
+        """
+        if count == self.count:
+            return
+        self.count = count
+        if self.patched >= 0:
+            self.dt_view[self.patched] = self.chan_dt[self.patched]
+            self.patched = -1
+        chan = self.chan
+        chan.k_list.count = count
+        if count:
+            m = self.index_map[count - 1] + 1
+            chan.chan_k_list.count = m
+            self.dt_view[m - 1] = self.k_dt[count - 1]
+            self.patched = m - 1
+        else:
+            chan.chan_k_list.count = 0
+
+    def finish(self) -> None:
+        """恢复成全部k线处理完的样子"""
+        if self.patched >= 0:
+            self.dt_view[self.patched] = self.chan_dt[self.patched]
+            self.patched = -1
+        self.chan.k_list.count = len(self.k_dt)
+        self.chan.chan_k_list.count = len(self.chan_dt)
+
+
+class Chan_Batch:
+    """
+    离线批量计算：输入一个股票全部的1分钟k线，一次算出FREQS所有级别的缠论结构。
+    k线包含和分型用数组批量算，只有产生分型的k线(以及共振等待中的k线)才进入笔、线段、中枢、买卖点的处理，
+    各级别之间的处理顺序和Chan_Strategy.on_bar一致，所以结果和逐根回放完全相同。
+    多个股票并行用chan_scan的进程池；单个股票里k线合成到分型只占两成左右的时间，分到子进程的开销比省下的多。
+    """
+    include = True
+    build_pivot = False
+    qjt = False
+    gz = False
+
+    def __init__(self, vt_symbol: str, setting: dict = None):
+        if setting:
+            if 'include' in setting.keys():
+                self.include = setting['include']
+            if 'build_pivot' in setting.keys():
+                self.build_pivot = setting['build_pivot']
+            if 'qjt' in setting.keys():
+                self.qjt = setting['qjt']
+            if 'gz' in setting.keys():
+                self.gz = setting['gz']
+        self.vt_symbol = vt_symbol
+        self.include_feature = False
+        self.chan_freq_map = {}
+        prev = None
+        for freq in FREQS:
+            chan = Chan_Class(freq=freq, symbol=self.vt_symbol, sell=None, buy=None, include=self.include,
+                              include_feature=self.include_feature, build_pivot=self.build_pivot, qjt=self.qjt,
+                              gz=self.gz)
+            self.chan_freq_map[freq] = chan
+            if prev:
+                prev.set_next(chan)
+                chan.set_prev(prev)
+            prev = chan
+            # 限定共振作用级别
+            if chan.prev == None or chan.freq != FREQS[-1]:
+                chan.gz = False
+
+    def run(self, bars: List[BarData]) -> dict:
+        """输入1分钟k线列表或BarStore，返回chan_freq_map"""
+        if isinstance(bars, BarStore):
+            return self.run_store(bars)
+        store = BarStore(max(len(bars), 1))
+        store.extend(bars)
+        return self.run_store(store)
+
+    def run_store(self, store: BarStore) -> dict:
+        """输入1分钟k线的BarStore，返回chan_freq_map"""
+        levels = []
+        targets = []
+        for order, freq in enumerate(FREQS):
+            window, _, target = FREQS_WINDOW[freq]
+            levels.append(_Level(self.chan_freq_map[freq], order, window))
+            targets.append(target)
+        for level, target in zip(levels, targets):
+            self.load_level(level, store, target)
+
+        gz_level = None
+        for level in levels:
+            if level.chan.gz:
+                gz_level = level
+
+        # 所有级别的分型事件按(1分钟k线, 级别顺序, 追加顺序)排序
+        times = np.concatenate([level.emit[level.fx.bar] for level in levels])
+        orders = np.concatenate([np.full(len(level.fx), level.order) for level in levels])
+        positions = np.concatenate([np.arange(len(level.fx)) for level in levels])
+        event_order = np.lexsort((positions, orders, times))
+        log_enabled = ChanLog.is_enabled()
+
+        for t, order, pos in zip(times[event_order].tolist(), orders[event_order].tolist(),
+                                 positions[event_order].tolist()):
+            level = levels[order]
+            chan = level.chan
+            if gz_level:
+                self.run_gz(levels, gz_level, t, order)
+            fx = level.fx_list[pos]
+            chan.fx_list.append(fx)
+            if level.fx.stroke[pos]:
+                for other in levels:
+                    other.set_view(other.count_at(t, order))
+                chan.on_stroke(fx)
+                if log_enabled:
+                    ChanLog.log(chan.freq, chan.symbol, "fx_list: ")
+                    ChanLog.log(chan.freq, chan.symbol, fx)
+            if gz_level:
+                gz_level.pos = max(gz_level.pos, gz_level.count_at(t, order))
+
+        if gz_level:
+            self.run_gz(levels, gz_level, len(store), 0)
+        for level in levels:
+            level.finish()
+        return self.chan_freq_map
+
+    def run_gz(self, levels: list, gz_level: _Level, t: int, order: int) -> None:
+        """处理(t, order)及之前还在等待共振的k线，同Chan_Class.on_bar开头的共振判断"""
+        chan = gz_level.chan
+        end = gz_level.count_at(t, order)
+        while chan.gz_tmp_bs and gz_level.pos < end:
+            gz_t = int(gz_level.emit[gz_level.pos])
+            for other in levels:
+                other.set_view(other.count_at(gz_t, gz_level.order))
+            chan.gz_delay_k_num += 1
+            chan.on_gz()
+            gz_level.pos += 1
+
+    def load_level(self, level: _Level, store: BarStore, target: Interval) -> None:
+        """生成本级别的k线，批量做包含处理和分型"""
+        self.attach_level(level, prepare_level(store, level.window, target, level.chan.include))
+
+    def attach_level(self, level: _Level, prepared: tuple) -> None:
+        """把prepare_level的结果装到本级别的Chan_Class上"""
+        chan = level.chan
+        level.emit, chan.k_list, chan.chan_k_list, chan.macd_manager, level.include, level.fx = prepared
+        k_list = chan.k_list
+        chan_k_list = chan.chan_k_list
+        level.index_map = level.include.index_map.tolist()
+        level.k_dt = k_list.datetime_array.view('int64')[:len(k_list)].tolist()
+        level.dt_view = chan_k_list.datetime_array.view('int64')
+        level.chan_dt = level.dt_view[:len(chan_k_list)].tolist()
+        level.fx_list = level.fx.to_fx_list(k_list.tzinfo)
+
+
+def prepare_level(store: BarStore, window: int, target: Interval, include: bool) -> tuple:
+    """
+    一个级别的k线合成、包含处理、分型和macd，只依赖1分钟k线，不读其他级别。
+    返回(emit, k_list, chan_k_list, macd_manager, IncludeResult, FxResult)
+    """
+    n = len(store)
+    if target == Interval.MINUTE:
+        count = n
+    else:
+        count = n // window
+    k_list = BarStore(max(count, 1))
+    k_list.symbol = store.symbol
+    k_list.exchange = store.exchange
+    k_list.interval = target
+    k_list.tzinfo = store.tzinfo
+    if target == Interval.MINUTE:
+        # 1分钟级别直接用原始k线
+        emit = np.arange(n)
+        k_list.extend_arrays(store.datetime, store.open, store.high, store.low, store.close, store.volume,
+                             store.open_interest)
+    else:
+        # 同BarGenerator按数量合成：开盘取第一根，收盘、日期取最后一根，成交量按整数累加，不足一个窗口的丢弃
+        emit = np.arange(count) * window + window - 1
+        if count:
+            size = count * window
+            dt = store.datetime_array.view('int64')[emit]
+            k_list.extend_arrays(
+                dt - dt % MINUTE_US,
+                store.open[:size:window],
+                np.maximum.reduceat(store.high[:size], np.arange(0, size, window)),
+                np.minimum.reduceat(store.low[:size], np.arange(0, size, window)),
+                store.close[emit],
+                np.trunc(store.volume[:size]).reshape(count, window).sum(axis=1),
+                store.open_interest[emit]
+            )
+
+    result = batch_include(k_list.high, k_list.low, k_list.open, k_list.close, include)
+    chan_k_list = BarStore(max(len(result), 1))
+    chan_k_list.symbol = k_list.symbol
+    chan_k_list.exchange = k_list.exchange
+    chan_k_list.interval = k_list.interval
+    chan_k_list.tzinfo = k_list.tzinfo
+    chan_k_list.extend_arrays(k_list.datetime[result.bar_index], result.open, result.high, result.low,
+                              result.close, k_list.volume[result.bar_index],
+                              k_list.open_interest[result.bar_index])
+    macd_manager = MacdManager()
+    macd_manager.rebuild(result.close.tolist())
+    fx = batch_fx(result, k_list.datetime)
+    return emit, k_list, chan_k_list, macd_manager, result, fx
@@ -0,0 +1,225 @@
+"""
+性能测试：生成可复现的A股1分钟k线，测量缠论计算每秒处理的k线数、内存峰值和各阶段耗时，结果写成json便于不同版本对比。
+
+    python -m trade.strategies.chan_benchmark
+    python -m trade.strategies.chan_benchmark --sizes 20 60 250 --repeat 3 --output bench.json
+    python -m trade.strategies.chan_benchmark --baseline bench_old.json --threshold 0.1
+
+每个规模分三遍运行：第一遍只计时(每秒k线数)，第二遍统计各阶段耗时，第三遍用tracemalloc统计内存峰值，互不影响。
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+from trade.object import BarData
+from trade.chanlog import ChanLog
+from .chan_strategy import Chan_Strategy
+from .chan_batch_engine import Chan_Batch
+from .chan_render import build_render_payload
+from .chan_profile import merge_stage_data
+from .chan_sample import generate_sessions
+
+BENCHMARK_VERSION = 1
+
+DEFAULT_SETTING = {'include': True, 'build_pivot': False, 'qjt': True, 'gz': True}
+
+
+def new_strategy(vt_symbol: str, setting: dict) -> Chan_Strategy:
+    return Chan_Strategy(engine=None, strategy_name='benchmark', vt_symbol=vt_symbol, setting=dict(setting))
+
+
+def run_replay(bars: List[BarData], vt_symbol: str, setting: dict, profile: bool = False):
+    strategy = new_strategy(vt_symbol, setting)
+    if profile:
+        strategy.enable_profiling()
+    start = time.perf_counter()
+    for bar in bars:
+        strategy.on_bar(bar)
+    return strategy, time.perf_counter() - start
+
+
+def run_render(strategy: Chan_Strategy) -> float:
+    start = time.perf_counter()
+    for freq, chan in strategy.chan_freq_map.items():
+        build_render_payload(chan, freq)
+    return time.perf_counter() - start
+
+
+def count_structure(strategy: Chan_Strategy) -> dict:
+    """各级别的结构数量，结构数量不同时耗时不可比"""
+    ans = {}
+    for freq, chan in strategy.chan_freq_map.items():
+        ans[freq] = {
+            'chan_k': len(chan.chan_k_list),
+            'fx': len(chan.fx_list),
+            'stroke': len(chan.stroke_list),
+            'line': len(chan.line_list),
+            'pivot': len(chan.pivot_list),
+            'buy': len(chan.buy_list),
+            'sell': len(chan.sell_list),
+        }
+    return ans
+
+
+def bench_size(days: int, seed: int, vt_symbol: str, setting: dict, repeat: int = 1, memory: bool = True,
+               batch: bool = True) -> dict:
+    """一个规模的测试结果"""
+    bars = generate_sessions(days, seed, vt_symbol.split('.')[0])
+    ans = OrderedDict([('days', days), ('seed', seed), ('bars', len(bars))])
+
+    # 只计时，取最快的一次
+    best = None
+    strategy = None
+    for i in range(max(repeat, 1)):
+        strategy, seconds = run_replay(bars, vt_symbol, setting)
+        best = seconds if best is None else min(best, seconds)
+    ans['replay'] = {'seconds': best, 'bars_per_sec': len(bars) / best if best else 0.0}
+    ans['structure'] = count_structure(strategy)
+
+    render_seconds = min(run_render(strategy) for i in range(max(repeat, 1)))
+
+    if batch:
+        best = None
+        for i in range(max(repeat, 1)):
+            start = time.perf_counter()
+            Chan_Batch(vt_symbol, dict(setting)).run(bars)
+            seconds = time.perf_counter() - start
+            best = seconds if best is None else min(best, seconds)
+        ans['batch'] = {'seconds': best, 'bars_per_sec': len(bars) / best if best else 0.0}
+
+    strategy, seconds = run_replay(bars, vt_symbol, setting, profile=True)
+    stages = merge_stage_data([chan.profiler for chan in strategy.chan_freq_map.values()])
+    stage_seconds = sum(stage['seconds'] for stage in stages.values())
+    stages['render'] = {'calls': len(strategy.chan_freq_map), 'seconds': render_seconds}
+    # k线合成、macd等不属于上面各阶段的时间
+    stages['other'] = {'calls': len(bars), 'seconds': max(seconds - stage_seconds, 0.0)}
+    ans['stages'] = stages
+    ans['events'] = {freq: profile['events'] for freq, profile in strategy.get_profile().items()}
+
+    if memory:
+        tracemalloc.start()
+        try:
+            run_replay(bars, vt_symbol, setting)
+            ans['peak_memory'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return ans
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=str(Path(__file__).parent),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return ''
+
+
+def run_benchmark(sizes: List[int], seed: int = 1, vt_symbol: str = '600000', setting: dict = None,
+                  repeat: int = 1, memory: bool = True, batch: bool = True, log=print) -> dict:
+    setting = dict(DEFAULT_SETTING if setting is None else setting)
+    report = OrderedDict([
+        ('version', BENCHMARK_VERSION),
+        ('created', datetime.now().isoformat(timespec='seconds')),
+        ('commit', get_commit()),
+        ('python', platform.python_version()),
+        ('numpy', np.__version__),
+        ('platform', platform.platform()),
+        ('setting', setting),
+        ('repeat', repeat),
+        ('results', []),
+    ])
+    for days in sizes:
+        result = bench_size(days, seed, vt_symbol, setting, repeat, memory, batch)
+        report['results'].append(result)
+        if log:
+            log(format_result(result))
+    return report
+
+
+def format_result(result: dict) -> str:
+    lines = ['%d天 %d根k线: 逐根 %.0f根/秒' % (result['days'], result['bars'], result['replay']['bars_per_sec'])]
+    if 'batch' in result:
+        lines[0] += ', 批量 %.0f根/秒' % result['batch']['bars_per_sec']
+    if 'peak_memory' in result:
+        lines[0] += ', 内存峰值 %.1fMB' % (result['peak_memory'] / 1024 / 1024)
+    total = sum(stage['seconds'] for stage in result['stages'].values()) or 1.0
+    for name, stage in result['stages'].items():
+        lines.append('    %-8s %10d次 %8.3fs %5.1f%%' % (name, stage['calls'], stage['seconds'],
+                                                      stage['seconds'] * 100 / total))
+    return '\n'.join(lines)
+
+
+def compare_report(report: dict, baseline: dict, threshold: float = 0.1) -> List[str]:
+    """
+    和之前的结果对比同样规模、同样种子的每秒k线数，变慢超过threshold的返回说明
+    """
+    regressions = []
+    old_results = {(result['days'], result['seed']): result for result in baseline.get('results', [])}
+    for result in report['results']:
+        old = old_results.get((result['days'], result['seed']))
+        if not old:
+            continue
+        for mode in ('replay', 'batch'):
+            if mode not in result or mode not in old or not old[mode]['bars_per_sec']:
+                continue
+            ratio = result[mode]['bars_per_sec'] / old[mode]['bars_per_sec']
+            text = '%d天 %s: %.0f -> %.0f根/秒 (%.2fx)' % (result['days'], mode, old[mode]['bars_per_sec'],
+                                                        result[mode]['bars_per_sec'], ratio)
+            if ratio < 1 - threshold:
+                regressions.append(text)
+            else:
+                print(text)
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='缠论计算性能测试')
+    parser.add_argument('--sizes', type=int, nargs='*', default=[20, 60, 250], help='k线天数，每天240根')
+    parser.add_argument('--seed', type=int, default=1, help='随机种子')
+    parser.add_argument('--symbol', default='600000')
+    parser.add_argument('--repeat', type=int, default=1, help='计时重复次数，取最快的一次')
+    parser.add_argument('--no-include', action='store_true', help='不做k线包含处理')
+    parser.add_argument('--build-pivot', action='store_true', help='用线段构成中枢')
+    parser.add_argument('--no-qjt', action='store_true', help='不使用区间套')
+    parser.add_argument('--no-gz', action='store_true', help='不使用共振')
+    parser.add_argument('--no-memory', action='store_true', help='不统计内存峰值')
+    parser.add_argument('--no-batch', action='store_true', help='不测试Chan_Batch')
+    parser.add_argument('--output', default='', help='结果json文件，默认benchmark_时间.json')
+    parser.add_argument('--baseline', default='', help='之前的结果json文件，用于对比')
+    parser.add_argument('--threshold', type=float, default=0.1, help='变慢超过这个比例时返回1')
+    args = parser.parse_args(argv)
+
+    # 日志不计入耗时
+    ChanLog.disable()
+    setting = {'include': not args.no_include, 'build_pivot': args.build_pivot, 'qjt': not args.no_qjt,
+               'gz': not args.no_gz}
+    report = run_benchmark(args.sizes, args.seed, args.symbol, setting, args.repeat, not args.no_memory,
+                           not args.no_batch)
+    output = args.output or 'benchmark_%s.json' % datetime.now().strftime('%Y%m%d_%H%M%S')
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print('结果已写入%s' % output)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_report(report, baseline, args.threshold)
+        for text in regressions:
+            print('变慢: ' + text)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
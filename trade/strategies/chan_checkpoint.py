@@ -0,0 +1,48 @@
+"""
+缠论多级别状态的二进制快照。
+文件格式：MAGIC(8字节) + 版本号(uint16 小端) + zlib压缩的pickle。
+结构里的对象引用(笔/线段/中枢共用分型，中枢和买卖点列表共用买卖点，prev/next链接)在pickle里保持不变。
+"""
+import pickle
+import struct
+import zlib
+from pathlib import Path
+from typing import Optional, Union
+
+MAGIC = b'CHANCKPT'
+# 结构有变化(字段、记录类型)时加1，旧版本的快照直接丢弃，重新回放
+CHECKPOINT_VERSION = 5
+# 兼容python3.7
+PICKLE_PROTOCOL = 4
+
+_HEADER = struct.Struct('<8sH')
+
+
+def save_checkpoint(path: Union[str, Path], state: dict) -> None:
+    """先写临时文件再改名，写到一半中断不会留下坏文件"""
+    path = Path(path)
+    data = zlib.compress(pickle.dumps(state, protocol=PICKLE_PROTOCOL), 1)
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, CHECKPOINT_VERSION))
+        f.write(data)
+    tmp_path.replace(path)
+
+
+def load_checkpoint(path: Union[str, Path]) -> Optional[dict]:
+    """文件不存在、格式不对或者版本不一致时返回None"""
+    path = Path(path)
+    if not path.exists():
+        return None
+    with open(path, 'rb') as f:
+        header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            return None
+        magic, version = _HEADER.unpack(header)
+        if magic != MAGIC or version != CHECKPOINT_VERSION:
+            return None
+        data = f.read()
+    try:
+        return pickle.loads(zlib.decompress(data))
+    except (zlib.error, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return None
@@ -1,12 +1,18 @@
 import math
-import talib as tl
-from trade.object import BarData
-from copy import copy
 import numpy as np
+from trade.object import BarData
+from logging import DEBUG
 from trade.chanlog import ChanLog
+from trade.utility import MacdManager, BarStore
+from .chan_batch import batch_include, IncludeResult
+from .chan_profile import ChanProfiler, METHODS as PROFILE_METHODS
+from .chan_object import FxData, PivotData, BsData, ChanArchive, BsIndex, UP, DOWN, bisect_left_time, \
+    bisect_right_time
 
 
 class Chan_Class:
+    # 性能统计，默认关闭，见set_profiler
+    profiler = None
 
     def __init__(self, freq, symbol, sell, buy, include=True, include_feature=False, build_pivot=False, qjt=True,
                  gz=False, buy1=100, buy2=200, buy3=200, sell1=100, sell2=200, sell3=200):
@@ -15,12 +21,14 @@ class Chan_Class:
         self.symbol = symbol
         self.prev = None
         self.next = None
-        self.k_list = []
-        self.chan_k_list = []
+        # 列式存储，k_list[i]/chan_k_list[i]仍返回BarData
+        self.k_list = BarStore()
+        self.chan_k_list = BarStore()
         self.fx_list = []
         self.stroke_list = []
         self.stroke_index_in_k = {}
         self.line_list = []
+        # 线段的分型在chan_k_list中的位置 -> 在stroke_list中的位置
         self.line_index = {}
         self.line_index_in_k = {}
         self.line_feature = []
@@ -31,7 +39,10 @@ class Chan_Class:
         self.trend_list = []
         self.buy_list = []
         self.sell_list = []
+        # 笔/线段结束分型在chan_k_list中的位置 -> 这一笔/线段的macd面积
         self.macd = {}
+        # 合并k线的macd状态，每根k线更新一次
+        self.macd_manager = MacdManager()
         self.buy = buy
         self.sell = sell
         self.buy1 = buy1
@@ -62,8 +73,37 @@ class Chan_Class:
         self.gz_delay_k_max = 12
         # 潜在bs
         self.gz_tmp_bs = None
-        # 高级别bs
-        self.gz_prev_last_bs = None
+        # 潜在bs之后高级别新出现的买点，由高级别on_buy_sell通知
+        self.gz_last_bs = None
+        # compact掉的旧结构
+        self.archive = ChanArchive()
+        # 买卖点按类型、日期的索引
+        self.bs_index = BsIndex()
+        # 区间套中枢生成器，第一次用到时创建
+        self.qjt_builder = None
+
+    def __getstate__(self):
+        # 下单回调属于策略，不保存，恢复后由策略重新设置
+        state = self.__dict__.copy()
+        state['buy'] = None
+        state['sell'] = None
+        # 缓存不保存
+        state['qjt_builder'] = None
+        # 性能统计不保存
+        if 'profiler' in state:
+            del state['profiler']
+            for name in PROFILE_METHODS:
+                state.pop(name, None)
+        return state
+
+    def set_profiler(self, profiler: ChanProfiler = None) -> None:
+        """开启(传入ChanProfiler)或关闭(None)性能统计"""
+        if self.profiler:
+            ChanProfiler.detach(self)
+            del self.profiler
+        if profiler:
+            profiler.attach(self)
+            self.profiler = profiler
 
     def set_prev(self, chan):
         self.prev = chan
@@ -81,51 +121,207 @@ class Chan_Class:
         else:
             self.on_process_k_no_include(bar)
 
+    def load_k_list(self, bars) -> IncludeResult:
+        """
+        历史k线批量做包含处理，恢复k_list、chan_k_list和macd状态，之后可以继续on_bar。
+        只处理k线这一层，分型、笔、线段等结构不在这里生成。
+        """
+        if self.k_list:
+            raise ValueError('load_k_list只能用于空的Chan_Class')
+        k_list = self.k_list
+        k_list.extend(bars)
+        result = batch_include(k_list.high, k_list.low, k_list.open, k_list.close, self.include)
+        chan_k_list = self.chan_k_list
+        chan_k_list.symbol = k_list.symbol
+        chan_k_list.exchange = k_list.exchange
+        chan_k_list.interval = k_list.interval
+        chan_k_list.tzinfo = k_list.tzinfo
+        bar_index = result.bar_index
+        chan_k_list.extend_arrays(k_list.datetime[bar_index], result.open, result.high, result.low, result.close,
+                                  k_list.volume[bar_index], k_list.open_interest[bar_index])
+        self.macd_manager.rebuild(result.close.tolist())
+        return result
+
+    def get_retention_time(self, keep_pivots: int):
+        """
+        保留最近keep_pivots个中枢时可以丢掉的时间点，之前的结构不再被读取；结构不够时返回None。
+        中枢往前看进入段前一段，线段往前看倒数第三个线段所在笔之前几笔，笔往前看倒数第二笔之前的分型。
+        """
+        data = self.line_list if self.build_pivot else self.stroke_list
+        if keep_pivots <= 0 or len(self.pivot_list) <= keep_pivots or len(self.line_list) < 3 or \
+                len(self.stroke_list) < 8:
+            return None
+        start = self.pivot_list[-keep_pivots].enter - 2
+        if start < 1 or start >= len(data):
+            return None
+        t = min(data[start].datetime, self.stroke_list[-8].datetime)
+        stroke_index = self.line_index.get(self.line_list[-3].index)
+        if stroke_index is None or stroke_index - 4 < 1:
+            return None
+        return min(t, self.stroke_list[stroke_index - 4].datetime)
+
+    def get_qjt_time(self):
+        """
+        之后的区间套从本级别最近的笔/线段起点开始读取下一级别，下一级别在这个时间之前的结构可以丢掉；还没有笔/线段时返回None。
+        起点是倒数第二个分型，笔/线段被修正时会往前退，再多留两个。
+        """
+        data = self.line_list if self.build_pivot else self.stroke_list
+        if not data:
+            return None
+        return data[max(len(data) - 4, 0)].datetime
+
+    def get_qjt_keep_time(self, bound):
+        """上一级别区间套从bound开始读取本级别时，还会用到bound之前的最后一笔/线段，返回它的时间"""
+        data = self.line_list if self.build_pivot else self.stroke_list
+        i = bisect_left_time(data, bound)
+        return data[i - 1].datetime if i > 0 else bound
+
+    def compact(self, t) -> None:
+        """
+        丢掉时间t之前的结构，下标(分型在chan_k_list中的位置、中枢进入离开段、买卖点所在笔/线段、
+        line_index、走势里的中枢)全部平移，旧买卖点冻结到archive。
+        t必须不晚于get_retention_time，而且不晚于上一级别的t(区间套会读取本级别的结构)。
+        """
+        archive = self.archive
+        fx_drop = self._count_before(self.fx_list, t)
+        stroke_drop = self._count_before(self.stroke_list, t)
+        line_drop = self._count_before(self.line_list, t)
+        data_drop = line_drop if self.build_pivot else stroke_drop
+        pivot_drop = 0
+        while pivot_drop < len(self.pivot_list) and self.pivot_list[pivot_drop].enter - 1 < data_drop:
+            pivot_drop += 1
+        fx_list = self.fx_list[fx_drop:]
+        stroke_list = self.stroke_list[stroke_drop:]
+        line_list = self.line_list[line_drop:]
+        if not fx_list or not stroke_list or not line_list:
+            return
+
+        # chan k线：保留最早分型前一根，macd面积要用到前一根的累计值
+        k_drop = min(fx_list[0].index, stroke_list[0].index, line_list[0].index) - 2
+        if k_drop < 1:
+            return
+        self.chan_k_list.drop_front(k_drop)
+        self.macd_manager.drop_front(k_drop)
+        raw_drop = int(np.searchsorted(self.k_list.datetime, self.chan_k_list.datetime[0]))
+        self.k_list.drop_front(raw_drop)
+        rebased = set()
+        for fx in fx_list + stroke_list + line_list:
+            if id(fx) not in rebased:
+                rebased.add(id(fx))
+                fx.index -= k_drop
+        self.fx_list = fx_list
+        self.stroke_list = stroke_list
+        self.line_list = line_list
+        self.line_index = {key - k_drop: index - stroke_drop for key, index in self.line_index.items()
+                           if index >= stroke_drop}
+
+        # 中枢、走势
+        self.pivot_list = self.pivot_list[pivot_drop:]
+        for pivot in self.pivot_list:
+            pivot.enter -= data_drop
+            pivot.exit -= data_drop
+        trend_list = []
+        for i, trend in enumerate(self.trend_list):
+            trend[4] = [index - pivot_drop for index in trend[4] if index >= pivot_drop]
+            if trend[4] or i == len(self.trend_list) - 1:
+                trend_list.append(trend)
+        trend_drop = len(self.trend_list) - len(trend_list)
+        self.trend_list = trend_list
+
+        # 买卖点：旧的冻结，最后一个留着给共振用
+        buy_drop = min(self._count_before(self.buy_list, t), len(self.buy_list) - 1)
+        sell_drop = min(self._count_before(self.sell_list, t), len(self.sell_list) - 1)
+        archive.buy_list.extend(tuple(bs) for bs in self.buy_list[:buy_drop])
+        archive.sell_list.extend(tuple(bs) for bs in self.sell_list[:sell_drop])
+        self.buy_list = self.buy_list[buy_drop:]
+        self.sell_list = self.sell_list[sell_drop:]
+        self.bs_index.rebuild(self.buy_list + self.sell_list)
+        bs_list = self.buy_list + self.sell_list
+        for pivot in self.pivot_list:
+            bs_list.extend(bs for bs in pivot.buy + pivot.sell if bs)
+        rebased = set()
+        for bs in bs_list:
+            if id(bs) not in rebased:
+                rebased.add(id(bs))
+                bs.index -= data_drop
+
+        self.macd = {key - k_drop: value for key, value in self.macd.items() if key >= k_drop}
+        if self.qjt_builder:
+            self.qjt_builder.clear()
+
+        archive.k_offset += raw_drop
+        archive.chan_k_offset += k_drop
+        archive.fx_offset += fx_drop
+        archive.stroke_offset += stroke_drop
+        archive.line_offset += line_drop
+        archive.pivot_offset += pivot_drop
+        archive.trend_offset += trend_drop
+
+    @staticmethod
+    def _count_before(data: list, t) -> int:
+        n = 0
+        while n < len(data) and data[n].datetime < t:
+            n += 1
+        return n
+
     def on_process_k_include(self, bar: BarData):
         """合并k线"""
-        if len(self.chan_k_list) < 2:
-            self.chan_k_list.append(bar)
+        chan_k_list = self.chan_k_list
+        n = len(chan_k_list)
+        if n < 2:
+            chan_k_list.append(bar)
+            self.macd_manager.update(bar.close_price)
         else:
-            pre_bar = self.chan_k_list[-2]
-            last_bar = self.chan_k_list[-1]
-            if (last_bar.high_price >= bar.high_price and last_bar.low_price <= bar.low_price) or (
-                    last_bar.high_price <= bar.high_price and last_bar.low_price >= bar.low_price):
-                if last_bar.high_price > pre_bar.high_price:
-                    new_bar = copy(bar)
-                    new_bar.high_price = max(last_bar.high_price, new_bar.high_price)
-                    new_bar.low_price = max(last_bar.low_price, new_bar.low_price)
-                    new_bar.open_price = max(last_bar.open_price, new_bar.open_price)
-                    new_bar.close_price = max(last_bar.close_price, new_bar.close_price)
+            pre_high = chan_k_list.high_array.item(n - 2)
+            last_high = chan_k_list.high_array.item(n - 1)
+            last_low = chan_k_list.low_array.item(n - 1)
+            if (last_high >= bar.high_price and last_low <= bar.low_price) or (
+                    last_high <= bar.high_price and last_low >= bar.low_price):
+                last_open = chan_k_list.open_array.item(n - 1)
+                last_close = chan_k_list.close_array.item(n - 1)
+                if last_high > pre_high:
+                    high_price = max(last_high, bar.high_price)
+                    low_price = max(last_low, bar.low_price)
+                    open_price = max(last_open, bar.open_price)
+                    close_price = max(last_close, bar.close_price)
                 else:
-                    new_bar = copy(bar)
-                    new_bar.high_price = min(last_bar.high_price, new_bar.high_price)
-                    new_bar.low_price = min(last_bar.low_price, new_bar.low_price)
-                    new_bar.open_price = min(last_bar.open_price, new_bar.open_price)
-                    new_bar.close_price = min(last_bar.close_price, new_bar.close_price)
-
-                self.chan_k_list[-1] = new_bar
-                ChanLog.log(self.freq, self.symbol, "combine k line: " + str(new_bar.datetime))
+                    high_price = min(last_high, bar.high_price)
+                    low_price = min(last_low, bar.low_price)
+                    open_price = min(last_open, bar.open_price)
+                    close_price = min(last_close, bar.close_price)
+
+                chan_k_list.set_values(n - 1, bar.datetime, open_price, high_price, low_price, close_price,
+                                       bar.volume, bar.open_interest)
+                self.macd_manager.replace_last(close_price)
+                ChanLog.log(self.freq, self.symbol, "combine k line: %s", bar.datetime, level=DEBUG)
             else:
-                self.chan_k_list.append(bar)
+                chan_k_list.append(bar)
+                self.macd_manager.update(bar.close_price)
             # 包含和非包含处理的k线都需要判断是否分型了
-            self.on_process_fx(self.chan_k_list)
+            self.on_process_fx(chan_k_list)
 
     def on_process_k_no_include(self, bar: BarData):
         """不用合并k线"""
         self.chan_k_list.append(bar)
+        self.macd_manager.update(bar.close_price)
         self.on_process_fx(self.chan_k_list)
 
-    def on_process_fx(self, data):
-        if len(data) > 2:
+    def on_process_fx(self, data: BarStore):
+        n = len(data)
+        if n > 2:
             flag = False
-            if data[-2].high_price >= data[-1].high_price and data[-2].high_price >= data[-3].high_price:
+            high = data.high_array
+            low = data.low_array
+            high_2 = high.item(n - 2)
+            low_2 = low.item(n - 2)
+            if high_2 >= high.item(n - 1) and high_2 >= high.item(n - 3):
                 # 形成顶分型 [high_price, low, dt, direction, index of k_list]
-                self.fx_list.append([data[-2].high_price, data[-2].low_price, data[-2].datetime, 'up', len(data) - 2])
+                self.fx_list.append(FxData(high_2, low_2, data.get_datetime(n - 2), UP, n - 2))
                 flag = True
 
-            if data[-2].low_price <= data[-1].low_price and data[-2].low_price <= data[-3].low_price:
+            if low_2 <= low.item(n - 1) and low_2 <= low.item(n - 3):
                 # 形成底分型
-                self.fx_list.append([data[-2].high_price, data[-2].low_price, data[-2].datetime, 'down', len(data) - 2])
+                self.fx_list.append(FxData(high_2, low_2, data.get_datetime(n - 2), DOWN, n - 2))
                 flag = True
 
             if flag:
@@ -137,33 +333,37 @@ class Chan_Class:
         """生成笔"""
         if len(self.stroke_list) < 1:
             self.stroke_list.append(data)
-            ChanLog.log(self.freq, self.symbol, self.stroke_list)
+            ChanLog.log(self.freq, self.symbol, self.stroke_list, level=DEBUG)
         else:
             last_fx = self.stroke_list[-1]
             cur_fx = data
             pivot_flag = False
             # 分型之间需要超过三根chank线
             # 延申也是需要条件的
-            if last_fx[3] == cur_fx[3]:
-                if (last_fx[3] == 'down' and cur_fx[1] < last_fx[1]) or (
-                        last_fx[3] == 'up' and cur_fx[0] > last_fx[0]):
+            if last_fx.direction == cur_fx.direction:
+                if (last_fx.direction == DOWN and cur_fx.low < last_fx.low) or (
+                        last_fx.direction == UP and cur_fx.high > last_fx.high):
                     # 笔延申
                     self.stroke_list[-1] = cur_fx
                     pivot_flag = True
+                    if self.profiler:
+                        self.profiler.count('stroke_extend')
 
             else:
-                # if (cur_fx[4] - last_fx[4] > 3) and (
-                #         (cur_fx[3] == 'down' and cur_fx[1] < last_fx[1] and cur_fx[0] < last_fx[0]) or (
-                #         cur_fx[3] == 'up' and cur_fx[0] > last_fx[0] and cur_fx[1] > last_fx[1])):
-                if (cur_fx[4] - last_fx[4] > 3) and (
-                        (cur_fx[3] == 'down' and cur_fx[0] < last_fx[1]) or (
-                        cur_fx[3] == 'up' and cur_fx[1] > last_fx[0])):
+                # if (cur_fx.index - last_fx.index > 3) and (
+                #         (cur_fx.direction == DOWN and cur_fx.low < last_fx.low and cur_fx.high < last_fx.high) or (
+                #         cur_fx.direction == UP and cur_fx.high > last_fx.high and cur_fx.low > last_fx.low)):
+                if (cur_fx.index - last_fx.index > 3) and (
+                        (cur_fx.direction == DOWN and cur_fx.high < last_fx.low) or (
+                        cur_fx.direction == UP and cur_fx.low > last_fx.high)):
                     # 笔新增
                     self.stroke_list.append(cur_fx)
                     ChanLog.log(self.freq, self.symbol, "stroke_list: ")
                     ChanLog.log(self.freq, self.symbol, self.stroke_list[-1])
-                    # ChanLog.log(self.freq, self.symbol, self.stroke_list)
+                    # ChanLog.log(self.freq, self.symbol, self.stroke_list, level=DEBUG)
                     pivot_flag = True
+                    if self.profiler:
+                        self.profiler.count('stroke_add')
 
             # 修正倒数第二个分型是否是最高的顶分型或者是否是最低的底分型
             # 只修一笔，不修多笔
@@ -171,27 +371,29 @@ class Chan_Class:
             stroke_change = None
             if pivot_flag and len(self.stroke_list) > 1:
                 stroke_change = self.stroke_list[-2]
-                if cur_fx[3] == 'down':
-                    while len(self.fx_list) > abs(start) and self.fx_list[start][2] > self.stroke_list[-2][2]:
-                        if self.fx_list[start][3] == 'up' and self.fx_list[start][0] > stroke_change[0]:
-                            if len(self.stroke_list) < 3 or (cur_fx[4] - self.fx_list[start][4] > 3):
+                if cur_fx.direction == DOWN:
+                    while len(self.fx_list) > abs(start) and self.fx_list[start].index > self.stroke_list[-2].index:
+                        if self.fx_list[start].direction == UP and self.fx_list[start].high > stroke_change.high:
+                            if len(self.stroke_list) < 3 or (cur_fx.index - self.fx_list[start].index > 3):
                                 stroke_change = self.fx_list[start]
                         start -= 1
                 else:
-                    while len(self.fx_list) > abs(start) and self.fx_list[start][2] > self.stroke_list[-2][2]:
-                        if self.fx_list[start][3] == 'down' and self.fx_list[start][1] < stroke_change[1]:
-                            if len(self.stroke_list) < 3 or (cur_fx[4] - self.fx_list[start][4] > 3):
+                    while len(self.fx_list) > abs(start) and self.fx_list[start].index > self.stroke_list[-2].index:
+                        if self.fx_list[start].direction == DOWN and self.fx_list[start].low < stroke_change.low:
+                            if len(self.stroke_list) < 3 or (cur_fx.index - self.fx_list[start].index > 3):
                                 stroke_change = self.fx_list[start]
                         start -= 1
             if stroke_change and not stroke_change == self.stroke_list[-2]:
                 ChanLog.log(self.freq, self.symbol, 'stroke_change')
                 ChanLog.log(self.freq, self.symbol, stroke_change)
+                if self.profiler:
+                    self.profiler.count('stroke_change')
                 self.stroke_list[-2] = stroke_change
                 if len(self.stroke_list) > 2:
                     cur_fx = self.stroke_list[-2]
                     last_fx = self.stroke_list[-3]
-                    self.macd[cur_fx[2]] = self.cal_macd(last_fx[4], cur_fx[4])
-                # if cur_fx[4] - self.stroke_list[-2][4] < 4:
+                    self.macd[cur_fx.index] = self.cal_macd(last_fx.index, cur_fx.index)
+                # if cur_fx.index - self.stroke_list[-2].index < 4:
                 #     self.stroke_list.pop()
 
             if self.build_pivot:
@@ -200,7 +402,7 @@ class Chan_Class:
                 if len(self.stroke_list) > 1:
                     cur_fx = self.stroke_list[-1]
                     last_fx = self.stroke_list[-2]
-                    self.macd[cur_fx[2]] = self.cal_macd(last_fx[4], cur_fx[4])
+                    self.macd[cur_fx.index] = self.cal_macd(last_fx.index, cur_fx.index)
                 self.on_line(self.stroke_list)
                 if pivot_flag:
                     self.on_pivot(self.stroke_list, None)
@@ -212,71 +414,80 @@ class Chan_Class:
             # ChanLog.log(self.freq, self.symbol, 'line_index:')
             # ChanLog.log(self.freq, self.symbol, self.line_index)
             pivot_flag = False
-            if data[-1][3] == 'up' and data[-3][0] >= data[-1][0] and data[-3][0] >= data[-5][0]:
-                if not self.line_list or self.line_list[-1][3] == 'down':
+            if data[-1].direction == UP and data[-3].high >= data[-1].high and data[-3].high >= data[-5].high:
+                if not self.line_list or self.line_list[-1].direction == DOWN:
                     if not self.line_list or ((len(self.stroke_list) - 3) - self.line_index[
-                        str(self.line_list[-1][2])] > 2 and self.line_list[-1][1] < data[-3][0]):
+                        self.line_list[-1].index] > 2 and self.line_list[-1].low < data[-3].high):
                         # 出现顶
                         self.line_list.append(data[-3])
-                        self.line_index[str(self.line_list[-1][2])] = len(self.stroke_list) - 3
+                        self.line_index[self.line_list[-1].index] = len(self.stroke_list) - 3
                         pivot_flag = True
+                        if self.profiler:
+                            self.profiler.count('line_add')
                 else:
                     # 延申顶
-                    if self.line_list[-1][0] < data[-3][0]:
+                    if self.line_list[-1].high < data[-3].high:
                         self.line_list[-1] = data[-3]
-                        self.line_index[str(self.line_list[-1][2])] = len(self.stroke_list) - 3
+                        self.line_index[self.line_list[-1].index] = len(self.stroke_list) - 3
                         pivot_flag = True
-            if data[-1][3] == 'down' and data[-3][1] <= data[-1][1] and data[-3][1] <= data[-5][1]:
-                if not self.line_list or self.line_list[-1][3] == 'up':
+                        if self.profiler:
+                            self.profiler.count('line_extend')
+            if data[-1].direction == DOWN and data[-3].low <= data[-1].low and data[-3].low <= data[-5].low:
+                if not self.line_list or self.line_list[-1].direction == UP:
                     if not self.line_list or ((len(self.stroke_list) - 3) - self.line_index[
-                        str(self.line_list[-1][2])] > 2 and self.line_list[-1][0] > data[-3][1]):
+                        self.line_list[-1].index] > 2 and self.line_list[-1].high > data[-3].low):
                         # 出现底
                         self.line_list.append(data[-3])
-                        self.line_index[str(self.line_list[-1][2])] = len(self.stroke_list) - 3
+                        self.line_index[self.line_list[-1].index] = len(self.stroke_list) - 3
                         pivot_flag = True
+                        if self.profiler:
+                            self.profiler.count('line_add')
                 else:
                     # 延申底
-                    if self.line_list[-1][1] > data[-3][1]:
+                    if self.line_list[-1].low > data[-3].low:
                         self.line_list[-1] = data[-3]
-                        self.line_index[str(self.line_list[-1][2])] = len(self.stroke_list) - 3
+                        self.line_index[self.line_list[-1].index] = len(self.stroke_list) - 3
                         pivot_flag = True
+                        if self.profiler:
+                            self.profiler.count('line_extend')
 
             line_change = None
             if pivot_flag and len(self.line_list) > 1:
                 last_fx = self.line_list[-2]
                 line_change = last_fx
                 cur_fx = self.line_list[-1]
-                cur_index = self.line_index[str(cur_fx[2])]
+                cur_index = self.line_index[cur_fx.index]
                 start = -6
-                last_index = self.line_index[str(last_fx[2])]
+                last_index = self.line_index[last_fx.index]
                 if cur_index - last_index > 3:
-                    while len(self.stroke_list) >= abs(start - 2) and self.stroke_list[start][2] > last_fx[2]:
-                        if cur_fx[3] == 'down' and self.stroke_list[start][0] > self.stroke_list[start + 2][0] and \
-                                self.stroke_list[start][0] > self.stroke_list[start - 2][0] and self.stroke_list[start][
-                            0] > line_change[0]:
-                            line_change = self.stroke_list[start]
-                        if cur_fx[3] == 'up' and self.stroke_list[start][1] < self.stroke_list[start + 2][1] and \
-                                self.stroke_list[start][1] < self.stroke_list[start - 2][1] and self.stroke_list[start][
-                            1] < line_change[1]:
-                            line_change = self.stroke_list[start]
+                    while len(self.stroke_list) >= abs(start - 2) and self.stroke_list[start].index > last_fx.index:
+                        stroke = self.stroke_list[start]
+                        if cur_fx.direction == DOWN and stroke.high > self.stroke_list[start + 2].high and \
+                                stroke.high > self.stroke_list[start - 2].high and stroke.high > line_change.high:
+                            line_change = stroke
+                        if cur_fx.direction == UP and stroke.low < self.stroke_list[start + 2].low and \
+                                stroke.low < self.stroke_list[start - 2].low and stroke.low < line_change.low:
+                            line_change = stroke
                         start -= 2
 
             if line_change and not line_change == self.line_list[-2]:
                 ChanLog.log(self.freq, self.symbol, 'line_change')
                 ChanLog.log(self.freq, self.symbol, line_change)
-                ChanLog.log(self.freq, self.symbol, self.line_list)
-                self.line_index[str(line_change[2])] = self.line_index[str(self.line_list[-2][2])]
+                if self.profiler:
+                    self.profiler.count('line_change')
+                ChanLog.log(self.freq, self.symbol, self.line_list, level=DEBUG)
+                self.line_index[line_change.index] = self.line_index[self.line_list[-2].index]
                 self.line_list[-2] = line_change
                 if len(self.line_list) > 2:
                     cur_fx = self.line_list[-2]
                     last_fx = self.line_list[-3]
-                    self.macd[cur_fx[2]] = self.cal_macd(last_fx[4], cur_fx[4])
+                    self.macd[cur_fx.index] = self.cal_macd(last_fx.index, cur_fx.index)
 
             if self.line_list and self.build_pivot:
                 if len(self.line_list) > 1:
                     cur_fx = self.line_list[-1]
                     last_fx = self.line_list[-2]
-                    self.macd[cur_fx[2]] = self.cal_macd(last_fx[4], cur_fx[4])
+                    self.macd[cur_fx.index] = self.cal_macd(last_fx.index, cur_fx.index)
                 ChanLog.log(self.freq, self.symbol, 'line_list:')
                 ChanLog.log(self.freq, self.symbol, self.line_list[-1])
                 self.on_pivot(self.line_list, None)
@@ -285,7 +496,7 @@ class Chan_Class:
         # 中枢列表[[日期1，日期2，中枢低点，中枢高点, 中枢类型，中枢进入段，中枢离开段, 形成时间, GG, DD,BS,BS,TS]]]
         # 日期1：中枢开始的时间
         # 日期2：中枢结束的时间，可能延申
-        # 中枢类型： ‘up', 'down'
+        # 中枢类型： UP, DOWN
         # BS: 买点
         # BS: 卖点
         # TS: 背驰段
@@ -297,157 +508,139 @@ class Chan_Class:
             flag = False
             # 构成新的中枢
             # 判断形成新的中枢的可能性
-            if not self.pivot_list or (len(self.pivot_list) > 0 and len(data) - self.pivot_list[-1][6] > 4):
-                cur_pivot = [data[-5][2], last_fx[2]]
-                if cur_fx[3] == 'down' and data[-2][0] > data[-5][1]:
-                    ZD = max(data[-3][1], data[-5][1])
-                    ZG = min(data[-2][0], data[-4][0])
-                    DD = min(data[-3][1], data[-5][1])
-                    GG = max(data[-2][0], data[-4][0])
+            if not self.pivot_list or (len(self.pivot_list) > 0 and len(data) - self.pivot_list[-1].exit > 4):
+                if cur_fx.direction == DOWN and data[-2].high > data[-5].low:
+                    ZD = max(data[-3].low, data[-5].low)
+                    ZG = min(data[-2].high, data[-4].high)
+                    DD = min(data[-3].low, data[-5].low)
+                    GG = max(data[-2].high, data[-4].high)
                     if ZG > ZD:
-                        cur_pivot.append(ZD)
-                        cur_pivot.append(ZG)
-                        cur_pivot.append('down')
-                        cur_pivot.append(len(data) - 5)
-                        cur_pivot.append(len(data) - 2)
-                        cur_pivot.append(cur_fx[2])
-                        cur_pivot.append(GG)
-                        cur_pivot.append(DD)
-                        cur_pivot.append([[], [], []])
-                        cur_pivot.append([[], [], []])
-                        cur_pivot.append([])
-                        new_pivot = cur_pivot
+                        new_pivot = PivotData(data[-5].datetime, last_fx.datetime, ZD, ZG, DOWN, len(data) - 5,
+                                              len(data) - 2, cur_fx.datetime, GG, DD)
                         # 中枢形成，判断背驰
-                if cur_fx[3] == 'up' and data[-2][1] < data[-5][0]:
-                    ZD = max(data[-2][1], data[-4][1])
-                    ZG = min(data[-3][0], data[-5][0])
-                    DD = min(data[-2][1], data[-4][1])
-                    GG = max(data[-3][0], data[-5][0])
+                if cur_fx.direction == UP and data[-2].low < data[-5].high:
+                    ZD = max(data[-2].low, data[-4].low)
+                    ZG = min(data[-3].high, data[-5].high)
+                    DD = min(data[-2].low, data[-4].low)
+                    GG = max(data[-3].high, data[-5].high)
                     if ZG > ZD:
-                        cur_pivot.append(ZD)
-                        cur_pivot.append(ZG)
-                        cur_pivot.append('up')
-                        cur_pivot.append(len(data) - 5)
-                        cur_pivot.append(len(data) - 2)
-                        cur_pivot.append(cur_fx[2])
-                        cur_pivot.append(GG)
-                        cur_pivot.append(DD)
-                        cur_pivot.append([[], [], []])
-                        cur_pivot.append([[], [], []])
-                        cur_pivot.append([])
-                        new_pivot = cur_pivot
+                        new_pivot = PivotData(data[-5].datetime, last_fx.datetime, ZD, ZG, UP, len(data) - 5,
+                                              len(data) - 2, cur_fx.datetime, GG, DD)
                 if not self.pivot_list:
                     if new_pivot:
                         flag = True
                 else:
                     last_pivot = self.pivot_list[-1]
-                    if new_pivot and ((new_pivot[2] > last_pivot[3] and cur_fx[3] == 'up') or (
-                            new_pivot[3] < last_pivot[2] and cur_fx[3] == 'down')):
+                    if new_pivot and ((new_pivot.zd > last_pivot.zg and cur_fx.direction == UP) or (
+                            new_pivot.zg < last_pivot.zd and cur_fx.direction == DOWN)):
                         flag = True
-                    if type and new_pivot and type == new_pivot[4]:
+                    if type and new_pivot and type == new_pivot.direction:
                         flag = True
 
             if len(self.pivot_list) > 0 and not flag:
                 last_pivot = self.pivot_list[-1]
-                ts = last_pivot[12]
+                ts = last_pivot.ts
                 # 由于stroke/line_change，不断change中枢
-                start = last_pivot[5]
+                start = last_pivot.enter
                 # 防止异常
                 if len(data) <= start:
                     self.pivot_list.pop()
+                    if self.profiler:
+                        self.profiler.count('pivot_pop')
                     if not self.pivot_list:
                         return
                     last_pivot = self.pivot_list[-1]
-                    start = last_pivot[5]
-                buy = last_pivot[10]
-                sell = last_pivot[11]
-                enter = data[start][2]
-                exit = cur_fx[2]
+                    start = last_pivot.enter
+                buy = last_pivot.buy
+                sell = last_pivot.sell
+                enter = data[start].index
+                exit = cur_fx.index
                 ee_data = [[data[start - 1], data[start]],
                            [data[len(data) - 2], data[len(data) - 1]]]
 
-                if last_pivot[4] == 'up':
+                if last_pivot.direction == UP:
                     # stroke_change导致的笔减少了
                     if len(data) > start + 3:
-                        last_pivot[2] = max(data[start + 1][1], data[start + 3][1])
-                        last_pivot[3] = min(data[start][0], data[start + 2][0])
-                        last_pivot[8] = max(data[start][0], data[start + 2][0])
-                        last_pivot[9] = min(data[start + 1][1], data[start + 3][1])
-                    if cur_fx[3] == 'up':
+                        last_pivot.zd = max(data[start + 1].low, data[start + 3].low)
+                        last_pivot.zg = min(data[start].high, data[start + 2].high)
+                        last_pivot.gg = max(data[start].high, data[start + 2].high)
+                        last_pivot.dd = min(data[start + 1].low, data[start + 3].low)
+                    if cur_fx.direction == UP:
                         if sell[0]:
                             # 一卖后的顶分型判断一卖是否有效，无效则将上一个一卖置为无效
-                            if sell[0][1] < cur_fx[0] and len(data) - last_pivot[6] < 3:
+                            if sell[0].price < cur_fx.high and len(data) - last_pivot.exit < 3:
                                 # 置一卖无效
-                                sell[0][5] = 0
-                                sell[0][6] = self.k_list[-1].datetime
+                                sell[0].valid = 0
+                                sell[0].invalid_time = self.k_list.get_datetime(-1)
                                 sell[0] = []
                                 # 置二卖无效
                                 if sell[1]:
-                                    sell[1][5] = 0
-                                    sell[1][6] = self.k_list[-1].datetime
+                                    sell[1].valid = 0
+                                    sell[1].invalid_time = self.k_list.get_datetime(-1)
                                     sell[1] = []
                         # 判断背驰
-                        if self.on_turn(enter, exit, ee_data, last_pivot[4]) and cur_fx[0] > last_pivot[8]:
-                            ts.append([last_fx[2], cur_fx[2]])
+                        if self.on_turn(enter, exit, ee_data, last_pivot.direction) and cur_fx.high > last_pivot.gg:
+                            ts.append([last_fx.datetime, cur_fx.datetime])
                             if not sell[0]:
                                 # 形成一卖
-                                ans, qjt_pivot_list = self.qjt_turn(last_fx[2], cur_fx[2], 'up')
+                                ans, qjt_pivot_list = self.qjt_turn(last_fx.datetime, cur_fx.datetime, UP)
                                 if ans:
-                                    sell[0] = [cur_fx[2], cur_fx[0], 'S1', self.k_list[-1].datetime, len(data) - 1, 1,
-                                               None, self.cal_bs_type(), None, qjt_pivot_list]
+                                    sell[0] = BsData(cur_fx.datetime, cur_fx.high, 'S1', self.k_list.get_datetime(-1),
+                                                     len(data) - 1, 1, None, self.cal_bs_type(), None, qjt_pivot_list)
                                     self.on_buy_sell(sell[0])
                         if sell[0] and not sell[1]:
-                            pos_sell1 = sell[0][4]
+                            pos_sell1 = sell[0].index
                             if len(data) > pos_sell1 + 2:
                                 pos_fx = data[pos_sell1 + 2]
-                                if pos_fx[3] == 'up':
-                                    if pos_fx[1] < sell[0][1]:
+                                if pos_fx.direction == UP:
+                                    if pos_fx.low < sell[0].price:
                                         # 形成二卖
-                                        ans, qjt_pivot_list = self.qjt_trend(last_fx[2], cur_fx[2], 'up')
+                                        ans, qjt_pivot_list = self.qjt_trend(last_fx.datetime, cur_fx.datetime, UP)
                                         if ans:
-                                            sell[1] = [pos_fx[2], pos_fx[0], 'S2', self.k_list[-1].datetime,
-                                                       pos_sell1 + 2, 1, None, self.cal_bs_type(), None, qjt_pivot_list]
+                                            sell[1] = BsData(pos_fx.datetime, pos_fx.high, 'S2',
+                                                             self.k_list.get_datetime(-1), pos_sell1 + 2, 1, None,
+                                                             self.cal_bs_type(), None, qjt_pivot_list)
                                         self.on_buy_sell(sell[1])
                                     else:
                                         # 一卖无效
-                                        sell[0][5] = 0
-                                        sell[0][6] = self.k_list[-1].datetime
+                                        sell[0].valid = 0
+                                        sell[0].invalid_time = self.k_list.get_datetime(-1)
                                         sell[0] = []
 
-                        if cur_fx[0] < last_pivot[2] and not sell[2] and not buy[0]:
+                        if cur_fx.high < last_pivot.zd and not sell[2] and not buy[0]:
                             # 形成三卖
-                            ans, qjt_pivot_list = self.qjt_trend(last_fx[2], cur_fx[2], 'up')
+                            ans, qjt_pivot_list = self.qjt_trend(last_fx.datetime, cur_fx.datetime, UP)
                             if ans:
-                                condition = len(data) > 2 and data[-3][0] < last_pivot[2] and data[-3][2] > last_pivot[
-                                    1]
+                                condition = len(data) > 2 and data[-3].high < last_pivot.zd and \
+                                            data[-3].datetime > last_pivot.end
                                 if not condition:
-                                    sell[2] = [cur_fx[2], cur_fx[0], 'S3', self.k_list[-1].datetime, len(data) - 1, 1,
-                                               None, self.cal_bs_type(), None, qjt_pivot_list]
+                                    sell[2] = BsData(cur_fx.datetime, cur_fx.high, 'S3', self.k_list.get_datetime(-1),
+                                                     len(data) - 1, 1, None, self.cal_bs_type(), None, qjt_pivot_list)
                                     self.on_buy_sell(sell[2])
 
-                        # if (not last_fx[1] > last_pivot[3]) and (not cur_fx[0] < last_pivot[2]):
-                        #     last_pivot[1] = cur_fx[2]
-                        #     last_pivot[6] = len(data) - 1
+                        # if (not last_fx.low > last_pivot.zg) and (not cur_fx.high < last_pivot.zd):
+                        #     last_pivot.end = cur_fx.datetime
+                        #     last_pivot.exit = len(data) - 1
 
                     else:
                         # 判断是否延申
-                        if (not cur_fx[1] > last_pivot[3]) and (not last_fx[0] < last_pivot[2]):
-                            last_pivot[1] = cur_fx[2]
-                            last_pivot[6] = len(data) - 1
+                        if (not cur_fx.low > last_pivot.zg) and (not last_fx.high < last_pivot.zd):
+                            last_pivot.end = cur_fx.datetime
+                            last_pivot.exit = len(data) - 1
                         else:
                             # 判断形成第三类买点
-                            if cur_fx[1] > last_pivot[2] and not buy[2] and not sell[0]:
-                                ans, qjt_pivot_list = self.qjt_trend(last_fx[2], cur_fx[2], 'down')
+                            if cur_fx.low > last_pivot.zd and not buy[2] and not sell[0]:
+                                ans, qjt_pivot_list = self.qjt_trend(last_fx.datetime, cur_fx.datetime, DOWN)
                                 if ans:
-                                    condition = len(data) > 2 and data[-3][1] > last_pivot[3] and data[-3][2] > \
-                                                last_pivot[1]
+                                    condition = len(data) > 2 and data[-3].low > last_pivot.zg and data[-3].datetime > \
+                                                last_pivot.end
                                     if not condition:
                                         sth_pivot = last_pivot
                                         # if len(self.pivot_list) > 1:
                                         #     sth_pivot = self.pivot_list[-2]
-                                        buy[2] = [cur_fx[2], cur_fx[1], 'B3', self.k_list[-1].datetime, len(data) - 1,
-                                                  1, None, self.cal_bs_type(),
-                                                  self.cal_b3_strength(cur_fx[1], sth_pivot), qjt_pivot_list]
+                                        buy[2] = BsData(cur_fx.datetime, cur_fx.low, 'B3', self.k_list.get_datetime(-1),
+                                                        len(data) - 1, 1, None, self.cal_bs_type(),
+                                                        self.cal_b3_strength(cur_fx.low, sth_pivot), qjt_pivot_list)
                                         ChanLog.log(self.freq, self.symbol, 'B3-pivot')
                                         ChanLog.log(self.freq, self.symbol, sth_pivot)
                                         ChanLog.log(self.freq, self.symbol, buy[2])
@@ -457,156 +650,159 @@ class Chan_Class:
                 else:
                     # stroke_change导致的笔减少了
                     if len(data) > start + 3:
-                        last_pivot[2] = max(data[start][1], data[start + 2][1])
-                        last_pivot[3] = min(data[start + 1][0], data[start + 3][0])
-                        last_pivot[8] = max(data[start + 1][0], data[start + 3][0])
-                        last_pivot[9] = min(data[start][1], data[start + 2][1])
-                    if cur_fx[3] == 'down':
+                        last_pivot.zd = max(data[start].low, data[start + 2].low)
+                        last_pivot.zg = min(data[start + 1].high, data[start + 3].high)
+                        last_pivot.gg = max(data[start + 1].high, data[start + 3].high)
+                        last_pivot.dd = min(data[start].low, data[start + 2].low)
+                    if cur_fx.direction == DOWN:
                         if buy[0]:
                             # 一买后的底分型判断一买是否有效，无效则将上一个一买置为无效
-                            if buy[0][1] > cur_fx[1] and len(data) - last_pivot[6] < 3:
+                            if buy[0].price > cur_fx.low and len(data) - last_pivot.exit < 3:
                                 # 置一买无效
-                                buy[0][5] = 0
-                                buy[0][6] = self.k_list[-1].datetime
+                                buy[0].valid = 0
+                                buy[0].invalid_time = self.k_list.get_datetime(-1)
                                 buy[0] = []
                                 # 置二买无效
                                 if buy[1]:
-                                    buy[1][5] = 0
-                                    buy[1][6] = self.k_list[-1].datetime
+                                    buy[1].valid = 0
+                                    buy[1].invalid_time = self.k_list.get_datetime(-1)
                                     buy[1] = []
 
                         # 判断背驰
-                        if self.on_turn(enter, exit, ee_data, last_pivot[4]) and cur_fx[1] < last_pivot[9]:
-                            ts.append([last_fx[2], cur_fx[2]])
+                        if self.on_turn(enter, exit, ee_data, last_pivot.direction) and cur_fx.low < last_pivot.dd:
+                            ts.append([last_fx.datetime, cur_fx.datetime])
                             if not buy[0]:
                                 # 形成一买
-                                ans, qjt_pivot_list = self.qjt_turn(last_fx[2], cur_fx[2], 'down')
+                                ans, qjt_pivot_list = self.qjt_turn(last_fx.datetime, cur_fx.datetime, DOWN)
                                 if ans:
-                                    buy[0] = [cur_fx[2], cur_fx[1], 'B1', self.k_list[-1].datetime, len(data) - 1, 1,
-                                              None, self.cal_bs_type(), None, qjt_pivot_list]
+                                    buy[0] = BsData(cur_fx.datetime, cur_fx.low, 'B1', self.k_list.get_datetime(-1),
+                                                    len(data) - 1, 1, None, self.cal_bs_type(), None, qjt_pivot_list)
                                     if self.gz:
-                                        self.gz_prev_last_bs = self.get_prev_last_bs()
+                                        self.gz_last_bs = None
                                         self.gz_tmp_bs = buy
-                                        buy[0][5] = 0
+                                        buy[0].valid = 0
                                     else:
                                         self.on_buy_sell(buy[0])
 
-                        if buy[0] and buy[0][5] == 1 and not buy[1]:
-                            pos_buy1 = buy[0][4]
+                        if buy[0] and buy[0].valid == 1 and not buy[1]:
+                            pos_buy1 = buy[0].index
                             if len(data) > pos_buy1 + 2:
                                 pos_fx = data[pos_buy1 + 2]
-                                if pos_fx[3] == 'down':
-                                    if pos_fx[1] > buy[0][1]:
+                                if pos_fx.direction == DOWN:
+                                    if pos_fx.low > buy[0].price:
                                         # 形成二买
-                                        ans, qjt_pivot_list = self.qjt_trend(last_fx[2], cur_fx[2], 'down')
+                                        ans, qjt_pivot_list = self.qjt_trend(last_fx.datetime, cur_fx.datetime, DOWN)
                                         if ans:
                                             sth_pivot = last_pivot
                                             # if len(self.pivot_list) > 1:
                                             #     sth_pivot = self.pivot_list[-2]
-                                            buy[1] = [pos_fx[2], pos_fx[1], 'B2', self.k_list[-1].datetime,
-                                                      pos_buy1 + 2, 1, None, self.cal_bs_type(),
-                                                      self.cal_b2_strength(pos_fx[1], last_fx, sth_pivot),
-                                                      qjt_pivot_list]
+                                            buy[1] = BsData(pos_fx.datetime, pos_fx.low, 'B2',
+                                                            self.k_list.get_datetime(-1), pos_buy1 + 2, 1, None,
+                                                            self.cal_bs_type(),
+                                                            self.cal_b2_strength(pos_fx.low, last_fx, sth_pivot),
+                                                            qjt_pivot_list)
                                             self.on_buy_sell(buy[1])
                                     else:
                                         # 一买无效
-                                        buy[0][5] = 0
-                                        buy[0][6] = self.k_list[-1].datetime
+                                        buy[0].valid = 0
+                                        buy[0].invalid_time = self.k_list.get_datetime(-1)
                                         buy[0] = []
 
-                        if cur_fx[1] > last_pivot[3] and not buy[2] and not sell[0]:
+                        if cur_fx.low > last_pivot.zg and not buy[2] and not sell[0]:
                             # 形成三买
-                            ans, qjt_pivot_list = self.qjt_trend(last_fx[2], cur_fx[2], 'down')
+                            ans, qjt_pivot_list = self.qjt_trend(last_fx.datetime, cur_fx.datetime, DOWN)
                             if ans:
-                                condition = len(data) > 2 and data[-3][1] > last_pivot[3] and data[-3][2] > \
-                                            last_pivot[1]
+                                condition = len(data) > 2 and data[-3].low > last_pivot.zg and data[-3].datetime > \
+                                            last_pivot.end
                                 if not condition:
                                     sth_pivot = last_pivot
                                     # if len(self.pivot_list) > 1:
                                     #     sth_pivot = self.pivot_list[-2]
-                                    buy[2] = [cur_fx[2], cur_fx[1], 'B3', self.k_list[-1].datetime, len(data) - 1, 1,
-                                              None, self.cal_bs_type(), self.cal_b3_strength(cur_fx[1], sth_pivot),
-                                              qjt_pivot_list]
+                                    buy[2] = BsData(cur_fx.datetime, cur_fx.low, 'B3', self.k_list.get_datetime(-1),
+                                                    len(data) - 1, 1, None, self.cal_bs_type(),
+                                                    self.cal_b3_strength(cur_fx.low, sth_pivot), qjt_pivot_list)
                                     ChanLog.log(self.freq, self.symbol, 'B3-pivot')
                                     ChanLog.log(self.freq, self.symbol, sth_pivot)
                                     ChanLog.log(self.freq, self.symbol, buy[2])
                                     self.on_buy_sell(buy[2])
 
-                        # if (not cur_fx[1] > last_pivot[3]) and (not last_fx[0] < last_pivot[2]):
-                        #     last_pivot[1] = cur_fx[2]
-                        #     last_pivot[6] = len(data) - 1
+                        # if (not cur_fx.low > last_pivot.zg) and (not last_fx.high < last_pivot.zd):
+                        #     last_pivot.end = cur_fx.datetime
+                        #     last_pivot.exit = len(data) - 1
                     else:
                         # 判断是否延申
-                        if (not last_fx[1] > last_pivot[3]) and (not cur_fx[0] < last_pivot[2]):
-                            last_pivot[1] = cur_fx[2]
-                            last_pivot[6] = len(data) - 1
+                        if (not last_fx.low > last_pivot.zg) and (not cur_fx.high < last_pivot.zd):
+                            last_pivot.end = cur_fx.datetime
+                            last_pivot.exit = len(data) - 1
                         else:
                             # 判断形成第三类卖点
-                            if cur_fx[1] < last_pivot[3] and not sell[2] and not buy[0]:
-                                ans, qjt_pivot_list = self.qjt_trend(last_fx[2], cur_fx[2], 'up')
+                            if cur_fx.low < last_pivot.zg and not sell[2] and not buy[0]:
+                                ans, qjt_pivot_list = self.qjt_trend(last_fx.datetime, cur_fx.datetime, UP)
                                 if ans:
-                                    condition = len(data) > 2 and data[-3][0] < last_pivot[2] and data[-3][2] > \
-                                                last_pivot[1]
+                                    condition = len(data) > 2 and data[-3].high < last_pivot.zd and \
+                                                data[-3].datetime > last_pivot.end
                                     if not condition:
-                                        sell[2] = [cur_fx[2], cur_fx[0], 'S3', self.k_list[-1].datetime, len(data) - 1,
-                                                   1, None, self.cal_bs_type(), None, qjt_pivot_list]
+                                        sell[2] = BsData(cur_fx.datetime, cur_fx.high, 'S3',
+                                                         self.k_list.get_datetime(-1), len(data) - 1, 1, None,
+                                                         self.cal_bs_type(), None, qjt_pivot_list)
                                         self.on_buy_sell(sell[2])
 
                 # 判断一二类买卖点失效
                 if len(self.pivot_list) > 1:
                     pre = self.pivot_list[-2]
-                    pre_buy = pre[10]
-                    pre_sell = pre[11]
+                    pre_buy = pre.buy
+                    pre_sell = pre.sell
                     if pre_sell[0] and not pre_sell[1]:
-                        pos_sell1 = pre_sell[0][4]
+                        pos_sell1 = pre_sell[0].index
                         if len(data) > pos_sell1 + 2:
                             pos_fx = data[pos_sell1 + 2]
-                            if pos_fx[3] == 'up':
-                                if pos_fx[0] < pre_sell[0][1]:
+                            if pos_fx.direction == UP:
+                                if pos_fx.high < pre_sell[0].price:
                                     # 形成二卖
-                                    pre_sell[1] = [pos_fx[2], pos_fx[0], 'S2', self.k_list[-1].datetime, pos_sell1 + 2,
-                                                   1, None, pre_sell[0][7], None]
+                                    pre_sell[1] = BsData(pos_fx.datetime, pos_fx.high, 'S2',
+                                                         self.k_list.get_datetime(-1), pos_sell1 + 2, 1, None,
+                                                         pre_sell[0].bs_type, None)
                                     self.on_buy_sell(pre_sell[1])
                                 else:
                                     # 一卖无效
-                                    pre_sell[0][5] = 0
-                                    pre_sell[0][6] = self.k_list[-1].datetime
+                                    pre_sell[0].valid = 0
+                                    pre_sell[0].invalid_time = self.k_list.get_datetime(-1)
                                     pre_sell[0] = []
 
-                    if pre_buy[0] and pre_buy[0][5] == 1 and not pre_buy[1]:
-                        pos_buy1 = pre_buy[0][4]
+                    if pre_buy[0] and pre_buy[0].valid == 1 and not pre_buy[1]:
+                        pos_buy1 = pre_buy[0].index
                         if len(data) > pos_buy1 + 2:
                             pos_fx = data[pos_buy1 + 2]
-                            if pos_fx[3] == 'down':
-                                if pos_fx[1] > pre_buy[0][1]:
+                            if pos_fx.direction == DOWN:
+                                if pos_fx.low > pre_buy[0].price:
                                     sth_pivot = None
                                     # if len(self.pivot_list) > 2:
                                     #     sth_pivot = self.pivot_list[-3]
                                     if len(self.pivot_list) > 1:
                                         sth_pivot = self.pivot_list[-2]
                                     # 形成二买
-                                    pre_buy[1] = [pos_fx[2], pos_fx[1], 'B2', self.k_list[-1].datetime, pos_buy1 + 2, 1,
-                                                  None, pre_buy[0][7],
-                                                  self.cal_b2_strength(pos_fx[1], data[pos_buy1 + 1], sth_pivot)]
+                                    pre_buy[1] = BsData(pos_fx.datetime, pos_fx.low, 'B2', self.k_list.get_datetime(-1),
+                                                        pos_buy1 + 2, 1, None, pre_buy[0].bs_type,
+                                                        self.cal_b2_strength(pos_fx.low, data[pos_buy1 + 1], sth_pivot))
                                     self.on_buy_sell(pre_buy[1])
                                 else:
                                     # 一买无效
-                                    pre_buy[0][5] = 0
-                                    pre_buy[0][6] = self.k_list[-1].datetime
+                                    pre_buy[0].valid = 0
+                                    pre_buy[0].invalid_time = self.k_list.get_datetime(-1)
                                     pre_buy[0] = []
 
                     # B2失效的判断标准：以B2为起点的笔的顶不大于反转笔的顶。
                     # 判断条件有问题
-                    if pre_buy[1] and len(data) > pre_buy[1][4] + 2:
-                        start = pre_buy[1][4] + 1
+                    if pre_buy[1] and len(data) > pre_buy[1].index + 2:
+                        start = pre_buy[1].index + 1
                         if data[start] < data[start - 2]:
                             if pre_buy[0]:
                                 # 一买无效
-                                pre_buy[0][5] = 0
-                                pre_buy[0][6] = self.k_list[-1].datetime
+                                pre_buy[0].valid = 0
+                                pre_buy[0].invalid_time = self.k_list.get_datetime(-1)
                                 pre_buy[0] = []
-                                pre_buy[1][5] = 0
-                                pre_buy[1][6] = self.k_list[-1].datetime
+                                pre_buy[1].valid = 0
+                                pre_buy[1].invalid_time = self.k_list.get_datetime(-1)
                                 pre_buy[1] = []
 
                     sth_pivot = None
@@ -618,44 +814,44 @@ class Chan_Class:
 
                 if len(self.pivot_list) > 2:
                     pre2 = self.pivot_list[-3]
-                    pre_buy = pre2[10]
-                    pre_sell = pre2[11]
+                    pre_buy = pre2.buy
+                    pre_sell = pre2.sell
                     pre1 = self.pivot_list[-2]
-                    if pre1[3] < last_pivot[2] and pre2[3] < pre1[2]:
+                    if pre1.zg < last_pivot.zd and pre2.zg < pre1.zd:
                         # 上升趋势
                         if pre_sell[0]:
                             # 置一卖无效
-                            pre_sell[0][5] = 0
-                            pre_sell[0][6] = self.k_list[-1].datetime
+                            pre_sell[0].valid = 0
+                            pre_sell[0].invalid_time = self.k_list.get_datetime(-1)
                             pre_sell[0] = []
 
                         if pre_sell[1]:
                             # 置二卖无效
-                            pre_sell[1][5] = 0
-                            pre_sell[1][6] = self.k_list[-1].datetime
+                            pre_sell[1].valid = 0
+                            pre_sell[1].invalid_time = self.k_list.get_datetime(-1)
                             pre_sell[1] = []
-                    # if pre1[2] > last_pivot[3]:
+                    # if pre1.zd > last_pivot.zg:
                     #     # 下降趋势
                     #     if pre_buy[0]:
                     #         # 置一买无效
-                    #         pre_buy[0][5] = 0
-                    #         pre_buy[0][6] = self.k_list[-1].datetime
+                    #         pre_buy[0].valid = 0
+                    #         pre_buy[0].invalid_time = self.k_list.get_datetime(-1)
                     #         pre_buy[0] = []
                     #
                     #     if pre_buy[1]:
                     #         # 置二买无效
-                    #         pre_buy[1][5] = 0
-                    #         pre_buy[1][6] = self.k_list[-1].datetime
+                    #         pre_buy[1].valid = 0
+                    #         pre_buy[1].invalid_time = self.k_list.get_datetime(-1)
                     #         pre_buy[1] = []
                 # 判断三类买卖点失效
-                if sell[2] and sell[2][0] < last_pivot[1]:
-                    sell[2][5] = 0
-                    sell[2][6] = self.k_list[-1].datetime
+                if sell[2] and sell[2].datetime < last_pivot.end:
+                    sell[2].valid = 0
+                    sell[2].invalid_time = self.k_list.get_datetime(-1)
                     sell[2] = []
 
-                if buy[2] and buy[2][0] < last_pivot[1]:
-                    buy[2][5] = 0
-                    buy[2][6] = self.k_list[-1].datetime
+                if buy[2] and buy[2].datetime < last_pivot.end:
+                    buy[2].valid = 0
+                    buy[2].invalid_time = self.k_list.get_datetime(-1)
                     buy[2] = []
                 sth_pivot = last_pivot
                 # if len(self.pivot_list) > 1:
@@ -665,38 +861,40 @@ class Chan_Class:
             if flag:
                 if new_pivot:
                     self.pivot_list.append(new_pivot)
+                    if self.profiler:
+                        self.profiler.count('pivot_add')
                     # 中枢形成，判断背驰
-                    ts = new_pivot[12]
-                    buy = new_pivot[10]
-                    sell = new_pivot[11]
-                    enter = data[new_pivot[5]][2]
-                    exit = data[new_pivot[6]][2]
-                    ee_data = [[data[new_pivot[5] - 1], data[new_pivot[5]]],
-                               [data[new_pivot[6] - 1], data[new_pivot[6]]]]
-                    if new_pivot[4] == 'up':
-                        if self.on_turn(enter, exit, ee_data, new_pivot[4]) and cur_fx[0] > new_pivot[8]:
-                            ts.append([last_fx[2], cur_fx[2]])
+                    ts = new_pivot.ts
+                    buy = new_pivot.buy
+                    sell = new_pivot.sell
+                    enter = data[new_pivot.enter].index
+                    exit = data[new_pivot.exit].index
+                    ee_data = [[data[new_pivot.enter - 1], data[new_pivot.enter]],
+                               [data[new_pivot.exit - 1], data[new_pivot.exit]]]
+                    if new_pivot.direction == UP:
+                        if self.on_turn(enter, exit, ee_data, new_pivot.direction) and cur_fx.high > new_pivot.gg:
+                            ts.append([last_fx.datetime, cur_fx.datetime])
                             if not sell[0]:
                                 # 形成一卖
-                                ans, qjt_pivot_list = self.qjt_turn(last_fx[2], cur_fx[2], 'up')
+                                ans, qjt_pivot_list = self.qjt_turn(last_fx.datetime, cur_fx.datetime, UP)
                                 if ans:
-                                    sell[0] = [cur_fx[2], cur_fx[0], 'S1', self.k_list[-1].datetime, len(data) - 1, 1,
-                                               None, self.cal_bs_type(), None, qjt_pivot_list]
+                                    sell[0] = BsData(cur_fx.datetime, cur_fx.high, 'S1', self.k_list.get_datetime(-1),
+                                                     len(data) - 1, 1, None, self.cal_bs_type(), None, qjt_pivot_list)
                                     self.on_buy_sell(sell[0])
 
-                    if new_pivot[4] == 'down':
-                        if self.on_turn(enter, exit, ee_data, new_pivot[4]) and cur_fx[1] < new_pivot[9]:
-                            ts.append([last_fx[2], cur_fx[2]])
+                    if new_pivot.direction == DOWN:
+                        if self.on_turn(enter, exit, ee_data, new_pivot.direction) and cur_fx.low < new_pivot.dd:
+                            ts.append([last_fx.datetime, cur_fx.datetime])
                             if not buy[0]:
                                 # 形成一买
-                                ans, qjt_pivot_list = self.qjt_turn(last_fx[2], cur_fx[2], 'down')
+                                ans, qjt_pivot_list = self.qjt_turn(last_fx.datetime, cur_fx.datetime, DOWN)
                                 if ans:
-                                    buy[0] = [cur_fx[2], cur_fx[1], 'B1', self.k_list[-1].datetime, len(data) - 1, 1,
-                                              None, self.cal_bs_type(), None, qjt_pivot_list]
+                                    buy[0] = BsData(cur_fx.datetime, cur_fx.low, 'B1', self.k_list.get_datetime(-1),
+                                                    len(data) - 1, 1, None, self.cal_bs_type(), None, qjt_pivot_list)
                                     if self.gz:
-                                        self.gz_prev_last_bs = self.get_prev_last_bs()
+                                        self.gz_last_bs = None
                                         self.gz_tmp_bs = buy
-                                        buy[0][5] = 0
+                                        buy[0].valid = 0
                                     else:
                                         self.on_buy_sell(buy[0])
 
@@ -706,106 +904,113 @@ class Chan_Class:
 
     def x_bs_pos(self, data, buy, sell, last_pivot, sth_pivot):
         if not self.gz:
-            if buy[0] and len(data) > buy[0][4] and data[buy[0][4]][2] != buy[0][0]:
-                pos_fx = data[buy[0][4]]
-                buy[0][5] = 0
-                buy[0][6] = self.k_list[-1].datetime
+            if buy[0] and len(data) > buy[0].index and data[buy[0].index].datetime != buy[0].datetime:
+                pos_fx = data[buy[0].index]
+                buy[0].valid = 0
+                buy[0].invalid_time = self.k_list.get_datetime(-1)
                 # B1<DD
-                buy[0] = [pos_fx[2], pos_fx[1], 'B1', self.k_list[-1].datetime, buy[0][4], 1, None, buy[0][7], None]
+                buy[0] = BsData(pos_fx.datetime, pos_fx.low, 'B1', self.k_list.get_datetime(-1), buy[0].index, 1, None,
+                                buy[0].bs_type, None)
                 self.on_buy_sell(buy[0])
 
-        if sell[0] and len(data) > sell[0][4] and data[sell[0][4]][2] != sell[0][0]:
-            pos_fx = data[sell[0][4]]
-            sell[0][5] = 0
-            sell[0][6] = self.k_list[-1].datetime
+        if sell[0] and len(data) > sell[0].index and data[sell[0].index].datetime != sell[0].datetime:
+            pos_fx = data[sell[0].index]
+            sell[0].valid = 0
+            sell[0].invalid_time = self.k_list.get_datetime(-1)
             # S1>GG
-            sell[0] = [pos_fx[2], pos_fx[0], 'S1', self.k_list[-1].datetime, sell[0][4], 1, None, sell[0][7], None]
+            sell[0] = BsData(pos_fx.datetime, pos_fx.high, 'S1', self.k_list.get_datetime(-1), sell[0].index, 1, None,
+                             sell[0].bs_type, None)
             self.on_buy_sell(sell[0])
 
-        if buy[1] and len(data) > buy[1][4] and data[buy[1][4]][2] != buy[1][0]:
-            pos_fx = data[buy[1][4]]
-            buy[1][5] = 0
-            buy[1][6] = self.k_list[-1].datetime
+        if buy[1] and len(data) > buy[1].index and data[buy[1].index].datetime != buy[1].datetime:
+            pos_fx = data[buy[1].index]
+            buy[1].valid = 0
+            buy[1].invalid_time = self.k_list.get_datetime(-1)
             if buy[0]:
-                if pos_fx[1] > buy[0][1]:
+                if pos_fx.low > buy[0].price:
                     # todo 笔延申重新判断为强弱
-                    buy[1] = [pos_fx[2], pos_fx[1], 'B2', self.k_list[-1].datetime, buy[1][4], 1, None, buy[1][7],
-                              self.cal_b2_strength(pos_fx[1], data[buy[1][4]], sth_pivot)]
+                    buy[1] = BsData(pos_fx.datetime, pos_fx.low, 'B2', self.k_list.get_datetime(-1), buy[1].index, 1,
+                                    None, buy[1].bs_type,
+                                    self.cal_b2_strength(pos_fx.low, data[buy[1].index], sth_pivot))
                     self.on_buy_sell(buy[1])
                 else:
                     # 一买无效
-                    buy[0][5] = 0
-                    buy[0][6] = self.k_list[-1].datetime
+                    buy[0].valid = 0
+                    buy[0].invalid_time = self.k_list.get_datetime(-1)
 
-        if sell[1] and len(data) > sell[1][4] and data[sell[1][4]][2] != sell[1][0]:
-            pos_fx = data[sell[1][4]]
-            sell[1][5] = 0
-            sell[1][6] = self.k_list[-1].datetime
+        if sell[1] and len(data) > sell[1].index and data[sell[1].index].datetime != sell[1].datetime:
+            pos_fx = data[sell[1].index]
+            sell[1].valid = 0
+            sell[1].invalid_time = self.k_list.get_datetime(-1)
 
-            if pos_fx[0] < sell[0][1]:
-                sell[1] = [pos_fx[2], pos_fx[0], 'S2', self.k_list[-1].datetime, sell[1][4], 1, None, sell[1][7], None]
+            if pos_fx.high < sell[0].price:
+                sell[1] = BsData(pos_fx.datetime, pos_fx.high, 'S2', self.k_list.get_datetime(-1), sell[1].index, 1,
+                                 None, sell[1].bs_type, None)
                 self.on_buy_sell(sell[1])
             else:
                 # 一卖无效
-                sell[0][5] = 0
-                sell[0][6] = self.k_list[-1].datetime
-
-        if buy[2] and len(data) > buy[2][4] and data[buy[2][4]][2] != buy[2][0] and buy[2][0] > last_pivot[1]:
-            pos_fx = data[buy[2][4]]
-            buy[2][5] = 0
-            buy[2][6] = self.k_list[-1].datetime
-            if pos_fx[1] > last_pivot[3]:
-                buy[2] = [pos_fx[2], pos_fx[1], 'B3', self.k_list[-1].datetime, buy[2][4], 1, None, buy[2][7],
-                          self.cal_b3_strength(pos_fx[1], sth_pivot)]
+                sell[0].valid = 0
+                sell[0].invalid_time = self.k_list.get_datetime(-1)
+
+        if buy[2] and len(data) > buy[2].index and data[buy[2].index].datetime != buy[2].datetime and \
+                buy[2].datetime > last_pivot.end:
+            pos_fx = data[buy[2].index]
+            buy[2].valid = 0
+            buy[2].invalid_time = self.k_list.get_datetime(-1)
+            if pos_fx.low > last_pivot.zg:
+                buy[2] = BsData(pos_fx.datetime, pos_fx.low, 'B3', self.k_list.get_datetime(-1), buy[2].index, 1, None,
+                                buy[2].bs_type, self.cal_b3_strength(pos_fx.low, sth_pivot))
                 ChanLog.log(self.freq, self.symbol, 'B3-pivot')
                 ChanLog.log(self.freq, self.symbol, sth_pivot)
                 ChanLog.log(self.freq, self.symbol, buy[2])
                 self.on_buy_sell(buy[2])
-        if sell[2] and len(data) > sell[2][4] and data[sell[2][4]][2] != sell[2][0] and sell[2][0] > last_pivot[1]:
-            pos_fx = data[sell[2][4]]
-            sell[2][5] = 0
-            sell[2][6] = self.k_list[-1].datetime
-            if pos_fx[0] < last_pivot[2]:
-                sell[2] = [pos_fx[2], pos_fx[0], 'S3', self.k_list[-1].datetime, sell[2][4], 1, None, sell[2][7], None]
+        if sell[2] and len(data) > sell[2].index and data[sell[2].index].datetime != sell[2].datetime and \
+                sell[2].datetime > last_pivot.end:
+            pos_fx = data[sell[2].index]
+            sell[2].valid = 0
+            sell[2].invalid_time = self.k_list.get_datetime(-1)
+            if pos_fx.high < last_pivot.zd:
+                sell[2] = BsData(pos_fx.datetime, pos_fx.high, 'S3', self.k_list.get_datetime(-1), sell[2].index, 1,
+                                 None, sell[2].bs_type, None)
                 self.on_buy_sell(sell[2])
 
     def cal_bs_type(self):
-        if len(self.pivot_list) > 1 and self.pivot_list[-1][4] == self.pivot_list[-2][4]:
+        if len(self.pivot_list) > 1 and self.pivot_list[-1].direction == self.pivot_list[-2].direction:
             return '趋势'
         return '盘整'
 
     def cal_b3_strength(self, price, last_pivot):
         if last_pivot:
-            if price > last_pivot[8]:
+            if price > last_pivot.gg:
                 return '强'
         return '弱'
 
     def cal_b2_strength(self, price, fx, last_pivot):
         if last_pivot:
-            if price > last_pivot[3]:
+            if price > last_pivot.zg:
                 return '超强'
-            if fx[0] > last_pivot[3]:
+            if fx[0] > last_pivot.zg:
                 return '强'
-            if fx[0] > last_pivot[2]:
+            if fx[0] > last_pivot.zd:
                 return '中'
         return '弱'
 
     def cal_macd(self, start, end):
-        sum = 0
+        # macd柱子绝对值在[start, end]的面积，前缀和相减
         if start >= end:
-            return sum
-        if self.include:
-            close_list = np.array([x.close_price for x in self.chan_k_list], dtype=np.double)
-        else:
-            close_list = np.array([x.close_price for x in self.k_list], dtype=np.double)
-        dif, dea, macd = tl.MACD(close_list, fastperiod=12,
-                                 slowperiod=26, signalperiod=9)
-        for i, v in enumerate(macd.tolist()):
-            if start <= i <= end:
-                sum += abs(round(v, 4))
-        return round(sum, 4)
+            return 0
+        return self.macd_manager.area(start, end)
+
+    def get_macd_area(self, data, i):
+        # 第i笔/线段的macd面积，data为stroke_list或line_list
+        if i < 0:
+            i += len(data)
+        if i < 1 or i >= len(data):
+            return 0
+        return self.cal_macd(data[i - 1].index, data[i].index)
 
     def on_turn(self, start, end, ee_data, type):
+        # start/end: 进入段、离开段结束分型在chan_k_list中的位置
         # ee_data: 笔/段列表 [[start, end]]
         # 判断背驰
         start_macd = None
@@ -817,13 +1022,17 @@ class Chan_Class:
         if start_macd and end_macd:
             if math.isnan(start_macd) or math.isnan(end_macd):
                 if len(ee_data) > 1:
-                    if type == 'down':
-                        enter_slope = (ee_data[0][0][0] - ee_data[0][1][1]) / (ee_data[0][1][4] - ee_data[0][0][4] + 1)
-                        exit_slope = (ee_data[1][0][0] - ee_data[1][1][1]) / (ee_data[1][1][4] - ee_data[1][0][4] + 1)
+                    if type == DOWN:
+                        enter_slope = (ee_data[0][0].high - ee_data[0][1].low) / (
+                                ee_data[0][1].index - ee_data[0][0].index + 1)
+                        exit_slope = (ee_data[1][0].high - ee_data[1][1].low) / (
+                                ee_data[1][1].index - ee_data[1][0].index + 1)
                         return abs(enter_slope) > abs(exit_slope)
                     else:
-                        enter_slope = (ee_data[0][0][1] - ee_data[0][1][0]) / (ee_data[0][1][4] - ee_data[0][0][4] + 1)
-                        exit_slope = (ee_data[1][0][1] - ee_data[1][1][0]) / (ee_data[1][1][4] - ee_data[1][0][4] + 1)
+                        enter_slope = (ee_data[0][0].low - ee_data[0][1].high) / (
+                                ee_data[0][1].index - ee_data[0][0].index + 1)
+                        exit_slope = (ee_data[1][0].low - ee_data[1][1].high) / (
+                                ee_data[1][1].index - ee_data[1][0].index + 1)
                         return abs(enter_slope) > abs(exit_slope)
             else:
                 return start_macd > end_macd
@@ -840,23 +1049,23 @@ class Chan_Class:
         ans = False
         ChanLog.log(self.freq, self.symbol, '区间套判断背驰：')
         ChanLog.log(self.freq, self.symbol, self.freq)
-        ChanLog.log(self.freq, self.symbol, str(self.pivot_list[-1]) + ':' + str(start))
+        ChanLog.log(self.freq, self.symbol, '%s:%s', self.pivot_list[-1], start)
         while chan:
             last_pivot = chan.pivot_list[-1]
             tmp = False
-            if last_pivot[1] > start:
-                if last_pivot[11][0]:
+            if last_pivot.end > start:
+                if last_pivot.sell[0]:
                     tmp = True
-                    start = chan.stroke_list[last_pivot[11][0][4] - 1][2]
+                    start = chan.stroke_list[last_pivot.sell[0].index - 1].datetime
                     if chan.build_pivot:
-                        start = chan.stroke_list[last_pivot[11][0][4] - 1][2]
-                if last_pivot[10][0]:
+                        start = chan.stroke_list[last_pivot.sell[0].index - 1].datetime
+                if last_pivot.buy[0]:
                     tmp = True
-                    start = chan.stroke_list[last_pivot[10][0][4] - 1][2]
+                    start = chan.stroke_list[last_pivot.buy[0].index - 1].datetime
                     if chan.build_pivot:
-                        start = chan.stroke_list[last_pivot[10][0][4] - 1][2]
-            ChanLog.log(self.freq, self.symbol, chan.freq + ':' + str(tmp))
-            ChanLog.log(self.freq, self.symbol, str(last_pivot) + ':' + str(start))
+                        start = chan.stroke_list[last_pivot.buy[0].index - 1].datetime
+            ChanLog.log(self.freq, self.symbol, '%s:%s', chan.freq, tmp)
+            ChanLog.log(self.freq, self.symbol, '%s:%s', last_pivot, start)
             ans = ans or tmp
             chan = chan.next
         return ans, qjt_pivot_list
@@ -872,34 +1081,32 @@ class Chan_Class:
         ans = False
         ChanLog.log(self.freq, self.symbol, '区间套判断背驰：')
         ChanLog.log(self.freq, self.symbol, self.freq)
-        ChanLog.log(self.freq, self.symbol, str(self.pivot_list[-1]) + ':' + str(start))
+        ChanLog.log(self.freq, self.symbol, '%s:%s', self.pivot_list[-1], start)
         while chan:
-            tmp = False
-            for i in range(-1, -len(chan.buy_list), -1):
-                buy_dt = chan.buy_list[i]
-                if buy_dt >= end and buy_dt < start:
-                    tmp = True
-                    break
-            tmp = False
-            for i in range(-1, -len(chan.sell_list), -1):
-                sell_dt = chan.sell_list[i]
-                if sell_dt >= end and sell_dt < start:
-                    tmp = True
-                    break
+            # 低级别在[start, end)之间有有效的一类买点(向下)/卖点(向上)
+            tmp = chan.bs_index.exists('B1' if type == DOWN else 'S1', start, end)
             ans = ans or tmp
             chan = chan.next
         return ans, qjt_pivot_list
 
     def qjt_pivot(self, data, type):
-        chan_pivot = Chan_Class(freq=self.freq, symbol=self.symbol, sell=None, buy=None, include=self.include,
-                                include_feature=self.include_feature, build_pivot=self.build_pivot, qjt=False)
-        chan_pivot.macd = self.macd
-        chan_pivot.k_list = self.chan_k_list
-        new_data = []
-        for d in data:
-            new_data.append(d)
-            chan_pivot.on_pivot(new_data, type)
-        return chan_pivot.pivot_list
+        # 用本级别的笔/线段data重新形成中枢和买卖点
+        if self.qjt_builder is None:
+            self.qjt_builder = QjtPivotBuilder(self)
+        return self.qjt_builder.build(data, type)
+
+    def get_qjt_data(self, data, start, end, type):
+        """
+        区间套用的笔/线段：时间在[start, end]之间的，加上start之前的最后一个(和type反向时)。
+        等同于从后往前逐个比较到第一个早于start的为止(不看data[0])，用二分查找定位。
+        """
+        lo = bisect_left_time(data, start)
+        ans = data[max(lo, 1):bisect_right_time(data, end)]
+        if lo > 1:
+            d = data[lo - 1]
+            if (type == UP and d.direction == DOWN) or (type == DOWN and d.direction == UP):
+                ans.insert(0, d)
+        return ans
 
     def qjt_turn(self, start, end, type):
         # 区间套判断背驰：重新形成新的中枢和买卖点
@@ -915,38 +1122,16 @@ class Chan_Class:
 
         while chan:
             tmp = False
-            data = []
             if chan.build_pivot:
-                for i in range(-1, -len(chan.line_list), -1):
-                    d = chan.line_list[i]
-                    if d[2] >= start:
-                        if d[2] <= end:
-                            data.append(d)
-                    else:
-                        if type == 'up' and d[3] == 'down':
-                            data.append(d)
-                        if type == 'down' and d[3] == 'up':
-                            data.append(d)
-                        break
+                data = chan.get_qjt_data(chan.line_list, start, end, type)
             else:
-                for i in range(-1, -len(chan.stroke_list), -1):
-                    d = chan.stroke_list[i]
-                    if d[2] >= start:
-                        if d[2] <= end:
-                            data.append(d)
-                    else:
-                        if type == 'up' and d[3] == 'down':
-                            data.append(d)
-                        if type == 'down' and d[3] == 'up':
-                            data.append(d)
-                        break
-            data.reverse()
+                data = chan.get_qjt_data(chan.stroke_list, start, end, type)
             chan_pivot_list = chan.qjt_pivot(data, type)
-            ChanLog.log(self.freq, self.symbol, str(self.pivot_list[-1]) + ':' + str(start))
-            ChanLog.log(self.freq, self.symbol, chan_pivot_list)
+            ChanLog.log(self.freq, self.symbol, '%s:%s', self.pivot_list[-1], start)
+            ChanLog.log(self.freq, self.symbol, chan_pivot_list, level=DEBUG)
             qjt_pivot_list.append(chan_pivot_list)
-            if chan_pivot_list and len(chan_pivot_list[-1][12]) > 0:
-                ts_item = chan_pivot_list[-1][12][-1]
+            if chan_pivot_list and len(chan_pivot_list[-1].ts) > 0:
+                ts_item = chan_pivot_list[-1].ts[-1]
                 start = ts_item[0]
                 end = ts_item[1]
                 tmp = True
@@ -964,21 +1149,22 @@ class Chan_Class:
         if not self.qjt:
             return True, qjt_pivot_list
         ChanLog.log(self.freq, self.symbol, '区间套判断有无走势：')
-        ChanLog.log(self.freq, self.symbol, str(start) + '--' + str(end))
-        ChanLog.log(self.freq, self.symbol, str(self.pivot_list[-1]))
+        ChanLog.log(self.freq, self.symbol, '%s--%s', start, end)
+        ChanLog.log(self.freq, self.symbol, self.pivot_list[-1])
         chan = self.next
         if not chan:
             return True, qjt_pivot_list
         ans = False
         while chan:
             tmp = False
-            for i in range(-1, -len(chan.pivot_list), -1):
-                last_pivot = chan.pivot_list[i]
-                if last_pivot[1] <= end and last_pivot[0] >= start:
+            # 开始时间>=start的中枢是列表的后缀，和原来一样不看第0个
+            pivot_list = chan.pivot_list
+            for i in range(max(bisect_left_time(pivot_list, start, 'start'), 1), len(pivot_list)):
+                if pivot_list[i].end <= end:
                     tmp = True
                     break
             ans = ans or tmp
-            ChanLog.log(self.freq, self.symbol, chan.freq + ':' + str(tmp))
+            ChanLog.log(self.freq, self.symbol, '%s:%s', chan.freq, tmp)
             chan = chan.next
         return ans, qjt_pivot_list
 
@@ -996,35 +1182,13 @@ class Chan_Class:
 
         while chan:
             tmp = False
-            data = []
             if chan.build_pivot:
-                for i in range(-1, -len(chan.line_list), -1):
-                    d = chan.line_list[i]
-                    if d[2] >= start:
-                        if d[2] <= end:
-                            data.append(d)
-                    else:
-                        if type == 'up' and d[3] == 'down':
-                            data.append(d)
-                        if type == 'down' and d[3] == 'up':
-                            data.append(d)
-                        break
+                data = chan.get_qjt_data(chan.line_list, start, end, type)
             else:
-                for i in range(-1, -len(chan.stroke_list), -1):
-                    d = chan.stroke_list[i]
-                    if d[2] >= start:
-                        if d[2] <= end:
-                            data.append(d)
-                    else:
-                        if type == 'up' and d[3] == 'down':
-                            data.append(d)
-                        if type == 'down' and d[3] == 'up':
-                            data.append(d)
-                        break
-            data.reverse()
+                data = chan.get_qjt_data(chan.stroke_list, start, end, type)
             chan_pivot_list = chan.qjt_pivot(data, type)
-            ChanLog.log(self.freq, self.symbol, str(self.pivot_list[-1]) + ':' + str(start))
-            ChanLog.log(self.freq, self.symbol, chan_pivot_list)
+            ChanLog.log(self.freq, self.symbol, '%s:%s', self.pivot_list[-1], start)
+            ChanLog.log(self.freq, self.symbol, chan_pivot_list, level=DEBUG)
             qjt_pivot_list.append(chan_pivot_list)
             if not len(chan_pivot_list) > 0:
                 chan = chan.next
@@ -1039,34 +1203,35 @@ class Chan_Class:
     def on_gz(self):
         """共振处理：只关联上一个级别"""
         # 暂时 只处理买点B1
-        chan = self.prev
-        if not chan:
+        if not self.prev:
             return
-        last_bs = None
-        if len(chan.buy_list) > 0:
-            last_bs = chan.buy_list[-1]
+        # 潜在B1之后上一级别最新的买点，不再每根k线读取上一级别的buy_list
+        last_bs = self.gz_last_bs
         # B1不成立
-        if self.gz_delay_k_num >= self.gz_delay_k_max or (len(self.gz_tmp_bs) > 4 and self.gz_tmp_bs[0][5] == 0) or not \
+        if self.gz_delay_k_num >= self.gz_delay_k_max or (len(self.gz_tmp_bs) > 4 and self.gz_tmp_bs[0].valid == 0) or not \
                 self.gz_tmp_bs[0]:
             self.gz_delay_k_num = 0
-            self.gz_prev_last_bs = None
+            self.gz_last_bs = None
             self.gz_tmp_bs[0] = []
             self.gz_tmp_bs = None
         else:
-            if last_bs and last_bs != self.gz_prev_last_bs and (
-                    last_bs[1] == 'B2' or last_bs[2] == 'B3' or last_bs[2] == 'B1'):
-                ChanLog.log(self.freq, self.symbol, 'gz:' + str(self.gz_delay_k_num) + ':')
+            if last_bs and (last_bs[1] == 'B2' or last_bs[2] == 'B3' or last_bs[2] == 'B1'):
+                ChanLog.log(self.freq, self.symbol, 'gz:%s:', self.gz_delay_k_num)
                 ChanLog.log(self.freq, self.symbol, last_bs)
-                ChanLog.log(self.freq, self.symbol, self.gz_prev_last_bs)
                 ChanLog.log(self.freq, self.symbol, self.gz_tmp_bs[0])
                 if self.gz_tmp_bs[0]:
-                    self.gz_tmp_bs[0][3] = self.k_list[-1].datetime
-                    self.gz_tmp_bs[0][5] = 1
+                    self.gz_tmp_bs[0].eval_time = self.k_list.get_datetime(-1)
+                    self.gz_tmp_bs[0].valid = 1
                     self.on_buy_sell(self.gz_tmp_bs[0])
                 self.gz_delay_k_num = 0
-                self.gz_prev_last_bs = None
+                self.gz_last_bs = None
                 self.gz_tmp_bs = None
 
+    def on_prev_buy(self, data: BsData):
+        """上一级别产生买点时通知本级别，共振等待中才记录"""
+        if self.gz_tmp_bs:
+            self.gz_last_bs = data
+
     def get_prev_last_bs(self):
         chan = self.prev
         if not chan or len(chan.buy_list) < 1:
@@ -1077,37 +1242,37 @@ class Chan_Class:
         # 走势列表[[日期1，日期2，走势类型，[背驰点], [中枢]]]
         if not self.trend_list:
             type = 'pzup'
-            if new_pivot[4] == 'down':
+            if new_pivot.direction == DOWN:
                 type = 'pzdown'
-            self.trend_list.append([new_pivot[0], new_pivot[1], type, [], [len(self.pivot_list) - 1]])
+            self.trend_list.append([new_pivot.start, new_pivot.end, type, [], [len(self.pivot_list) - 1]])
         else:
             last_trend = self.trend_list[-1]
             if last_trend[2] == 'up':
-                if new_pivot[4] == 'up':
-                    last_trend[1] = new_pivot[1]
+                if new_pivot.direction == UP:
+                    last_trend[1] = new_pivot.end
                     last_trend[4].append(len(self.pivot_list) - 1)
                 else:
-                    self.trend_list.append([new_pivot[0], new_pivot[1], 'pzdown', [], [len(self.pivot_list) - 1]])
+                    self.trend_list.append([new_pivot.start, new_pivot.end, 'pzdown', [], [len(self.pivot_list) - 1]])
             if last_trend[2] == 'down':
-                if new_pivot[4] == 'down':
-                    last_trend[1] = new_pivot[1]
+                if new_pivot.direction == DOWN:
+                    last_trend[1] = new_pivot.end
                     last_trend[4].append(len(self.pivot_list) - 1)
                 else:
-                    self.trend_list.append([new_pivot[0], new_pivot[1], 'pzup', [], [len(self.pivot_list) - 1]])
+                    self.trend_list.append([new_pivot.start, new_pivot.end, 'pzup', [], [len(self.pivot_list) - 1]])
             if last_trend[2] == 'pzup':
-                if new_pivot[4] == 'up':
-                    last_trend[1] = new_pivot[1]
+                if new_pivot.direction == UP:
+                    last_trend[1] = new_pivot.end
                     last_trend[4].append(len(self.pivot_list) - 1)
                     last_trend[2] = 'up'
                 else:
-                    self.trend_list.append([new_pivot[0], new_pivot[1], 'pzdown', [], [len(self.pivot_list) - 1]])
+                    self.trend_list.append([new_pivot.start, new_pivot.end, 'pzdown', [], [len(self.pivot_list) - 1]])
             if last_trend[2] == 'pzdown':
-                if new_pivot[4] == 'down':
-                    last_trend[1] = new_pivot[1]
+                if new_pivot.direction == DOWN:
+                    last_trend[1] = new_pivot.end
                     last_trend[4].append(len(self.pivot_list) - 1)
                     last_trend[2] = 'down'
                 else:
-                    self.trend_list.append([new_pivot[0], new_pivot[1], 'pzup', [], [len(self.pivot_list) - 1]])
+                    self.trend_list.append([new_pivot.start, new_pivot.end, 'pzup', [], [len(self.pivot_list) - 1]])
 
     def on_buy_sell(self, data, valid=True):
         if not data:
@@ -1115,17 +1280,81 @@ class Chan_Class:
         # 买点列表[[日期，值，类型, evaluation_time, 买点位置=index of stroke/line, valid, invalid_time, 类型, 强弱, qjt_pivot_list]]
         # 卖点列表[[日期，值，类型, evaluation_time, 买点位置=index of stroke/line, valid, invalid_time, 类型, 强弱, qjt_pivot_list]]
         if valid:
-            if data[2].startswith('B'):
+            if data.type.startswith('B'):
                 ChanLog.log(self.freq, self.symbol, 'buy:')
                 ChanLog.log(self.freq, self.symbol, data)
                 self.buy_list.append(data)
+                self.bs_index.add(data)
+                if self.next and self.next.gz:
+                    self.next.on_prev_buy(data)
                 if self.buy:
                     self.buy(self.k_list[-1].close_price, 100, self.freq)
             else:
                 ChanLog.log(self.freq, self.symbol, 'sell:')
                 ChanLog.log(self.freq, self.symbol, data)
                 self.sell_list.append(data)
+                self.bs_index.add(data)
                 if self.sell:
                     self.sell(self.k_list[-1].close_price, 100, self.freq)
         else:
             pass
+
+
+class QjtPivotBuilder(Chan_Class):
+    """
+    区间套用的中枢生成器，每个级别一个，重复使用。
+    只有on_pivot用到的字段，不分配k线、macd等状态；k线和macd直接读所属级别的。
+    结果按(start, end, type)缓存，笔/线段相同(同一批对象)并且所属级别还没有新的k线时直接返回。
+    """
+    cache_size = 256
+
+    def __init__(self, chan: Chan_Class):
+        self.chan = chan
+        self.freq = chan.freq
+        self.symbol = chan.symbol
+        self.prev = None
+        self.next = None
+        self.build_pivot = chan.build_pivot
+        self.qjt = False
+        self.gz = False
+        self.buy = None
+        self.sell = None
+        self.k_list = None
+        self.macd = None
+        self.pivot_list = []
+        self.trend_list = []
+        self.cache = {}
+
+    def clear(self) -> None:
+        self.cache = {}
+
+    def on_buy_sell(self, data, valid=True):
+        # 买卖点只留在返回的中枢里，不进买卖点列表、索引，也不通知其他级别
+        pass
+
+    def build(self, data: list, type) -> list:
+        """data逐根送入on_pivot，返回形成的中枢列表"""
+        chan = self.chan
+        k_list = chan.chan_k_list
+        # 买卖点的eval_time取所属级别最后一根k线的日期，也要作为缓存条件
+        last_time = k_list.get_datetime(-1) if k_list else None
+        key = (data[0].datetime, data[-1].datetime, type) if data else (None, None, type)
+        item = self.cache.get(key)
+        if item and item[1] == last_time and len(item[0]) == len(data) and all(
+                x is y for x, y in zip(item[0], data)):
+            return item[2]
+
+        self.k_list = k_list
+        self.macd = chan.macd
+        self.pivot_list = []
+        self.trend_list = []
+        new_data = []
+        for d in data:
+            new_data.append(d)
+            self.on_pivot(new_data, type)
+        pivot_list = self.pivot_list
+
+        if len(self.cache) >= self.cache_size:
+            self.cache = {}
+        self.cache[key] = (tuple(data), last_time, pivot_list)
+        return pivot_list
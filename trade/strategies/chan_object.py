@@ -0,0 +1,229 @@
+from bisect import bisect_left, bisect_right
+from collections import deque
+from datetime import datetime
+
+# 方向编码
+UP = 1
+DOWN = -1
+
+DIRECTION_STR = {UP: 'up', DOWN: 'down'}
+STR_DIRECTION = {'up': UP, 'down': DOWN}
+
+
+class ChanRecord:
+    """
+    缠论结构的基类：__slots__保存字段，比较按对象身份(is)进行。
+    下标访问record[i]兼容原来的list格式，方向字段返回'up'/'down'。
+    """
+    __slots__ = ()
+    _fields = ()
+    # 用字符串兼容的方向字段下标
+    _direction_index = -1
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self._fields)))]
+        if index < 0:
+            index += len(self._fields)
+        value = getattr(self, self._fields[index])
+        if index == self._direction_index:
+            return DIRECTION_STR.get(value, value)
+        return value
+
+    def __setitem__(self, index, value):
+        if index < 0:
+            index += len(self._fields)
+        if index == self._direction_index:
+            value = STR_DIRECTION.get(value, value)
+        setattr(self, self._fields[index], value)
+
+    def __iter__(self):
+        for i in range(len(self._fields)):
+            yield self[i]
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def to_list(self):
+        return list(self)
+
+
+class FxData(ChanRecord):
+    """
+    分型，笔和线段也由分型构成
+    [high_price, low, dt, direction, index of chan_k_list]
+    """
+    __slots__ = ('high', 'low', 'datetime', 'direction', 'index')
+    _fields = __slots__
+    _direction_index = 3
+
+    def __init__(self, high: float, low: float, dt: datetime, direction: int, index: int):
+        self.high = high
+        self.low = low
+        self.datetime = dt
+        self.direction = direction
+        self.index = index
+
+    def _key(self):
+        return self.high, self.low, self.datetime, self.direction, self.index
+
+    def __lt__(self, other):
+        # 和原来list的字典序比较一致，DOWN < UP 与 'down' < 'up' 相同
+        return self._key() < other._key()
+
+
+class PivotData(ChanRecord):
+    """
+    中枢
+    [日期1，日期2，中枢低点，中枢高点, 中枢类型，中枢进入段，中枢离开段, 形成时间, GG, DD, BS, BS, TS]
+    """
+    __slots__ = ('start', 'end', 'zd', 'zg', 'direction', 'enter', 'exit', 'datetime', 'gg', 'dd', 'buy', 'sell',
+                 'ts')
+    _fields = __slots__
+    _direction_index = 4
+
+    def __init__(self, start: datetime, end: datetime, zd: float, zg: float, direction: int, enter: int, exit: int,
+                 dt: datetime, gg: float, dd: float):
+        self.start = start
+        self.end = end
+        self.zd = zd
+        self.zg = zg
+        self.direction = direction
+        self.enter = enter
+        self.exit = exit
+        self.datetime = dt
+        self.gg = gg
+        self.dd = dd
+        # 一二三类买卖点的槽位，空为[]
+        self.buy = [[], [], []]
+        self.sell = [[], [], []]
+        # 背驰段 [[start, end]]
+        self.ts = []
+
+
+class BsData(ChanRecord):
+    """
+    买卖点
+    [日期，值，类型, evaluation_time, 买点位置=index of stroke/line, valid, invalid_time, 类型, 强弱, qjt_pivot_list]
+    """
+    __slots__ = ('datetime', 'price', 'type', 'eval_time', 'index', 'valid', 'invalid_time', 'bs_type',
+                 'strength', 'qjt_pivot_list')
+    _fields = __slots__
+
+    def __init__(self, dt: datetime, price: float, type: str, eval_time: datetime, index: int, valid: int = 1,
+                 invalid_time: datetime = None, bs_type: str = None, strength: str = None,
+                 qjt_pivot_list: list = None):
+        self.datetime = dt
+        self.price = price
+        self.type = type
+        self.eval_time = eval_time
+        self.index = index
+        self.valid = valid
+        self.invalid_time = invalid_time
+        self.bs_type = bs_type
+        self.strength = strength
+        self.qjt_pivot_list = qjt_pivot_list
+
+
+class ChanArchive:
+    """
+    compact之后丢掉的旧结构：各列表从头丢掉的数量，以及冻结成tuple的旧买卖点(最多保留maxlen个)
+    """
+    __slots__ = ('k_offset', 'chan_k_offset', 'fx_offset', 'stroke_offset', 'line_offset', 'pivot_offset',
+                 'trend_offset', 'buy_list', 'sell_list')
+
+    def __init__(self, maxlen: int = 1000):
+        self.k_offset = 0
+        self.chan_k_offset = 0
+        self.fx_offset = 0
+        self.stroke_offset = 0
+        self.line_offset = 0
+        self.pivot_offset = 0
+        self.trend_offset = 0
+        self.buy_list = deque(maxlen=maxlen)
+        self.sell_list = deque(maxlen=maxlen)
+
+
+class BsIndex:
+    """
+    买卖点索引：按类型(B1/B2/B3/S1/S2/S3)分开，按买卖点日期排序。
+    有效性(valid)会在原对象上修改，查询时再判断。
+    """
+    __slots__ = ('datetime_map', 'data_map')
+
+    def __init__(self):
+        self.datetime_map = {}
+        self.data_map = {}
+
+    def add(self, bs: BsData) -> None:
+        dt_list = self.datetime_map.get(bs.type)
+        if dt_list is None:
+            dt_list = self.datetime_map[bs.type] = []
+            self.data_map[bs.type] = []
+        data_list = self.data_map[bs.type]
+        # 基本都是追加在最后
+        if not dt_list or dt_list[-1] <= bs.datetime:
+            dt_list.append(bs.datetime)
+            data_list.append(bs)
+        else:
+            i = bisect_right(dt_list, bs.datetime)
+            dt_list.insert(i, bs.datetime)
+            data_list.insert(i, bs)
+
+    def rebuild(self, bs_list: list) -> None:
+        self.datetime_map = {}
+        self.data_map = {}
+        for bs in sorted(bs_list, key=lambda x: x.datetime):
+            self.add(bs)
+
+    def query(self, type: str, start: datetime, end: datetime, valid: bool = True) -> list:
+        """日期在[start, end)之间的type类买卖点，valid为True时只返回有效的"""
+        dt_list = self.datetime_map.get(type)
+        if not dt_list:
+            return []
+        data_list = self.data_map[type]
+        ans = data_list[bisect_left(dt_list, start):bisect_left(dt_list, end)]
+        if valid:
+            ans = [bs for bs in ans if bs.valid == 1]
+        return ans
+
+    def exists(self, type: str, start: datetime, end: datetime, valid: bool = True) -> bool:
+        """[start, end)之间有没有type类(有效的)买卖点"""
+        dt_list = self.datetime_map.get(type)
+        if not dt_list:
+            return False
+        data_list = self.data_map[type]
+        for i in range(bisect_left(dt_list, start), bisect_left(dt_list, end)):
+            if not valid or data_list[i].valid == 1:
+                return True
+        return False
+
+
+def bisect_left_time(data: list, t: datetime, attr: str = 'datetime') -> int:
+    """
+    data按attr时间升序(笔、线段、中枢列表都是)，返回第一个时间>=t的位置。
+    直接在记录上二分，不另外维护时间数组，尾部替换、compact之后不需要同步。
+    """
+    lo, hi = 0, len(data)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if getattr(data[mid], attr) < t:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def bisect_right_time(data: list, t: datetime, attr: str = 'datetime') -> int:
+    """返回第一个时间>t的位置"""
+    lo, hi = 0, len(data)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if t < getattr(data[mid], attr):
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
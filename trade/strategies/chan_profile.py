@@ -0,0 +1,126 @@
+"""
+缠论计算的性能统计：各阶段方法的调用次数和耗时，以及笔、线段、中枢变化等事件的次数。
+默认关闭，Chan_Strategy.enable_profiling或者setting里profile=True时才生效。
+"""
+import json
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+# 各阶段对应的Chan_Class方法
+STAGES = OrderedDict([
+    ('include', ['on_process_k_include', 'on_process_k_no_include']),
+    ('fx', ['on_process_fx']),
+    ('stroke', ['on_stroke']),
+    ('line', ['on_line']),
+    ('pivot', ['on_pivot', 'on_trend']),
+    ('bs', ['on_turn', 'x_bs_pos', 'cal_macd', 'on_buy_sell']),
+    ('qjt', ['qjt_turn', 'qjt_turn0', 'qjt_turn1', 'qjt_trend', 'qjt_trend0', 'qjt_pivot']),
+    ('gz', ['on_gz', 'on_prev_buy']),
+])
+
+METHODS = [name for names in STAGES.values() for name in names]
+
+
+class ChanProfiler:
+    """
+    For:
+    1. counting calls and wall time of the Chan_Class hot path methods of one symbol and level
+    2. counting structure events such as stroke_change, line_change and pivot_pop
+
+    Notice:
+    1. the methods are wrapped on the instance by attach and restored by detach, a Chan_Class without
+       a profiler runs the plain methods and only checks self.profiler at the event points
+    2. seconds includes nested calls, self_seconds does not; profilers of the levels of one strategy
+       share the stack so calls into another level are not counted twice
+    3. not saved in checkpoints
+    """
+
+    def __init__(self, symbol: str = '', freq: str = '', stack: List[float] = None):
+        self.symbol = symbol
+        self.freq = freq
+        self.calls: Dict[str, int] = {name: 0 for name in METHODS}
+        self.seconds: Dict[str, float] = {name: 0.0 for name in METHODS}
+        self.self_seconds: Dict[str, float] = {name: 0.0 for name in METHODS}
+        self.events: Dict[str, int] = {}
+        # 正在执行的方法里，已经计入被调用方法的时间
+        self.stack: List[float] = [] if stack is None else stack
+
+    def attach(self, chan) -> None:
+        for name in METHODS:
+            method = getattr(chan, name, None)
+            if method is not None:
+                setattr(chan, name, self.wrap(name, method))
+
+    @staticmethod
+    def detach(chan) -> None:
+        for name in METHODS:
+            chan.__dict__.pop(name, None)
+
+    def wrap(self, name: str, method):
+        calls = self.calls
+        seconds = self.seconds
+        self_seconds = self.self_seconds
+        stack = self.stack
+
+        def wrapper(*args, **kwargs):
+            stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                child = stack.pop()
+                calls[name] += 1
+                seconds[name] += elapsed
+                self_seconds[name] += elapsed - child
+                if stack:
+                    stack[-1] += elapsed
+        return wrapper
+
+    def count(self, event: str, n: int = 1) -> None:
+        self.events[event] = self.events.get(event, 0) + n
+
+    def reset(self) -> None:
+        for name in METHODS:
+            self.calls[name] = 0
+            self.seconds[name] = 0.0
+            self.self_seconds[name] = 0.0
+        self.events.clear()
+
+    def get_stage_data(self) -> Dict[str, dict]:
+        """按STAGES汇总的调用次数和不含子调用的耗时"""
+        ans = OrderedDict()
+        for stage, names in STAGES.items():
+            ans[stage] = {'calls': sum(self.calls[name] for name in names),
+                          'seconds': sum(self.self_seconds[name] for name in names)}
+        return ans
+
+    def to_dict(self) -> dict:
+        return {
+            'symbol': self.symbol,
+            'freq': self.freq,
+            'methods': {name: {'calls': self.calls[name], 'seconds': self.seconds[name],
+                               'self_seconds': self.self_seconds[name]}
+                        for name in METHODS if self.calls[name]},
+            'stages': self.get_stage_data(),
+            'events': dict(self.events),
+        }
+
+
+def dump_profile(path, profile: dict) -> None:
+    """profile为{股票: {级别: ChanProfiler.to_dict()}}"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(profile, f, ensure_ascii=False, indent=2)
+
+
+def merge_stage_data(profilers: List[Optional[ChanProfiler]]) -> Dict[str, dict]:
+    """多个级别的阶段数据相加"""
+    ans = OrderedDict((stage, {'calls': 0, 'seconds': 0.0}) for stage in STAGES)
+    for profiler in profilers:
+        if not profiler:
+            continue
+        for stage, data in profiler.get_stage_data().items():
+            ans[stage]['calls'] += data['calls']
+            ans[stage]['seconds'] += data['seconds']
+    return ans
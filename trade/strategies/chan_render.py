@@ -0,0 +1,80 @@
+"""
+缠图页面的数据：k线、笔、线段、中枢、macd和买卖点转换成chart.html需要的格式。
+不依赖Qt，缠图界面和性能测试共用。
+"""
+import json
+from typing import Optional
+
+import pandas as pd
+
+from trade.constant import FREQS
+
+
+def get_format_str(freq: str) -> str:
+    """日线只显示日期"""
+    if freq == FREQS[0]:
+        return '%Y-%m-%d'
+    return '%Y-%m-%d %H:%M'
+
+
+def format_pivot(pivot, format_str):
+    reformatpivot = []
+    for Item in pivot:
+        reformatpivot.append(
+            [Item[0].strftime(format_str), Item[1].strftime(format_str), Item[2], Item[3]])
+    return reformatpivot
+
+
+def format_line(line, format_str):
+    reformatline = []
+    for Item in line:
+        if Item[3] == 'up':
+            reformatline.append([Item[2].strftime(format_str), Item[0]])
+        else:
+            reformatline.append([Item[2].strftime(format_str), Item[1]])
+    return reformatline
+
+
+def format_bs(BS, format_str):
+    rebs = []
+    for bs in BS:
+        valid = '有效'
+        if bs[5] == 0:
+            valid = '无效'
+            rebs.append([bs[0].strftime(format_str), bs[1], bs[2], bs[3].strftime(format_str),
+                         valid + ':' + bs[6].strftime(format_str), bs[7], bs[8]])
+        else:
+            rebs.append([bs[0].strftime(format_str), bs[1], bs[2], bs[3].strftime(format_str), '', bs[7], bs[8]])
+    return rebs
+
+
+def build_render_payload(chan, freq: str) -> Optional[dict]:
+    """一个级别的页面数据，没有k线时返回None"""
+    format_str = get_format_str(freq)
+    # 直接取列式存储的列，不逐根生成BarData
+    chan_k_list = chan.chan_k_list
+    klist = pd.DataFrame({
+        "date": pd.to_datetime(chan_k_list.datetime).strftime(format_str),
+        "open": chan_k_list.open,
+        "close": chan_k_list.close,
+        "low": chan_k_list.low,
+        "high": chan_k_list.high,
+        "volume": chan_k_list.volume
+    }, columns=["date", "open", "close", "low", "high", "volume"])
+    if len(klist) <= 0:
+        return None
+    # 和背驰判断共用同一份macd
+    macd_manager = chan.macd_manager
+    Macd = {}
+    Macd['dif'] = macd_manager.dif
+    Macd['dea'] = macd_manager.dea
+    Macd['macd'] = [v * 2 for v in macd_manager.hist]
+    return {
+        'kline': klist.to_json(orient='split'),
+        'bi': format_line(chan.stroke_list, format_str),
+        'xd': format_line(chan.line_list, format_str),
+        'zs': format_pivot(chan.pivot_list, format_str),
+        'macd': json.dumps(Macd),
+        'bl': format_bs(chan.buy_list, format_str),
+        'sl': format_bs(chan.sell_list, format_str),
+    }
@@ -0,0 +1,75 @@
+"""
+可复现的A股1分钟k线，供一致性检查、扫描的random数据源和性能测试共用。
+"""
+import random
+from datetime import datetime, timedelta
+from typing import List
+
+from trade.object import BarData
+from trade.constant import Exchange, Interval
+
+# 行情状态：(每分钟漂移, 每分钟波动, 向均值回归的力度)
+REGIMES = {
+    'up': (0.0004, 0.0015, 0.0),
+    'down': (-0.0004, 0.0015, 0.0),
+    'range': (0.0, 0.0015, 0.02),
+    'volatile': (0.0, 0.004, 0.0),
+}
+
+
+def generate_sessions(days: int, seed: int, symbol: str = '600000', exchange: Exchange = Exchange.SSE,
+                      limit: float = 0.1, price: float = 20.0) -> List[BarData]:
+    """
+    可复现的A股1分钟k线，每天240根。
+    行情在上涨、下跌、震荡、剧烈波动之间随机切换，开盘有跳空，价格不超出前收盘的涨跌停，偶尔出现封板的涨停或跌停日。
+    """
+    rnd = random.Random(seed)
+    bars = []
+    day = datetime(2020, 1, 2)
+    regime = 'range'
+    pre_close = price
+    for d in range(days):
+        while day.weekday() >= 5:
+            day += timedelta(days=1)
+        if rnd.random() < 0.15:
+            regime = rnd.choice(list(REGIMES))
+        drift, vol, revert = REGIMES[regime]
+        up_limit = round(pre_close * (1 + limit), 2)
+        down_limit = round(pre_close * (1 - limit), 2)
+        # 涨停日、跌停日：当天向涨跌停价走，到价后封住
+        limit_move = 0
+        r = rnd.random()
+        if r < 0.02:
+            limit_move = 1
+        elif r < 0.04:
+            limit_move = -1
+        # 开盘跳空，少数日子跳空较大
+        gap = rnd.gauss(0, 0.03) if rnd.random() < 0.05 else rnd.gauss(0, 0.004)
+        price = min(max(pre_close * (1 + gap), down_limit), up_limit)
+        anchor = price
+        for i in range(240):
+            if i < 120:
+                dt = day.replace(hour=9, minute=30) + timedelta(minutes=i + 1)
+            else:
+                dt = day.replace(hour=13, minute=0) + timedelta(minutes=i - 119)
+            open_price = round(price, 2)
+            if limit_move:
+                step = 0.004 * limit_move + rnd.gauss(0, 0.001)
+            else:
+                step = drift + rnd.gauss(0, vol) - revert * (price - anchor) / anchor
+            price = min(max(price * (1 + step), down_limit, 1.0), up_limit)
+            close_price = round(price, 2)
+            if close_price in (up_limit, down_limit) and open_price == close_price:
+                # 封板时高低收都是板价
+                high_price = low_price = close_price
+            else:
+                high_price = min(round(max(open_price, close_price) + abs(rnd.gauss(0, vol * price)), 2), up_limit)
+                low_price = max(round(min(open_price, close_price) - abs(rnd.gauss(0, vol * price)), 2), down_limit)
+            # 成交量开盘和收盘放大
+            volume = int(rnd.lognormvariate(8, 0.5) * (1 + 2 * ((i - 120) / 120) ** 2))
+            bars.append(BarData(symbol=symbol, exchange=exchange, interval=Interval.MINUTE, datetime=dt,
+                                open_price=open_price, high_price=high_price, low_price=low_price,
+                                close_price=close_price, volume=volume))
+        pre_close = round(price, 2)
+        day += timedelta(days=1)
+    return bars
@@ -0,0 +1,261 @@
+"""
+多股票扫描：进程池里对一批股票计算缠论结构，每算完一个股票就返回它各级别最近的中枢、走势和买卖点。
+
+    python -m trade.strategies.chan_scan 600000 000001 --source random --days 60
+    python -m trade.strategies.chan_scan --file symbols.txt --source csv --data-dir trade/data --workers 8
+    python -m trade.strategies.chan_scan --all --source jq --jquser xxx --jqpass xxx --start 2021-01-01
+
+每个进程启动时初始化一次(数据源、聚宽登录)，之后复用；同时提交的股票数量有上限，结果按完成顺序逐个输出。
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, date, timedelta
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from trade.object import BarData, HistoryRequest
+from trade.constant import Exchange, Interval
+from trade.chanlog import ChanLog
+from trade.csvdata import CsvLoader
+from trade.utility import parse_vt_symbol
+from .chan_object import DIRECTION_STR
+from .chan_strategy import Chan_Strategy
+from .chan_batch_engine import Chan_Batch
+from .chan_sample import generate_sessions
+
+SOURCES = ['random', 'csv', 'jq']
+
+# 进程内的数据源和设置，由_init_worker设置
+_worker = {}
+
+
+def load_bars(vt_symbol: str, source: str, start: date = None, end: date = None, days: int = 60,
+              data_dir: str = 'trade/data') -> Sequence[BarData]:
+    """
+    读取一个股票的1分钟k线
+    random: 以股票代码为种子的随机k线，days天
+    csv: data_dir/股票代码/下的月度csv文件，经过CsvLoader的二进制缓存，返回BarStore
+    jq: 聚宽，需要已经登录
+    """
+    symbol, exchange = parse_vt_symbol(vt_symbol)
+    if source == 'random':
+        return generate_sessions(days, zlib.crc32(symbol.encode()), symbol, exchange)
+    if source == 'csv':
+        # 已经在扫描的进程池里，不再为月份开进程
+        return CsvLoader(data_dir, workers=0).load_store(symbol, exchange, start, end)
+    if source == 'jq':
+        from trade.jqdata import jqdata_client
+        req = HistoryRequest(symbol=symbol, exchange=exchange, interval=Interval.MINUTE,
+                             start=start or date.today() - timedelta(days=days), end=end or date.today())
+        ans = jqdata_client.query_history(req)
+        return ans[1] if ans else []
+    raise ValueError('不支持的数据源：%s' % source)
+
+
+def summarize(chan_freq_map: dict, keep: int = 3) -> dict:
+    """各级别最近keep个中枢、走势、买卖点，只保留基本字段，便于跨进程传递和输出json"""
+    ans = {}
+    for freq, chan in chan_freq_map.items():
+        ans[freq] = {
+            'k_num': len(chan.k_list),
+            'pivot_list': [[p.start, p.end, p.zd, p.zg, DIRECTION_STR.get(p.direction, p.direction), p.gg, p.dd]
+                           for p in chan.pivot_list[-keep:]],
+            'trend_list': [trend[:3] for trend in chan.trend_list[-keep:]],
+            'buy_list': [[bs.datetime, bs.price, bs.type, bs.eval_time, bs.valid, bs.bs_type, bs.strength]
+                         for bs in chan.buy_list[-keep:]],
+            'sell_list': [[bs.datetime, bs.price, bs.type, bs.eval_time, bs.valid, bs.bs_type, bs.strength]
+                          for bs in chan.sell_list[-keep:]],
+        }
+    return ans
+
+
+def _init_worker(options: dict) -> None:
+    """每个进程启动时执行一次"""
+    _worker.clear()
+    _worker.update(options)
+    if not options.get('log'):
+        ChanLog.disable()
+    if options['source'] == 'jq':
+        from trade.jqdata import jqdata_client
+        jqdata_client.init(options.get('jquser'), options.get('jqpass'))
+
+
+def scan_symbol(vt_symbol: str) -> dict:
+    """在当前进程里计算一个股票，出错时error字段为异常信息"""
+    options = _worker
+    ans = {'vt_symbol': vt_symbol, 'bars': 0, 'elapsed': 0.0, 'error': None, 'levels': {}}
+    start_time = time.time()
+    try:
+        bars = load_bars(vt_symbol, options['source'], options.get('start'), options.get('end'),
+                         options.get('days', 60), options.get('data_dir', 'trade/data'))
+        ans['bars'] = len(bars)
+        if bars:
+            setting = dict(options.get('setting') or {})
+            if options.get('batch', True):
+                # 结果和逐根回放一致，见chan_batch_check
+                chan_freq_map = Chan_Batch(vt_symbol, setting).run(bars)
+            else:
+                strategy = Chan_Strategy(engine=None, strategy_name='scan', vt_symbol=vt_symbol, setting=setting)
+                for bar in bars:
+                    strategy.on_bar(bar)
+                chan_freq_map = strategy.chan_freq_map
+            ans['levels'] = summarize(chan_freq_map, options.get('keep', 3))
+    except Exception as ex:
+        ans['error'] = repr(ex)
+    ans['elapsed'] = time.time() - start_time
+    return ans
+
+
+class ChanScanner:
+    """
+    For:
+    1. running Chan_Batch (or Chan_Strategy) over many symbols in a process pool
+    2. yielding a summary per symbol as soon as it finishes
+
+    Notice:
+    1. each worker process loads its data source once in the initializer
+    2. at most max_pending symbols are submitted at a time, so memory is bounded for long symbol lists
+    3. workers=0 runs everything in the calling process
+    """
+
+    def __init__(self, setting: dict = None, source: str = 'random', workers: int = None, max_pending: int = None,
+                 start: date = None, end: date = None, days: int = 60, data_dir: str = 'trade/data',
+                 keep: int = 3, batch: bool = True, log: bool = False, jquser: str = '', jqpass: str = ''):
+        if source not in SOURCES:
+            raise ValueError('不支持的数据源：%s' % source)
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.max_pending = max_pending or max(self.workers, 1) * 2
+        self.options = {
+            'setting': dict(setting or {}),
+            'source': source,
+            'start': start,
+            'end': end,
+            'days': days,
+            'data_dir': data_dir,
+            'keep': keep,
+            'batch': batch,
+            'log': log,
+            'jquser': jquser,
+            'jqpass': jqpass,
+        }
+
+    def scan(self, vt_symbols: Iterable[str]) -> Iterator[dict]:
+        """按完成顺序返回每个股票的结果"""
+        if self.workers <= 0:
+            # 在调用方的进程里运行，结束后恢复日志级别和_worker，不影响宿主程序
+            level = ChanLog.level
+            worker = dict(_worker)
+            try:
+                _init_worker(self.options)
+                for vt_symbol in vt_symbols:
+                    yield scan_symbol(vt_symbol)
+            finally:
+                ChanLog.set_level(level)
+                _worker.clear()
+                _worker.update(worker)
+            return
+
+        symbols = iter(vt_symbols)
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                 initargs=(self.options,)) as executor:
+            pending = set()
+            for vt_symbol in symbols:
+                pending.add(executor.submit(scan_symbol, vt_symbol))
+                if len(pending) >= self.max_pending:
+                    break
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for vt_symbol in symbols:
+                        pending.add(executor.submit(scan_symbol, vt_symbol))
+                        break
+                    yield future.result()
+
+
+def load_symbols(file: str) -> List[str]:
+    """每行一个股票代码，#开头为注释"""
+    symbols = []
+    with open(file) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                symbols.append(line)
+    return symbols
+
+
+def query_all_symbols(jquser: str, jqpass: str) -> List[str]:
+    """聚宽上所有A股，600000.SSE格式"""
+    from trade.jqdata import jqdata_client
+    if not jqdata_client.init(jquser, jqpass):
+        return []
+    df = jqdata_client.provider.get_all_securities(['stock'])
+    symbols = []
+    for code in df.index:
+        symbol, market = code.split('.')
+        symbols.append('%s.%s' % (symbol, Exchange.SSE.value if market == 'XSHG' else Exchange.SZSE.value))
+    return symbols
+
+
+def _parse_date(value: str) -> Optional[date]:
+    return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='多股票缠论扫描')
+    parser.add_argument('symbols', nargs='*', help='股票代码，如600000或600000.SSE')
+    parser.add_argument('--file', help='股票代码文件，每行一个')
+    parser.add_argument('--all', action='store_true', help='聚宽上所有A股')
+    parser.add_argument('--source', choices=SOURCES, default='random', help='k线数据源')
+    parser.add_argument('--data-dir', default='trade/data', help='csv数据源的目录')
+    parser.add_argument('--start', help='开始日期，如2021-01-01')
+    parser.add_argument('--end', help='结束日期')
+    parser.add_argument('--days', type=int, default=60, help='random数据源的天数，jq数据源没有开始日期时往前取的天数')
+    parser.add_argument('--workers', type=int, default=None, help='进程数，默认cpu个数，0表示不用进程池')
+    parser.add_argument('--max-pending', type=int, default=None, help='同时提交的股票数量上限，默认进程数*2')
+    parser.add_argument('--keep', type=int, default=3, help='每个级别输出最近多少个中枢、走势、买卖点')
+    parser.add_argument('--replay', action='store_true', help='用Chan_Strategy逐根回放，默认批量计算')
+    parser.add_argument('--no-include', action='store_true', help='不做k线包含处理')
+    parser.add_argument('--build-pivot', action='store_true', help='用线段构成中枢')
+    parser.add_argument('--qjt', action='store_true', help='使用区间套')
+    parser.add_argument('--gz', action='store_true', help='使用共振')
+    parser.add_argument('--log', action='store_true', help='写缠论日志')
+    parser.add_argument('--jquser', default='')
+    parser.add_argument('--jqpass', default='')
+    args = parser.parse_args(argv)
+
+    symbols = list(args.symbols)
+    if args.file:
+        symbols.extend(load_symbols(args.file))
+    if args.all:
+        symbols.extend(query_all_symbols(args.jquser, args.jqpass))
+    if not symbols:
+        parser.error('没有股票代码')
+
+    setting = {'include': not args.no_include, 'build_pivot': args.build_pivot, 'qjt': args.qjt, 'gz': args.gz}
+    scanner = ChanScanner(setting, source=args.source, workers=args.workers, max_pending=args.max_pending,
+                          start=_parse_date(args.start), end=_parse_date(args.end), days=args.days,
+                          data_dir=args.data_dir, keep=args.keep, batch=not args.replay, log=args.log,
+                          jquser=args.jquser, jqpass=args.jqpass)
+    start_time = time.time()
+    count = 0
+    failed = 0
+    for result in scanner.scan(symbols):
+        count += 1
+        failed += bool(result['error'])
+        print(json.dumps(result, ensure_ascii=False, default=_json_default), flush=True)
+    print('%d个股票，%d个失败，耗时%.2fs' % (count, failed, time.time() - start_time), file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -9,6 +9,8 @@ from trade.object import (
 )
 from trade.constant import FREQS, INTERVAL_FREQ, Interval, FREQS_WINDOW, METHOD, Direction, Offset
 from .chan_class import Chan_Class
+from .chan_checkpoint import save_checkpoint, load_checkpoint
+from .chan_profile import ChanProfiler, dump_profile
 
 
 class Chan_Strategy(Template):
@@ -20,9 +22,17 @@ class Chan_Strategy(Template):
     build_pivot = False
     qjt = False
     gz = False
-    jb = Interval.MINUTE
+    # 买卖的级别，FREQS之一
+    jb = INTERVAL_FREQ[Interval.MINUTE.value]
+    # 每个级别保留最近多少个中枢，0表示不清理
+    retention = 0
+    # 每多少根1分钟k线检查一次是否清理
+    retention_interval = 2400
+    # 统计各级别各阶段的耗时和笔、线段、中枢变化次数
+    profile = False
 
-    parameters = ['method', 'symbol', 'include', 'build_pivot', 'qjt', 'gz', 'jb']
+    parameters = ['method', 'symbol', 'include', 'build_pivot', 'qjt', 'gz', 'jb', 'retention', 'retention_interval',
+                  'profile']
     buy1 = 100
     buy2 = 200
     buy3 = 200
@@ -60,11 +70,21 @@ class Chan_Strategy(Template):
             # 买卖的级别
             if 'jb' in setting.keys():
                 self.jb = setting['jb']
+            # 长时间运行时的内存上限
+            if 'retention' in setting.keys():
+                self.retention = setting['retention']
+            if 'retention_interval' in setting.keys():
+                self.retention_interval = setting['retention_interval']
+            if 'profile' in setting.keys():
+                self.profile = setting['profile']
             # 线段生成方法
             # if 'include_feature' in setting.keys():
             #     self.include_feature = setting['include_feature']
 
         super().__init__(engine, strategy_name, vt_symbol, setting)
+        # 旧设置里保存的是Interval，和on_bar传入的级别名称比较时永远不相等
+        if isinstance(self.jb, Interval):
+            self.jb = INTERVAL_FREQ[self.jb.value]
         self.engine = engine
         self.strategy_name = strategy_name
         self.vt_symbol = vt_symbol
@@ -73,6 +93,9 @@ class Chan_Strategy(Template):
         # map
         self.chan_freq_map = {}
         self.bg_freq_map = {}
+        # 最后处理的1分钟k线时间，恢复快照后只回放之后的k线
+        self.last_datetime = None
+        self.retention_count = 0
 
         # 初始化缠论类和bg
         self.bg = BarGenerator(on_bar=self.on_bar, interval=Interval.MINUTE)
@@ -96,6 +119,23 @@ class Chan_Strategy(Template):
                 self.bg_freq_map[freq] = BarGenerator(on_bar=self.on_pass, on_window_bar=self.on_bar, window=wlist[0],
                                                       interval=wlist[1], target=wlist[2])
             i += 1
+        if self.profile:
+            self.enable_profiling()
+
+    def enable_profiling(self, enabled: bool = True) -> None:
+        """开启或关闭各级别的性能统计，重新开启时清零"""
+        self.profile = enabled
+        # 各级别共用调用栈，调用其他级别的方法不重复计时
+        stack = []
+        for freq, chan in self.chan_freq_map.items():
+            chan.set_profiler(ChanProfiler(self.vt_symbol, freq, stack) if enabled else None)
+
+    def get_profile(self) -> dict:
+        """{级别: 统计数据}，没有开启时为空"""
+        return {freq: chan.profiler.to_dict() for freq, chan in self.chan_freq_map.items() if chan.profiler}
+
+    def dump_profile(self, path) -> None:
+        dump_profile(path, {self.vt_symbol: self.get_profile()})
 
     def on_start(self):
         self.write_log("chan策略启动")
@@ -113,10 +153,87 @@ class Chan_Strategy(Template):
         # print(bar)
         freq = INTERVAL_FREQ[bar.interval.value]
         if bar.interval.value == Interval.MINUTE.value:
+            self.last_datetime = bar.datetime
             for freq in self.bg_freq_map:
                 self.bg_freq_map[freq].update_bar(bar)
             # self.put_render_event()
         self.chan_freq_map[freq].on_bar(bar)
+        if self.retention and bar.interval.value == Interval.MINUTE.value:
+            self.retention_count += 1
+            if self.retention_count >= self.retention_interval:
+                self.retention_count = 0
+                self.compact()
+
+    def compact(self):
+        """
+        按retention清理各级别的旧结构。
+        开启区间套时从高级别往低级别，高级别的区间套会读取低级别从它最近的笔/线段起点开始的结构，
+        所以低级别的清理时间不晚于所有更高级别的get_qjt_time；高级别本身不需要清理。
+        """
+        bound = None
+        for freq in FREQS:
+            chan = self.chan_freq_map[freq]
+            t = chan.get_retention_time(self.retention)
+            if self.qjt and chan.prev:
+                if bound is None:
+                    # 高级别的结构还不够，不知道区间套会读到哪里，低级别都不清理
+                    return
+                t = min(t, chan.get_qjt_keep_time(bound)) if t is not None else None
+            if t is not None:
+                chan.compact(t)
+            if self.qjt:
+                qjt_t = chan.get_qjt_time()
+                if qjt_t is None:
+                    return
+                bound = qjt_t if bound is None else min(bound, qjt_t)
+
+    def get_checkpoint_setting(self) -> dict:
+        """影响计算结果的参数，快照恢复时必须一致；retention决定快照里的结构是否被清理过"""
+        return {'include': self.include, 'build_pivot': self.build_pivot, 'qjt': self.qjt, 'gz': self.gz,
+                'retention': self.retention}
+
+    def save_checkpoint(self, path) -> None:
+        """保存所有级别的缠论状态和k线合成器的状态"""
+        bg_state = {}
+        for freq, bg in self.bg_freq_map.items():
+            bg_state[freq] = (bg.window_bar, bg.interval_count, bg.last_bar)
+        state = {
+            'vt_symbol': self.vt_symbol,
+            'setting': self.get_checkpoint_setting(),
+            'last_datetime': self.last_datetime,
+            'chan_freq_map': self.chan_freq_map,
+            'bg_state': bg_state
+        }
+        save_checkpoint(path, state)
+
+    def load_checkpoint(self, path) -> bool:
+        """恢复快照，股票或参数不一致、文件损坏或者是旧格式时返回False，保持原状态，由调用方全量回放"""
+        state = load_checkpoint(path)
+        try:
+            if not state or state['vt_symbol'] != self.vt_symbol or state['setting'] != self.get_checkpoint_setting():
+                return False
+            chan_freq_map = state['chan_freq_map']
+            if set(chan_freq_map) != set(self.chan_freq_map):
+                return False
+            bg_state = {}
+            for freq, (window_bar, interval_count, last_bar) in state['bg_state'].items():
+                bg_state[self.bg_freq_map[freq]] = (window_bar, interval_count, last_bar)
+            last_datetime = state['last_datetime']
+        except (TypeError, KeyError, AttributeError, ValueError):
+            return False
+        # 全部检查通过之后再修改状态
+        self.chan_freq_map = chan_freq_map
+        for chan in self.chan_freq_map.values():
+            chan.buy = self.buy
+            chan.sell = self.sell
+        for bg, (window_bar, interval_count, last_bar) in bg_state.items():
+            bg.window_bar = window_bar
+            bg.interval_count = interval_count
+            bg.last_bar = last_bar
+        self.last_datetime = last_datetime
+        if self.profile:
+            self.enable_profiling()
+        return True
 
     def buy(self, price: float, volume: float, freq: str = '', stop: bool = False, lock: bool = False):
         return self.send_order(Direction.LONG, Offset.OPEN, price, volume, freq, stop, lock)
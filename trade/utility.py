@@ -15,12 +15,30 @@ from trade.constant import Exchange, Interval, ZH_TRANS_MAP
 
 log_formatter = logging.Formatter('[%(asctime)s] %(message)s')
 
+EPOCH = datetime.datetime(1970, 1, 1)
+ONE_MICROSECOND = datetime.timedelta(microseconds=1)
+EPOCH_ORDINAL = EPOCH.toordinal()
+
 
 def extract_vt_symbol(vt_symbol: str) -> Tuple[str, Exchange]:
     symbol, exchange_str = vt_symbol.split(".")
     return symbol, Exchange(exchange_str)
 
 
+def parse_vt_symbol(vt_symbol: str) -> Tuple[str, Exchange]:
+    """
+    600000 / 600000.SSE -> (600000, Exchange.SSE)
+    without an exchange: 6xxxxx is SSE, others are SZSE
+    """
+    parts = vt_symbol.strip().split(".")
+    symbol = parts[0]
+    if len(parts) > 1 and parts[1]:
+        return symbol, Exchange(parts[1].upper())
+    if symbol.startswith("6"):
+        return symbol, Exchange.SSE
+    return symbol, Exchange.SZSE
+
+
 def generate_vt_symbol(symbol: str, exchange: Exchange) -> str:
     """
     return vt_symbol
@@ -791,6 +809,509 @@ class ArrayManager(object):
         return result[-1]
 
 
+def _wall_time_us(dt: datetime.datetime) -> int:
+    # microseconds since epoch of the wall time, ignoring tzinfo, avoids building timedelta objects
+    return (dt.toordinal() - EPOCH_ORDINAL) * 86400000000 + \
+        (dt.hour * 3600 + dt.minute * 60 + dt.second) * 1000000 + dt.microsecond
+
+
+class BarStore(object):
+    """
+    For:
+    1. growable struct-of-arrays container of bar data (amortized doubling)
+    2. list-like access for callers written against List[BarData]
+
+    Notice:
+    1. symbol, exchange, interval and tzinfo are kept once per store, taken from the first bar
+    2. datetime is kept as datetime64 wall time and re-localized on the way out
+    3. *_array attributes are the raw buffers (capacity sized), read them with .item(i) for i < len
+    """
+
+    def __init__(self, size: int = 1024):
+        """Constructor"""
+        self.count: int = 0
+        self.size: int = max(size, 1)
+
+        self.symbol: str = ""
+        self.exchange: Exchange = None
+        self.interval: Interval = None
+        self.tzinfo = None
+
+        self.datetime_array: np.ndarray = np.zeros(self.size, dtype="datetime64[us]")
+        self.open_array: np.ndarray = np.zeros(self.size)
+        self.high_array: np.ndarray = np.zeros(self.size)
+        self.low_array: np.ndarray = np.zeros(self.size)
+        self.close_array: np.ndarray = np.zeros(self.size)
+        self.volume_array: np.ndarray = np.zeros(self.size)
+        self.open_interest_array: np.ndarray = np.zeros(self.size)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __bool__(self) -> bool:
+        return self.count > 0
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.get_bar(i) for i in range(*index.indices(self.count))]
+        return self.get_bar(index)
+
+    def __setitem__(self, index: int, bar: BarData) -> None:
+        self.set_bar(index, bar)
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self.get_bar(i)
+
+    def __getstate__(self) -> dict:
+        # only the filled part of the buffers is saved
+        state = self.__dict__.copy()
+        for name in ("datetime_array", "open_array", "high_array", "low_array",
+                     "close_array", "volume_array", "open_interest_array"):
+            state[name] = state[name][:self.count].copy()
+        state["size"] = max(self.count, 1)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        if not self.count:
+            for name in ("datetime_array", "open_array", "high_array", "low_array",
+                         "close_array", "volume_array", "open_interest_array"):
+                setattr(self, name, np.zeros(1, dtype=getattr(self, name).dtype))
+
+    def _index(self, index: int) -> int:
+        if index < 0:
+            index += self.count
+        if index < 0 or index >= self.count:
+            raise IndexError("BarStore index out of range")
+        return index
+
+    def _grow(self) -> None:
+        self.size *= 2
+        for name in ("datetime_array", "open_array", "high_array", "low_array",
+                     "close_array", "volume_array", "open_interest_array"):
+            old = getattr(self, name)
+            new = np.zeros(self.size, dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def append(self, bar: BarData) -> None:
+        """
+        Append a bar to the end of the store.
+        """
+        if not self.count:
+            self.symbol = bar.symbol
+            self.exchange = bar.exchange
+            self.interval = bar.interval
+            self.tzinfo = bar.datetime.tzinfo
+        self.append_values(bar.datetime, bar.open_price, bar.high_price, bar.low_price, bar.close_price,
+                           bar.volume, bar.open_interest)
+
+    def append_values(
+            self,
+            dt: datetime.datetime,
+            open_price: float,
+            high_price: float,
+            low_price: float,
+            close_price: float,
+            volume: float = 0,
+            open_interest: float = 0
+    ) -> None:
+        """
+        Append a bar given as plain values.
+        """
+        if self.count >= self.size:
+            self._grow()
+        self.count += 1
+        self.set_values(self.count - 1, dt, open_price, high_price, low_price, close_price, volume,
+                        open_interest)
+
+    def extend(self, bars) -> None:
+        """
+        Append a sequence of bars in one pass.
+        """
+        if not bars:
+            return
+        if isinstance(bars, BarStore):
+            # column copy, no BarData is built
+            if not self.count:
+                self.symbol = bars.symbol
+                self.exchange = bars.exchange
+                self.interval = bars.interval
+                self.tzinfo = bars.tzinfo
+            self.extend_arrays(bars.datetime, bars.open, bars.high, bars.low, bars.close, bars.volume,
+                               bars.open_interest)
+            return
+        if not self.count:
+            bar = bars[0]
+            self.symbol = bar.symbol
+            self.exchange = bar.exchange
+            self.interval = bar.interval
+            self.tzinfo = bar.datetime.tzinfo
+        self.extend_arrays(
+            np.array([_wall_time_us(bar.datetime) for bar in bars], dtype="int64"),
+            [bar.open_price for bar in bars],
+            [bar.high_price for bar in bars],
+            [bar.low_price for bar in bars],
+            [bar.close_price for bar in bars],
+            [bar.volume for bar in bars],
+            [bar.open_interest for bar in bars]
+        )
+
+    def extend_arrays(
+            self,
+            dt_array,
+            open_array,
+            high_array,
+            low_array,
+            close_array,
+            volume_array=0,
+            open_interest_array=0
+    ) -> None:
+        """
+        Append columns of bar data, dt_array is datetime64[us] or int64 microseconds since epoch (wall time).
+        """
+        dt_array = np.asarray(dt_array)
+        n = len(dt_array)
+        if not n:
+            return
+        while self.count + n > self.size:
+            self._grow()
+        start, end = self.count, self.count + n
+        self.datetime_array.view("int64")[start:end] = dt_array.astype("datetime64[us]").view("int64") \
+            if dt_array.dtype.kind == "M" else dt_array
+        self.open_array[start:end] = open_array
+        self.high_array[start:end] = high_array
+        self.low_array[start:end] = low_array
+        self.close_array[start:end] = close_array
+        self.volume_array[start:end] = volume_array
+        self.open_interest_array[start:end] = open_interest_array
+        self.count = end
+
+    def bisect_right(self, dt: datetime.datetime) -> int:
+        """
+        Index of the first bar later than dt (wall time).
+        """
+        return int(np.searchsorted(self.datetime_array[:self.count].view("int64"), _wall_time_us(dt), "right"))
+
+    def drop_front(self, n: int) -> None:
+        """
+        Drop the first n bars, later bars move down by n.
+        """
+        n = min(max(n, 0), self.count)
+        if not n:
+            return
+        remain = self.count - n
+        for name in ("datetime_array", "open_array", "high_array", "low_array",
+                     "close_array", "volume_array", "open_interest_array"):
+            array = getattr(self, name)
+            array[:remain] = array[n:self.count]
+        self.count = remain
+
+    def set_bar(self, index: int, bar: BarData) -> None:
+        """
+        Overwrite the bar at index.
+        """
+        self.set_values(self._index(index), bar.datetime, bar.open_price, bar.high_price, bar.low_price,
+                        bar.close_price, bar.volume, bar.open_interest)
+
+    def set_values(
+            self,
+            index: int,
+            dt: datetime.datetime,
+            open_price: float,
+            high_price: float,
+            low_price: float,
+            close_price: float,
+            volume: float = 0,
+            open_interest: float = 0
+    ) -> None:
+        """
+        Overwrite the bar at a non-negative index with plain values.
+        """
+        if dt.tzinfo is not None:
+            dt = dt.replace(tzinfo=None)
+        # write through an int64 view, much cheaper than numpy's datetime conversion
+        self.datetime_array.view("int64")[index] = (dt - EPOCH) // ONE_MICROSECOND
+        self.open_array[index] = open_price
+        self.high_array[index] = high_price
+        self.low_array[index] = low_price
+        self.close_array[index] = close_price
+        self.volume_array[index] = volume
+        self.open_interest_array[index] = open_interest
+
+    def pop(self) -> BarData:
+        """
+        Remove and return the last bar.
+        """
+        bar = self.get_bar(-1)
+        self.count -= 1
+        return bar
+
+    def get_datetime(self, index: int) -> datetime.datetime:
+        """
+        Datetime of the bar at index, with the store's tzinfo.
+        """
+        dt = self.datetime_array.item(self._index(index))
+        if self.tzinfo is not None:
+            dt = dt.replace(tzinfo=self.tzinfo)
+        return dt
+
+    def get_bar(self, index: int) -> BarData:
+        """
+        Build a BarData snapshot of the bar at index.
+        """
+        index = self._index(index)
+        return BarData(
+            symbol=self.symbol,
+            exchange=self.exchange,
+            interval=self.interval,
+            datetime=self.get_datetime(index),
+            open_price=self.open_array.item(index),
+            high_price=self.high_array.item(index),
+            low_price=self.low_array.item(index),
+            close_price=self.close_array.item(index),
+            volume=self.volume_array.item(index),
+            open_interest=self.open_interest_array.item(index)
+        )
+
+    @property
+    def datetime(self) -> np.ndarray:
+        """
+        Get datetime64 time series (wall time).
+        """
+        return self.datetime_array[:self.count]
+
+    @property
+    def open(self) -> np.ndarray:
+        """
+        Get open price time series.
+        """
+        return self.open_array[:self.count]
+
+    @property
+    def high(self) -> np.ndarray:
+        """
+        Get high price time series.
+        """
+        return self.high_array[:self.count]
+
+    @property
+    def low(self) -> np.ndarray:
+        """
+        Get low price time series.
+        """
+        return self.low_array[:self.count]
+
+    @property
+    def close(self) -> np.ndarray:
+        """
+        Get close price time series.
+        """
+        return self.close_array[:self.count]
+
+    @property
+    def volume(self) -> np.ndarray:
+        """
+        Get trading volume time series.
+        """
+        return self.volume_array[:self.count]
+
+    @property
+    def open_interest(self) -> np.ndarray:
+        """
+        Get open interest time series.
+        """
+        return self.open_interest_array[:self.count]
+
+
+class MacdManager(object):
+    """
+    For:
+    1. streaming MACD state (fast/slow EMA, dif, dea, hist) updated once per bar
+    2. replacing the last bar (k line include) without recomputing history
+    3. prefix sums of abs(round(hist, 4)), so the MACD area of any index range is
+       one subtraction
+
+    Notice:
+    values match talib.MACD run over the whole close series (up to float rounding),
+    including its seeding: both EMAs start at index slow-1 from SMAs, dea starts
+    signal-1 bars later from an SMA of dif.
+    """
+
+    def __init__(self, fast_period: int = 12, slow_period: int = 26, signal_period: int = 9):
+        """Constructor"""
+        if slow_period < fast_period:
+            fast_period, slow_period = slow_period, fast_period
+        self.fast_period: int = fast_period
+        self.slow_period: int = slow_period
+        self.signal_period: int = signal_period
+
+        self.fast_k: float = 2.0 / (fast_period + 1)
+        self.slow_k: float = 2.0 / (slow_period + 1)
+        self.signal_k: float = 2.0 / (signal_period + 1)
+
+        # talib.MACD lookback: first dif index and first dea/hist index
+        self.dif_start: int = slow_period - 1
+        self.dea_start: int = self.dif_start + signal_period - 1
+
+        self.close: list = []
+        self.fast: list = []
+        self.slow: list = []
+        self.dif: list = []
+        self.dea: list = []
+        self.hist: list = []
+        # hist_area[i] = sum(abs(round(hist[j], 4)) for dea_start <= j <= i)
+        self.hist_area: list = []
+        # number of bars dropped from the front, list index i is bar offset + i
+        self.offset: int = 0
+
+    def __len__(self) -> int:
+        return len(self.close)
+
+    def __getstate__(self) -> dict:
+        # float lists are kept as float64 arrays, 8 bytes per value when pickled
+        state = self.__dict__.copy()
+        for name in ("close", "fast", "slow", "dif", "dea", "hist", "hist_area"):
+            state[name] = np.array(state[name], dtype=float)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        for name in ("close", "fast", "slow", "dif", "dea", "hist", "hist_area"):
+            setattr(self, name, getattr(self, name).tolist())
+
+    def update(self, close_price: float) -> float:
+        """
+        Append a new bar, return its hist value.
+        """
+        nan = float('nan')
+        i = len(self.close) + self.offset
+        self.close.append(close_price)
+
+        if i < self.dif_start:
+            fast = slow = dif = nan
+        elif i == self.dif_start:
+            fast = self._sma(self.close, self.fast_period)
+            slow = self._sma(self.close, self.slow_period)
+            dif = fast - slow
+        else:
+            fast = ((close_price - self.fast[-1]) * self.fast_k) + self.fast[-1]
+            slow = ((close_price - self.slow[-1]) * self.slow_k) + self.slow[-1]
+            dif = fast - slow
+        self.fast.append(fast)
+        self.slow.append(slow)
+        self.dif.append(dif)
+
+        if i < self.dea_start:
+            dea = nan
+        elif i == self.dea_start:
+            dea = self._sma(self.dif, self.signal_period)
+        else:
+            dea = ((dif - self.dea[-1]) * self.signal_k) + self.dea[-1]
+        self.dea.append(dea)
+
+        hist = dif - dea
+        self.hist.append(hist)
+
+        # warm-up bars contribute 0, so hist_area[dea_start - 1] == 0
+        if i < self.dea_start:
+            self.hist_area.append(0.0)
+        else:
+            self.hist_area.append(self.hist_area[-1] + abs(round(hist, 4)))
+        return hist
+
+    def replace_last(self, close_price: float) -> float:
+        """
+        Replace the close of the last bar, return its new hist value.
+        """
+        if self.close:
+            self.pop()
+        return self.update(close_price)
+
+    def pop(self) -> None:
+        """
+        Drop the last bar.
+        """
+        self.close.pop()
+        self.fast.pop()
+        self.slow.pop()
+        self.dif.pop()
+        self.dea.pop()
+        self.hist.pop()
+        self.hist_area.pop()
+
+    def area(self, start: int, end: int) -> float:
+        """
+        Sum of abs(round(hist, 4)) over bar index [start, end], nan if the range
+        reaches into the warm-up bars.
+        """
+        end = min(end, len(self.hist) - 1)
+        if start > end:
+            return 0.0
+        if start + self.offset < self.dea_start:
+            return float('nan')
+        return round(self.hist_area[end] - self.hist_area[start - 1], 4)
+
+    def drop_front(self, n: int) -> None:
+        """
+        Drop the first n bars, keeping the running sums so that area() over the
+        remaining bars is unchanged (start must stay >= 1 after the drop).
+        """
+        n = min(max(n, 0), len(self.close))
+        if not n:
+            return
+        for name in ("close", "fast", "slow", "dif", "dea", "hist", "hist_area"):
+            del getattr(self, name)[:n]
+        self.offset += n
+
+    def rebuild(self, close_list: list) -> None:
+        """
+        Recompute the whole state from a close series.
+        """
+        self.close = []
+        self.fast = []
+        self.slow = []
+        self.dif = []
+        self.dea = []
+        self.hist = []
+        self.hist_area = []
+        self.offset = 0
+        # warm-up through update, then the same recurrences with local variables
+        warm = min(len(close_list), self.dea_start + 1)
+        for close_price in close_list[:warm]:
+            self.update(close_price)
+        if warm == len(close_list):
+            return
+
+        fast_k, slow_k, signal_k = self.fast_k, self.slow_k, self.signal_k
+        fast, slow, dea, area = self.fast[-1], self.slow[-1], self.dea[-1], self.hist_area[-1]
+        fast_list, slow_list, dif_list = self.fast, self.slow, self.dif
+        dea_list, hist_list, area_list = self.dea, self.hist, self.hist_area
+        for close_price in close_list[warm:]:
+            fast = ((close_price - fast) * fast_k) + fast
+            slow = ((close_price - slow) * slow_k) + slow
+            dif = fast - slow
+            dea = ((dif - dea) * signal_k) + dea
+            hist = dif - dea
+            area = area + abs(round(hist, 4))
+            fast_list.append(fast)
+            slow_list.append(slow)
+            dif_list.append(dif)
+            dea_list.append(dea)
+            hist_list.append(hist)
+            area_list.append(area)
+        self.close.extend(close_list[warm:])
+
+    @staticmethod
+    def _sma(data: list, n: int) -> float:
+        # sum in order, as talib does
+        total = 0.0
+        for v in data[-n:]:
+            total += v
+        return total / n
+
+
 def virtual(func: Callable) -> Callable:
     """
     mark a function as "virtual", which means that this function can be override.